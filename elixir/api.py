@@ -26,9 +26,23 @@ import sys
 
 from .query import get_query
 from .lib import validFamily
-from .web_utils import validate_version
+from .web_utils import validate_version, validate_ident
+
+# Content type of streamed identifier search results, one JSON object per line
+MEDIA_NDJSON = 'application/x-ndjson'
+
+# Yields the results of an identifier search as JSON lines, as they are found
+# in the databases. Closes query when done.
+def stream_ident(query, version, ident, family, path_prefix):
+    try:
+        for kind, path, line, type in query.iter_ident(version, ident, family, path_prefix):
+            yield json.dumps({'kind': kind, 'path': path, 'line': line, 'type': type}).encode() + b'\n'
+    finally:
+        query.close()
 
 class ApiIdentGetterResource:
+    '''Returns the definitions, references and documentation comments of an identifier,
+        as a JSON document or streamed as JSON lines. See "REST API usage" in README.'''
     def on_get(self, req, resp, project, ident):
         version = validate_version(req.get_param('version'))
         if version is None:
@@ -38,6 +52,10 @@ class ApiIdentGetterResource:
         if not validFamily(family):
             family = 'C'
 
+        path_prefix = req.get_param('path', default='').lstrip('/')
+        limit = req.get_param_as_int('limit', min_value=1)
+        after = req.get_param('after')
+
         query = get_query(req.context.config.project_dir, project)
         if not query:
             resp.status = falcon.HTTP_NOT_FOUND
@@ -47,15 +65,109 @@ class ApiIdentGetterResource:
             rc = version == 'latest-rc'
             version = query.get_latest_tag(rc=rc)
 
-        symbol_definitions, symbol_references, symbol_doccomments, _ = query.search_ident(version, ident, family)
+        if req.get_param('format') == 'ndjson':
+            resp.status = falcon.HTTP_200
+            resp.content_type = MEDIA_NDJSON
+            resp.stream = stream_ident(query, version, ident, family, path_prefix)
+            return
+
+        # One more reference is requested to know if there is a next page
+        symbol_definitions, symbol_references, symbol_doccomments, _ = query.search_ident(
+                version, ident, family, path_prefix=path_prefix, cursor=after,
+                limit=limit + 1 if limit is not None else None)
 
         resp.status = falcon.HTTP_200
         resp.content_type = falcon.MEDIA_JSON
         resp.media = {
+            'definitions': [sym.__dict__ for sym in symbol_definitions] if after is None else [],
+            'references': [sym.__dict__ for sym in symbol_references[:limit]],
+            'documentations': [sym.__dict__ for sym in symbol_doccomments] if after is None else []
+        }
+        if limit is not None and len(symbol_references) > limit:
+            resp.media['next'] = symbol_references[limit - 1].path
+
+        query.close()
+
+# Maximum number of identifiers of a batch request
+MAX_BATCH_IDENTS = 1000
+
+# Returns the list of (ident, family) of the body of a batch request
+def parse_batch_idents(body):
+    if not isinstance(body, dict) or not isinstance(body.get('idents'), list):
+        raise falcon.HTTPBadRequest(title='Invalid request body',
+                                    description='The body must be a JSON object with an "idents" list')
+    if len(body['idents']) > MAX_BATCH_IDENTS:
+        raise falcon.HTTPBadRequest(title='Invalid request body',
+                                    description=f'At most {MAX_BATCH_IDENTS} identifiers can be requested at once')
+
+    idents = []
+    for entry in body['idents']:
+        if (not isinstance(entry, dict) or not isinstance(entry.get('ident'), str) or
+                not isinstance(entry.get('family', 'C'), str)):
+            ident = None
+        else:
+            ident = validate_ident(entry['ident'])
+        if ident is None:
+            raise falcon.HTTPBadRequest(title='Invalid request body',
+                                        description='Invalid identifier: ' + json.dumps(entry))
+        family = entry.get('family', 'C')
+        if not validFamily(family):
+            family = 'C'
+        idents.append((ident, family))
+    return idents
+
+# Yields the result object of each identifier of a batch request
+def iter_batch_results(query, version, idents, path_prefix):
+    results = query.search_idents(version, idents, path_prefix)
+    for (ident, family), (symbol_definitions, symbol_references, symbol_doccomments, _) in zip(idents, results):
+        yield {
+            'ident': ident,
+            'family': family,
             'definitions': [sym.__dict__ for sym in symbol_definitions],
             'references': [sym.__dict__ for sym in symbol_references],
             'documentations': [sym.__dict__ for sym in symbol_doccomments]
         }
 
+# Yields the results of a batch request as JSON lines, as they are computed.
+# Closes query when done.
+def stream_batch(query, version, idents, path_prefix):
+    try:
+        for result in iter_batch_results(query, version, idents, path_prefix):
+            yield json.dumps(result).encode() + b'\n'
+    finally:
         query.close()
 
+class ApiIdentsBatchResource:
+    '''Returns the results of ApiIdentGetterResource for several identifiers of
+        a version at once. See "REST API usage" in README.'''
+    def on_post(self, req, resp, project):
+        version = validate_version(req.get_param('version'))
+        if version is None:
+            raise falcon.HTTPInvalidParam('', 'version')
+
+        path_prefix = req.get_param('path', default='').lstrip('/')
+        idents = parse_batch_idents(req.get_media())
+
+        query = get_query(req.context.config.project_dir, project)
+        if not query:
+            resp.status = falcon.HTTP_NOT_FOUND
+            return
+
+        if version in ('latest', 'latest-rc'):
+            rc = version == 'latest-rc'
+            version = query.get_latest_tag(rc=rc)
+
+        if req.get_param('format') == 'ndjson':
+            resp.status = falcon.HTTP_200
+            resp.content_type = MEDIA_NDJSON
+            resp.stream = stream_batch(query, version, idents, path_prefix)
+            return
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = falcon.MEDIA_JSON
+        resp.media = {
+            'version': version,
+            'results': list(iter_batch_results(query, version, idents, path_prefix)),
+        }
+
+        query.close()
@@ -29,6 +29,34 @@ from .query import get_query
 from .web_utils import validate_project, validate_ident
 
 class AutocompleteResource:
+    # Returns the first 10 keys of db starting with query_bytes, for indexes
+    # without an autocomplete index
+    @staticmethod
+    def find_prefix(db, query_bytes, process):
+        response = []
+
+        i = 0
+        cur = db.db.cursor()
+        # Find "the smallest key greater than or equal to the specified key"
+        # https://docs.oracle.com/cd/E17276_01/html/api_reference/C/dbcget.html
+        # In practice this should mean "the key that starts with provided prefix"
+        # See docs about the default comparison function for B-Tree databases:
+        # https://docs.oracle.com/cd/E17276_01/html/api_reference/C/dbset_bt_compare.html
+        result = cur.get(query_bytes, DB_SET_RANGE)
+        while result is not None and i < 10:
+            key, _ = result
+            if key.startswith(query_bytes):
+                # If found key starts with the prefix, add to response
+                # and move to the next key
+                i += 1
+                response.append(process(key.decode("utf-8")))
+                result = cur.next()
+            else:
+                # If found key does not start with the prefix, stop
+                break
+        cur.close()
+        return response
+
     def on_get(self, req, resp):
         ident_prefix = req.get_param('q')
         family = req.get_param('f')
@@ -54,32 +82,19 @@ class AutocompleteResource:
             # DTS identifiers are stored quoted
             process = lambda x: parse.unquote(x)
             db = query.db.comps
+            index = query.db.autocomplete.get('compatibledts')
         else:
             process = lambda x: x
             db = query.db.defs
+            index = query.db.autocomplete.get('definitions')
 
-        response = []
-
-        i = 0
-        cur = db.db.cursor()
         query_bytes = autoBytes(parse.quote(ident_prefix))
-        # Find "the smallest key greater than or equal to the specified key"
-        # https://docs.oracle.com/cd/E17276_01/html/api_reference/C/dbcget.html
-        # In practice this should mean "the key that starts with provided prefix"
-        # See docs about the default comparison function for B-Tree databases:
-        # https://docs.oracle.com/cd/E17276_01/html/api_reference/C/dbset_bt_compare.html
-        result = cur.get(query_bytes, DB_SET_RANGE)
-        while result is not None and i < 10:
-            key, _ = result
-            if key.startswith(query_bytes):
-                # If found key starts with the prefix, add to response
-                # and move to the next key
-                i += 1
-                response.append(process(key.decode("utf-8")))
-                result = cur.next()
-            else:
-                # If found key does not start with the prefix, stop
-                break
+
+        if index is not None:
+            # Ranked prefix, case-insensitive and substring matches, see data.AutocompleteIndex
+            response = [process(key.decode("utf-8")) for key in index.search(query_bytes, 10)]
+        else:
+            response = self.find_prefix(db, query_bytes, process)
 
         resp.status = falcon.HTTP_200
         resp.content_type = falcon.MEDIA_JSON
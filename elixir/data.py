@@ -20,13 +20,29 @@
 
 import berkeleydb
 import re
+import sys
+import bisect
+from array import array
+from itertools import accumulate, chain, groupby
+import heapq
+import mmap
+import pickle
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from urllib import parse
 from . import lib
 import os
 import os.path
 import errno
+import logging
+
+logger = logging.getLogger(__name__)
 
 deflist_regex = re.compile(rb'(\d*)(\w)(\d*)(\w),?')
-deflist_macro_regex = re.compile(r'\dM\d+(\w)')
 
 ##################################################################################
 
@@ -52,102 +68,1044 @@ defTypeD = {v: k for k, v in defTypeR.items()}
 
 maxId = 999999999
 
+##################################################################################
+
+# Binary encoding of DefList, PathList and RefList values
+#
+# The legacy format is ASCII text, parsed with regexes on every read. Binary values
+# start with a marker byte, that can't start a text value, and the format version.
+# Entries are kept sorted by blob ID, so that readers don't have to sort them.
+#
+# Values are stored by columns. A column of integers is a byte with the width of its
+# values (1, 2 or 4 bytes), followed by the values as little-endian integers.
+# Blob IDs are delta-coded, and so are line numbers of a single reference entry.
+# Fixed-width columns are used instead of per-value varints, so that they can be
+# decoded with array and itertools.accumulate instead of byte by byte in Python.
+
+BINARY_MARKER = 0xff
+BINARY_VERSION = 1
+
+# Marker of PathListDelta values
+DELTA_MARKER = 0xfe
+
+column_types = {1: 'B', 2: 'H', 4: 'I'}
+assert array('I').itemsize == 4
+
+def is_binary(data):
+    return len(data) != 0 and data[0] == BINARY_MARKER
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+def encode_column(values, out):
+    max_value = max(values, default=0)
+    if max_value < 1 << 8:
+        width = 1
+    elif max_value < 1 << 16:
+        width = 2
+    else:
+        width = 4
+
+    column = array(column_types[width], values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    out.append(width)
+    out += column.tobytes()
+
+# Returns decoded column and position of the first byte after it
+def decode_column(data, pos, count):
+    width = data[pos]
+    pos += 1
+    end = pos + count*width
+    column = array(column_types[width])
+    column.frombytes(data[pos:end])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column, end
+
+# Returns count values of the column at pos, starting from value start
+def decode_column_slice(data, pos, start, count):
+    width = data[pos]
+    pos += 1 + start*width
+    column = array(column_types[width])
+    column.frombytes(data[pos:pos + count*width])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def encode_header(count):
+    out = bytearray((BINARY_MARKER, BINARY_VERSION))
+    encode_varint(count, out)
+    return out
+
+# Returns number of entries and position of the first byte after the header
+def decode_header(data):
+    if data[1] != BINARY_VERSION:
+        raise ValueError(f'unsupported binary format version: {data[1]}')
+    return decode_varint(data, 2)
+
+def delta_encode(values):
+    return [b - a for a, b in zip(chain((0,), values), values)]
+
+def zigzag_encode(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+def zigzag_decode(value):
+    return value >> 1 if value & 1 == 0 else -((value + 1) >> 1)
+
+# Returns the position where an entry with blob ID id should be inserted
+# so that ids stays sorted. Entries are usually appended in order.
+def insert_position(ids, id):
+    if len(ids) == 0 or ids[-1] <= id:
+        return len(ids)
+    return bisect.bisect_right(ids, id)
+
 class DefList:
     '''Stores associations between a blob ID, a type (e.g., "function"),
         a line number and a file family.
         Also stores in which families the ident exists for faster tests.'''
-    def __init__(self, data=b'#'):
-        self.data, self.families = data.split(b'#')
+    def __init__(self, data=b''):
+        self.data = data
+        self.decoded = False
+
+    def decode(self):
+        if self.decoded:
+            return
+
+        self.ids, self.types, self.lines, self.entry_families = [], [], [], []
+
+        if is_binary(self.data):
+            count, pos = decode_header(self.data)
+            length, pos = decode_varint(self.data, pos)
+            self.families = self.data[pos:pos+length].decode()
+            pos += length
+            ids, pos = decode_column(self.data, pos, count)
+            self.ids = list(accumulate(ids))
+            self.types = list(self.data[pos:pos+count].decode())
+            pos += count
+            lines, pos = decode_column(self.data, pos, count)
+            self.lines = list(lines)
+            self.entry_families = list(self.data[pos:pos+count].decode())
+        elif len(self.data) != 0:
+            data, families = self.data.split(b'#')
+            self.families = families.decode().replace(',', '')
+            entries = deflist_regex.findall(data)
+            entries.sort(key=lambda x:int(x[0]))
+            for id, type, line, family in entries:
+                self.ids.append(int(id))
+                self.types.append(type.decode())
+                self.lines.append(int(line))
+                self.entry_families.append(family.decode())
+        else:
+            self.families = ''
+
+        self.decoded = True
 
     def iter(self, dummy=False):
-        # Get all element in a list of sublists and sort them
-        entries = deflist_regex.findall(self.data)
-        entries.sort(key=lambda x:int(x[0]))
-        for id, type, line, family in entries:
-            id = int(id)
-            type = defTypeR [type.decode()]
-            line = int(line)
-            family = family.decode()
-            yield id, type, line, family
+        self.decode()
+        for id, type, line, family in zip(self.ids, self.types, self.lines, self.entry_families):
+            yield id, defTypeR[type], line, family
         if dummy:
             yield maxId, None, None, None
 
     def append(self, id, type, line, family):
         if type not in defTypeD:
             return
-        p = str(id) + defTypeD[type] + str(line) + family
-        if self.data != b'':
-            p = ',' + p
-        self.data += p.encode()
+        self.decode()
+        pos = insert_position(self.ids, id)
+        self.ids.insert(pos, id)
+        self.types.insert(pos, defTypeD[type])
+        self.lines.insert(pos, line)
+        self.entry_families.insert(pos, family)
         self.add_family(family)
+        self.data = None
 
     def pack(self):
-        return self.data + b'#' + self.families
+        if self.data is not None and is_binary(self.data):
+            return self.data
+
+        self.decode()
+        out = encode_header(len(self.ids))
+        families = self.families.encode()
+        encode_varint(len(families), out)
+        out += families
+        encode_column(delta_encode(self.ids), out)
+        out += ''.join(self.types).encode()
+        encode_column(self.lines, out)
+        out += ''.join(self.entry_families).encode()
+        self.data = bytes(out)
+        return self.data
 
     def add_family(self, family):
-        family = family.encode()
-        if not family in self.families.split(b','):
-            if self.families != b'':
-                family = b',' + family
+        self.decode()
+        if family not in self.families:
             self.families += family
 
     def get_families(self):
-        return self.families.decode().split(',')
+        self.decode()
+        return list(self.families)
 
     def get_macros(self):
-        return deflist_macro_regex.findall(self.data.decode()) or ''
+        self.decode()
+        return [family for type, family in zip(self.types, self.entry_families) if type == 'M'] or ''
+
+    # Returns the type letters of all entries, see defTypeR
+    def get_types(self):
+        self.decode()
+        return self.types
 
 class PathList:
     '''Stores associations between a blob ID and a file path.
         Inserted by update.py sorted by blob ID.'''
     def __init__(self, data=b''):
         self.data = data
+        self.decoded = False
+
+    def decode(self):
+        if self.decoded:
+            return
+
+        if is_binary(self.data):
+            count, pos = decode_header(self.data)
+            ids, pos = decode_column(self.data, pos, count)
+            self.ids = list(accumulate(ids))
+            lengths, pos = decode_column(self.data, pos, count)
+            self.offsets = list(accumulate(lengths, initial=pos))
+        else:
+            self.ids = []
+            self.offsets = [0]
+            # Legacy entries are stored in the same way as binary ones:
+            # path of entry n is self.data[offsets[n]:offsets[n+1]]
+            paths = bytearray()
+            for p in self.data.split(b'\n')[:-1]:
+                id, path = p.split(b' ',maxsplit=1)
+                self.ids.append(int(id))
+                paths += path
+                self.offsets.append(len(paths))
+            self.data = bytes(paths)
+
+        self.decoded = True
+
+    # Returns the list of blob IDs, sorted
+    def get_ids(self):
+        self.decode()
+        return self.ids
+
+    # Returns path of entry n
+    def get_path(self, n):
+        return bytes(self.data[self.offsets[n]:self.offsets[n+1]]).decode()
+
+    # Returns path of entry n, without decoding the whole list if possible
+    # hint: (index, position) of an entry before n and of its path in the paths of the list
+    def get_path_at(self, n, hint):
+        if self.decoded or not is_binary(self.data):
+            self.decode()
+            return self.get_path(n)
+
+        if not hasattr(self, 'paths_pos'):
+            count, pos = decode_header(self.data)
+            # Skip blob IDs
+            pos += 1 + count*self.data[pos]
+            self.lengths_pos = pos
+            self.paths_pos = pos + 1 + count*self.data[pos]
+
+        first, offset = hint
+        lengths = decode_column_slice(self.data, self.lengths_pos, first, n - first + 1)
+        start = self.paths_pos + offset + sum(lengths[:-1])
+        return bytes(self.data[start:start+lengths[-1]]).decode()
 
     def iter(self, dummy=False):
-        for p in self.data.split(b'\n')[:-1]:
-            id, path = p.split(b' ',maxsplit=1)
-            id = int(id)
-            path = path.decode()
-            yield id, path
+        self.decode()
+        for n, id in enumerate(self.ids):
+            yield id, self.get_path(n)
         if dummy:
             yield maxId, None
 
     def append(self, id, path):
-        p = str(id).encode() + b' ' + path + b'\n'
-        self.data += p
+        self.decode()
+        if len(self.ids) != 0 and self.ids[-1] > id:
+            raise ValueError('PathList entries must be appended sorted by blob ID')
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data[:self.offsets[-1]])
+        self.ids.append(id)
+        self.data += path
+        self.offsets.append(len(self.data))
 
     def pack(self):
-        return self.data
+        self.decode()
+        out = encode_header(len(self.ids))
+        encode_column(delta_encode(self.ids), out)
+        encode_column([b - a for a, b in zip(self.offsets, self.offsets[1:])], out)
+        out += self.data[self.offsets[0]:self.offsets[-1]]
+        return bytes(out)
+
+# Returns a PathList or a PathListDelta, depending on the format of data
+def decode_versions_value(data):
+    if is_delta(data):
+        return PathListDelta(data)
+    return PathList(data)
+
+def is_delta(data):
+    return len(data) != 0 and data[0] == DELTA_MARKER
+
+class PathListDelta:
+    '''Stores the files of a version as the entries removed from and added to
+        the files of another version, its base. Bases can be deltas themselves,
+        depth is the number of deltas to apply to get the files of this version.'''
+    def __init__(self, data=b'', base=b'', depth=1):
+        if len(data) != 0:
+            if data[1] != BINARY_VERSION:
+                raise ValueError(f'unsupported binary format version: {data[1]}')
+            self.depth, pos = decode_varint(data, 2)
+            length, pos = decode_varint(data, pos)
+            self.base = data[pos:pos+length]
+            pos += length
+            length, pos = decode_varint(data, pos)
+            self.removed = PathList(data[pos:pos+length])
+            self.added = PathList(data[pos+length:])
+        else:
+            self.base = base
+            self.depth = depth
+            self.removed = PathList()
+            self.added = PathList()
+
+    # Returns the PathList of this version, given the PathList of its base
+    def apply(self, base):
+        removed = set(self.removed.iter())
+        entries = (entry for entry in base.iter() if entry not in removed)
+
+        obj = PathList()
+        for id, path in heapq.merge(entries, self.added.iter()):
+            obj.append(id, path.encode())
+        return obj
+
+    def pack(self):
+        out = bytearray((DELTA_MARKER, BINARY_VERSION))
+        encode_varint(self.depth, out)
+        encode_varint(len(self.base), out)
+        out += self.base
+        removed = self.removed.pack()
+        encode_varint(len(removed), out)
+        out += removed
+        out += self.added.pack()
+        return bytes(out)
+
+class BlobSet:
+    '''Stores the set of blob IDs of a version as a roaring bitmap: IDs are
+        grouped by their upper 16 bits, and the lower 16 bits of each group are
+        stored as a sorted array, or as a bitmap for groups of more than 4096 IDs.
+        Also stores where the entries of each group are in the PathList of the
+        version, so that the paths of a blob can be read without decoding the list.
+        Built by update.py from all the PathList entries, sorted by blob ID.'''
+    # Arrays of more IDs would be larger than a bitmap
+    array_limit = 4096
+    bitmap_size = 1 << 13
+
+    def __init__(self, data=b''):
+        self.data = data
+        self.decoded = False
+        # [upper bits, lower bits of the entries, bytes of their paths] of appended groups
+        self.groups = []
+
+    def decode(self):
+        if self.decoded:
+            return
+
+        if len(self.data) != 0:
+            count, pos = decode_header(self.data)
+            self.keys, pos = decode_column(self.data, pos, count)
+            # Number of PathList entries, distinct IDs and bytes of paths in each group
+            self.entries, pos = decode_column(self.data, pos, count)
+            self.distinct, pos = decode_column(self.data, pos, count)
+            path_sizes, pos = decode_column(self.data, pos, count)
+        else:
+            self.keys, self.entries, self.distinct, path_sizes, pos = [], [], [], [], 0
+
+        # Position of the first entry and of its path in the PathList, and of
+        # the data of each group in this value
+        self.first_entries = list(accumulate(self.entries, initial=0))
+        self.path_offsets = list(accumulate(path_sizes, initial=0))
+        self.data_offsets = list(accumulate((self.get_data_size(c) for c in range(len(self.keys))),
+                                            initial=pos))
+        self.lows = {}
+        self.decoded = True
+
+    def get_data_size(self, c):
+        if self.distinct[c] <= self.array_limit:
+            return 2*self.entries[c]
+        return self.bitmap_size + 2*(self.entries[c] - self.distinct[c])
+
+    @staticmethod
+    def decode_lows(data):
+        lows = array('H')
+        lows.frombytes(data)
+        if sys.byteorder == 'big':
+            lows.byteswap()
+        return lows
+
+    # Returns the array of lower bits of group c, or its bitmap and the array of
+    # lower bits of the entries of a blob after its first one
+    def get_lows(self, c):
+        if c not in self.lows:
+            data = self.data[self.data_offsets[c]:self.data_offsets[c+1]]
+            if self.distinct[c] <= self.array_limit:
+                self.lows[c] = (None, self.decode_lows(data))
+            else:
+                self.lows[c] = (int.from_bytes(data[:self.bitmap_size], 'little'),
+                                self.decode_lows(data[self.bitmap_size:]))
+        return self.lows[c]
+
+    # Returns (start, end, hint): the entries of blob id in the PathList are
+    # start to end (excluded), hint is to be passed to PathList.get_path_at
+    def find(self, id):
+        self.decode()
+        key, low = id >> 16, id & 0xffff
+        c = bisect.bisect_left(self.keys, key)
+        if c == len(self.keys) or self.keys[c] != key:
+            return 0, 0, None
+
+        bitmap, lows = self.get_lows(c)
+        if bitmap is None:
+            start = bisect.bisect_left(lows, low)
+            end = bisect.bisect_right(lows, low, lo=start)
+        elif (bitmap >> low) & 1:
+            dup_start = bisect.bisect_left(lows, low)
+            dup_end = bisect.bisect_right(lows, low, lo=dup_start)
+            start = (bitmap & ((1 << low) - 1)).bit_count() + dup_start
+            end = start + 1 + dup_end - dup_start
+        else:
+            return 0, 0, None
+
+        first = self.first_entries[c]
+        return first + start, first + end, (first, self.path_offsets[c])
+
+    def append(self, id, path):
+        key, low = id >> 16, id & 0xffff
+        if len(self.groups) != 0 and (key, low) < (self.groups[-1][0], self.groups[-1][1][-1]):
+            raise ValueError('BlobSet entries must be appended sorted by blob ID')
+        if len(self.groups) == 0 or self.groups[-1][0] != key:
+            self.groups.append([key, [], 0])
+        self.groups[-1][1].append(low)
+        self.groups[-1][2] += len(path)
+
+    def pack(self):
+        if len(self.groups) == 0:
+            return bytes(self.data)
+
+        distinct = [len(set(lows)) for _, lows, _ in self.groups]
+        out = encode_header(len(self.groups))
+        encode_column([key for key, _, _ in self.groups], out)
+        encode_column([len(lows) for _, lows, _ in self.groups], out)
+        encode_column(distinct, out)
+        encode_column([path_size for _, _, path_size in self.groups], out)
+
+        for (_, lows, _), group_distinct in zip(self.groups, distinct):
+            if group_distinct > self.array_limit:
+                bitmap = 0
+                for low in lows:
+                    bitmap |= 1 << low
+                out += bitmap.to_bytes(self.bitmap_size, 'little')
+                # Entries of a blob after its first one
+                lows = [low for prev, low in zip(chain((None,), lows), lows) if low == prev]
+
+            lows = array('H', lows)
+            if sys.byteorder == 'big':
+                lows.byteswap()
+            out += lows.tobytes()
+
+        return bytes(out)
 
 class RefList:
     '''Stores a mapping from blob ID to list of lines
         and the corresponding family.'''
     def __init__(self, data=b''):
         self.data = data
+        self.decoded = False
+
+    def decode(self):
+        if self.decoded:
+            return
+
+        if is_binary(self.data):
+            count, pos = decode_header(self.data)
+            ids, pos = decode_column(self.data, pos, count)
+            self.ids = list(accumulate(ids))
+            self.families = self.data[pos:pos+count].decode()
+            pos += count
+            line_counts, pos = decode_column(self.data, pos, count)
+            # Line numbers of entry n are lines[line_offsets[n]:line_offsets[n+1]]
+            self.line_offsets = list(accumulate(line_counts, initial=0))
+            self.lines, pos = decode_column(self.data, pos, self.line_offsets[-1])
+        else:
+            entries = [x.split(b':') for x in self.data.split(b'\n')[:-1]]
+            entries.sort(key=lambda x:int(x[0]))
+            self.ids = [int(id) for id, _, _ in entries]
+            self.families = ''.join(family.decode() for _, _, family in entries)
+            self.line_offsets = [0]
+            self.lines = []
+            for _, lines, _ in entries:
+                self.lines += self.encode_lines(lines.decode())
+                self.line_offsets.append(len(self.lines))
+
+        self.decoded = True
+
+    @staticmethod
+    def encode_lines(lines):
+        lines = [int(l) for l in lines.split(',')]
+        return [zigzag_encode(b - a) for a, b in zip(chain((0,), lines), lines)]
+
+    # Returns the list of blob IDs, sorted
+    def get_ids(self):
+        self.decode()
+        return self.ids
+
+    # Returns the number of entries, without decoding binary values
+    def count(self):
+        if not self.decoded and is_binary(self.data):
+            return decode_header(self.data)[0]
+        return len(self.get_ids())
+
+    # Returns the family of entry n
+    def get_family(self, n):
+        return self.families[n]
+
+    # Returns the lines of entry n, separated by commas
+    def get_lines(self, n):
+        deltas = self.lines[self.line_offsets[n]:self.line_offsets[n+1]]
+        return ','.join(map(str, accumulate(map(zigzag_decode, deltas))))
 
     def iter(self, dummy=False):
-        # Split all elements in a list of sublists and sort them
-        entries = [x.split(b':') for x in self.data.split(b'\n')[:-1]]
-        entries.sort(key=lambda x:int(x[0]))
-        for b, c, d in entries:
-            b = int(b.decode())
-            c = c.decode()
-            d = d.decode()
-            yield b, c, d
+        self.decode()
+        for n, id in enumerate(self.ids):
+            yield id, self.get_lines(n), self.families[n]
         if dummy:
             yield maxId, None, None
 
     def append(self, id, lines, family):
-        p = str(id) + ':' + lines + ':' + family + '\n'
-        self.data += p.encode()
+        self.decode()
+        if not isinstance(self.lines, list):
+            self.lines = list(self.lines)
+
+        encoded_lines = self.encode_lines(lines)
+        pos = insert_position(self.ids, id)
+        if pos == len(self.ids):
+            self.ids.append(id)
+            self.families += family
+            self.lines += encoded_lines
+            self.line_offsets.append(len(self.lines))
+        else:
+            start = self.line_offsets[pos]
+            self.ids.insert(pos, id)
+            self.families = self.families[:pos] + family + self.families[pos:]
+            self.lines[start:start] = encoded_lines
+            self.line_offsets.insert(pos, start)
+            for n in range(pos+1, len(self.line_offsets)):
+                self.line_offsets[n] += len(encoded_lines)
 
     def pack(self):
-        return self.data
+        self.decode()
+        out = encode_header(len(self.ids))
+        encode_column(delta_encode(self.ids), out)
+        out += self.families.encode()
+        encode_column([b - a for a, b in zip(self.line_offsets, self.line_offsets[1:])], out)
+        encode_column(self.lines, out)
+        return bytes(out)
+
+class TokenList:
+    '''Stores the positions of the identifiers of a blob, so that the web server
+        can mark the ones that have a definition without tokenizing the blob again.
+        Identifiers are numbered in order of first appearance. For each of them,
+        stores whether it was in the definitions cache of the family of the blob
+        when the list was created, at definitions cache generation "generation".
+        end is the length of the tokenized code, see tokenizer.split_tokens.'''
+    def __init__(self, data=b'', family='', end=0):
+        self.data = data
+        self.decoded = False
+        if len(data) == 0:
+            self.family = family
+            self.generation = 0
+            self.end = end
+            # Number of the identifier of each token, and bytes since the end of the previous one
+            self.numbers = []
+            self.gaps = []
+            self.lengths = []
+            self.defined = []
+            self.first_offsets = []
+            self.idents = {}
+            self.last_end = 0
+            self.decoded = True
+
+    def decode(self):
+        if self.decoded:
+            return
+
+        count, pos = decode_header(self.data)
+        self.family = chr(self.data[pos])
+        self.generation, pos = decode_varint(self.data, pos + 1)
+        self.end, pos = decode_varint(self.data, pos)
+        idents_count, pos = decode_varint(self.data, pos)
+        self.gaps, pos = decode_column(self.data, pos, count)
+        self.numbers, pos = decode_column(self.data, pos, count)
+        self.lengths, pos = decode_column(self.data, pos, idents_count)
+        self.defined, pos = decode_column(self.data, pos, idents_count)
+
+        self.first_offsets = [None] * idents_count
+        offset = 0
+        for gap, n in zip(self.gaps, self.numbers):
+            offset += gap
+            if self.first_offsets[n] is None:
+                self.first_offsets[n] = offset
+            offset += self.lengths[n]
+
+        self.decoded = True
+
+    def get_family(self):
+        self.decode()
+        return self.family
+
+    # Returns the number of the identifier of each token and its offset in the blob
+    def iter(self):
+        self.decode()
+        offset = 0
+        for gap, n in zip(self.gaps, self.numbers):
+            offset += gap
+            yield n, offset
+            offset += self.lengths[n]
+
+    # Returns identifier n, read from code
+    def get_ident(self, code, n):
+        self.decode()
+        offset = self.first_offsets[n]
+        return code[offset:offset+self.lengths[n]]
+
+    def append(self, offset, ident):
+        if offset < self.last_end:
+            raise ValueError('TokenList entries must be appended sorted by offset')
+
+        n = self.idents.get(ident)
+        if n is None:
+            n = len(self.lengths)
+            self.idents[ident] = n
+            self.lengths.append(len(ident))
+            self.defined.append(0)
+            self.first_offsets.append(offset)
+        self.numbers.append(n)
+        self.gaps.append(offset - self.last_end)
+        self.last_end = offset + len(ident)
+
+    # Returns the identifiers of the list, in order of numbers
+    def get_idents(self):
+        return list(self.idents.keys())
+
+    def pack(self):
+        self.decode()
+        out = encode_header(len(self.numbers))
+        out.append(ord(self.family))
+        encode_varint(self.generation, out)
+        encode_varint(self.end, out)
+        encode_varint(len(self.lengths), out)
+        encode_column(self.gaps, out)
+        encode_column(self.numbers, out)
+        encode_column(self.lengths, out)
+        encode_column(self.defined, out)
+        return bytes(out)
+
+class PathIndex:
+    '''Set of the paths of the files of a version, and of their directories,
+        stored in a file that is memory-mapped, so that all processes share
+        the same pages. The file starts with a header, followed by a hash table
+        of (hash, offset) slots, and the sorted paths, each followed by a newline.
+        Paths are looked up with open addressing, empty slots have an offset of 0.'''
+    magic = b'ELXPI001'
+    header = struct.Struct('<8sII')
+    slot = struct.Struct('<II')
+
+    def __init__(self, mm):
+        self.mm = mm
+        _, self.slot_count, self.count = self.header.unpack_from(mm, 0)
+        self.strings_start = self.header.size + self.slot_count * self.slot.size
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(cls.magic)] != cls.magic:
+            mm.close()
+            raise ValueError('invalid path index ' + filename)
+        return cls(mm)
+
+    def __contains__(self, path):
+        path = lib.autoBytes(path)
+        hash = zlib.crc32(path)
+        mask = self.slot_count - 1
+        n = hash & mask
+        size = len(path)
+        while True:
+            slot_hash, offset = self.slot.unpack_from(self.mm, self.header.size + n*self.slot.size)
+            if offset == 0:
+                return False
+            if slot_hash == hash:
+                # Offsets start at 1, so that 0 marks empty slots
+                start = self.strings_start + offset - 1
+                if self.mm[start:start+size] == path and self.mm[start+size] == ord('\n'):
+                    return True
+            n = (n + 1) & mask
+
+    def close(self):
+        self.mm.close()
+
+    # Returns the contents of a path index file containing paths, an iterable of bytes
+    @classmethod
+    def pack(cls, paths):
+        paths = sorted(set(paths))
+        # At most half of the slots are used
+        slot_count = 2
+        while slot_count < 2*len(paths):
+            slot_count *= 2
+        mask = slot_count - 1
+
+        slots = bytearray(slot_count * cls.slot.size)
+        strings = bytearray()
+        for path in paths:
+            hash = zlib.crc32(path)
+            n = hash & mask
+            while cls.slot.unpack_from(slots, n*cls.slot.size)[1] != 0:
+                n = (n + 1) & mask
+            cls.slot.pack_into(slots, n*cls.slot.size, hash, len(strings) + 1)
+            strings += path + b'\n'
+
+        return cls.header.pack(cls.magic, slot_count, len(paths)) + slots + strings
+
+# Returns the paths of files and of their parent directories to store in a PathIndex
+# entries: (id, path) tuples of the files of a version
+def get_indexed_paths(entries):
+    last_dir = None
+    for _, path in entries:
+        path = lib.autoBytes(path)
+        dirname = os.path.dirname(path)
+        if dirname != last_dir:
+            last_dir = dirname
+            yield dirname
+        yield path
+
+# Weight of a key of an autocomplete index, by its most important definition type.
+# The score of a key is (number of references + 1) * weight.
+autocomplete_type_weights = {
+    'c': 4, 'd': 4, 'e': 4, 'f': 4, 'M': 4, 's': 4, 't': 4, 'u': 4,
+    'E': 2, 'p': 2, 'v': 2, 'x': 2,
+    'l': 1, 'm': 1}
+
+# Returns the positions of the words of key: its start, characters following
+# characters other than letters and digits or a %XX escape (quoted keys), and
+# uppercase letters following lowercase ones
+def get_word_starts(key):
+    starts = [0]
+    for i in range(1, len(key)):
+        previous, current = key[i-1:i], key[i:i+1]
+        if (not previous.isalnum() or (i >= 3 and key[i-3] == ord('%')) or
+                (previous.islower() and current.isupper())):
+            starts.append(i)
+    return starts
+
+class AutocompleteIndex:
+    '''Keys of a database, with a score telling how often they are used, stored in
+        a file that is memory-mapped, so that all processes share the same pages.
+        The file starts with a header, followed by arrays of integers in native
+        byte order: offsets of the sorted keys, their counts and scores, a tree
+        of the positions of the best scores, then the suffixes of the keys in
+        lowercase starting at each word (see get_word_starts), sorted, the keys
+        they belong to, and the tree of their best scores. Then come the weights
+        (one byte per key), the keys and the keys in lowercase, each followed by
+        a newline.
+        In a tree of n positions, node k is the best position of nodes 2k and 2k+1,
+        and node n+i is position i, so that the best key of any range of positions
+        is found by looking at O(log n) nodes.'''
+    magic = b'ELXAC001'
+    # The byte order mark is written in native order, indexes written on a host
+    # with another byte order are refused
+    byte_order_mark = 0x01020304
+    header = struct.Struct('=8sIIII')
+
+    def __init__(self, mm):
+        self.mm = mm
+        _, _, self.count, self.suffix_count, strings_size = self.header.unpack_from(mm, 0)
+        self.views = [memoryview(mm)]
+        pos = self.header.size
+
+        def column(length):
+            nonlocal pos
+            view = self.views[0][pos:pos+4*length].cast('I')
+            self.views.append(view)
+            pos += 4*length
+            return view
+
+        self.offsets = column(self.count + 1)
+        self.counts = column(self.count)
+        self.scores = column(self.count)
+        self.tree = column(2*self.count)
+        self.suffixes = column(self.suffix_count)
+        self.suffix_keys = column(self.suffix_count)
+        self.suffix_tree = column(2*self.suffix_count)
+        self.weights_start = pos
+        self.strings_start = self.weights_start + self.count
+        self.lower_start = self.strings_start + strings_size
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order_mark = cls.header.unpack_from(mm, 0)[:2]
+        if magic != cls.magic or byte_order_mark != cls.byte_order_mark:
+            mm.close()
+            raise ValueError('invalid autocomplete index ' + filename)
+        return cls(mm)
+
+    def close(self):
+        # The mapping can't be closed while there are views on it
+        for view in reversed(self.views):
+            view.release()
+        self.mm.close()
+
+    def get_key(self, i):
+        return self.mm[self.strings_start + self.offsets[i]:self.strings_start + self.offsets[i+1] - 1]
+
+    # Yields (key, count, weight) of all keys, sorted
+    def iter(self):
+        for i in range(self.count):
+            yield self.get_key(i), self.counts[i], self.mm[self.weights_start + i]
+
+    # Returns the first position in the sorted keys (suffixes=False) or suffixes
+    # whose string is greater than or equal to prefix, or with after, greater than
+    # all strings starting with prefix
+    def bisect(self, suffixes, prefix, after):
+        size = len(prefix)
+        lo, hi = 0, self.suffix_count if suffixes else self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if suffixes:
+                i = self.suffix_keys[mid]
+                start = self.lower_start + self.suffixes[mid]
+                end = self.lower_start + self.offsets[i+1] - 1
+            else:
+                start = self.strings_start + self.offsets[mid]
+                end = self.strings_start + self.offsets[mid+1] - 1
+            string = self.mm[start:min(start + size, end)]
+            if string < prefix or (after and string == prefix):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Returns the index of the key of a position of the sorted keys or suffixes
+    def get_index(self, suffixes, pos):
+        return self.suffix_keys[pos] if suffixes else pos
+
+    # Returns the best position in [lo, hi) of the sorted keys or suffixes.
+    # Ties are broken in favor of the first position.
+    def best(self, suffixes, lo, hi):
+        tree = self.suffix_tree if suffixes else self.tree
+        size = self.suffix_count if suffixes else self.count
+        best, best_score = -1, -1
+        lo += size
+        hi += size
+        while lo < hi:
+            if lo & 1:
+                candidates = (tree[lo],)
+                lo += 1
+            else:
+                candidates = ()
+            if hi & 1:
+                hi -= 1
+                candidates += (tree[hi],)
+            for pos in candidates:
+                score = self.scores[self.get_index(suffixes, pos)]
+                if score > best_score or (score == best_score and pos < best):
+                    best, best_score = pos, score
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    # Yields the indexes of the keys of positions [lo, hi) of the sorted keys or
+    # suffixes by decreasing score. Keys with several suffixes are yielded several times.
+    def iter_best(self, suffixes, lo, hi):
+        heap = []
+
+        def push(lo, hi):
+            if lo < hi:
+                pos = self.best(suffixes, lo, hi)
+                i = self.get_index(suffixes, pos)
+                heapq.heappush(heap, (-self.scores[i], pos, i, lo, hi))
+
+        push(lo, hi)
+        while heap:
+            _, pos, i, lo, hi = heapq.heappop(heap)
+            yield i
+            push(lo, pos)
+            push(pos+1, hi)
+
+    # Returns at most limit keys matching query: keys starting with query, then keys
+    # with a word starting with query when ignoring case, see get_word_starts.
+    # Keys of each group are sorted by decreasing score.
+    def search(self, query, limit):
+        query = lib.autoBytes(query)
+        found = []
+
+        lo = self.bisect(False, query, False)
+        hi = self.bisect(False, query, True)
+        for i in self.iter_best(False, lo, hi):
+            if len(found) == limit:
+                break
+            found.append(i)
+
+        if len(found) < limit:
+            lower = query.lower()
+            lo = self.bisect(True, lower, False)
+            hi = self.bisect(True, lower, True)
+            for i in self.iter_best(True, lo, hi):
+                if len(found) == limit:
+                    break
+                if i not in found:
+                    found.append(i)
+
+        return [self.get_key(i) for i in found]
+
+    # Returns the contents of an autocomplete index file containing entries,
+    # an iterable of (key, count, weight) sorted by key
+    @classmethod
+    def pack(cls, entries):
+        keys, counts, weights = [], array('I'), bytearray()
+        for key, count, weight in entries:
+            keys.append(key)
+            counts.append(min(count, 0xffffffff))
+            weights.append(weight)
+
+        strings = b''.join(key + b'\n' for key in keys)
+        lower_strings = strings.lower()
+        offsets = array('I', accumulate((len(key) + 1 for key in keys), initial=0))
+        scores = array('I', (min((count + 1) * weight, 0xffffffff)
+                             for count, weight in zip(counts, weights)))
+
+        suffixes = []
+        for i, key in enumerate(keys):
+            for start in get_word_starts(key):
+                suffixes.append((lower_strings[offsets[i] + start:offsets[i+1] - 1], offsets[i] + start, i))
+        suffixes.sort()
+
+        def build_tree(indexes):
+            n = len(indexes)
+            value = lambda pos: scores[indexes[pos]]
+            tree = array('I', bytes(4*n)) + array('I', range(n))
+            for k in range(n-1, 0, -1):
+                left, right = tree[2*k], tree[2*k+1]
+                if value(left) > value(right) or (value(left) == value(right) and left < right):
+                    tree[k] = left
+                else:
+                    tree[k] = right
+            return tree
+
+        suffix_keys = array('I', (i for _, _, i in suffixes))
+        columns = (offsets, counts, scores, build_tree(range(len(keys))),
+                   array('I', (start for _, start, _ in suffixes)), suffix_keys, build_tree(suffix_keys))
+
+        out = bytearray(cls.header.pack(cls.magic, cls.byte_order_mark, len(keys), len(suffixes), len(strings)))
+        for column in columns:
+            out += column.tobytes()
+        out += weights
+        out += strings
+        out += lower_strings
+        return bytes(out)
+
+# Rough memory cost of a buffered entry, in addition to its strings
+entry_overhead = 100
+
+class PostingsBuffer:
+    '''Accumulates entries to append to the values of a BsdDB, so that each value
+        is read, decoded, encoded and written once per flush instead of once per entry.
+        Entries are spilled to sorted temporary files when their estimated size
+        exceeds memory_limit bytes, and merged back when flushing.'''
+    def __init__(self, db, memory_limit):
+        self.db = db
+        self.memory_limit = memory_limit
+        self.entries = {}
+        self.size = 0
+        self.runs = []
+
+    # Appends entry (arguments of the append method of the value type) to the value of key
+    def append(self, key, *entry):
+        key = lib.autoBytes(key)
+        if key in self.entries:
+            self.entries[key].append(entry)
+        else:
+            self.entries[key] = [entry]
+            self.size += len(key) + entry_overhead
+
+        self.size += entry_overhead + sum(len(x) for x in entry if type(x) in (str, bytes))
+        if self.size > self.memory_limit:
+            self.spill()
+
+    # Writes buffered entries to a temporary file, sorted by key
+    def spill(self):
+        run = tempfile.TemporaryFile()
+        for key in sorted(self.entries):
+            pickle.dump((key, self.entries[key]), run)
+        run.seek(0)
+        self.runs.append(run)
+        self.entries = {}
+        self.size = 0
+
+    @staticmethod
+    def iter_run(run):
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+
+    # Writes all entries to the database, in key order. Returns the list of modified keys.
+    # The caller is responsible for locking the database.
+    def flush(self):
+        sources = [self.iter_run(run) for run in self.runs]
+        sources.append(sorted(self.entries.items()))
+
+        keys = []
+        # Runs are merged in the order they were spilled, so that entries of a key
+        # are appended in the order they were added
+        for key, group in groupby(heapq.merge(*sources, key=lambda x: x[0]), key=lambda x: x[0]):
+            obj = self.db.get(key)
+            if obj is None:
+                obj = self.db.ctype(b'')
+            for _, entries in group:
+                for entry in entries:
+                    obj.append(*entry)
+            self.db.put(key, obj)
+            keys.append(key)
+
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.entries = {}
+        self.size = 0
+        return keys
 
 class BsdDB:
-    def __init__(self, filename, readonly, contentType, shared=False):
+    # env: optional DBEnv, see acquire_env
+    def __init__(self, filename, readonly, contentType, shared=False, env=None):
         self.filename = filename
-        self.db = berkeleydb.db.DB()
+        self.db = berkeleydb.db.DB(env)
         flags = berkeleydb.db.DB_THREAD if shared else 0
 
         if readonly:
@@ -185,6 +1143,135 @@ class BsdDB:
     def __len__(self):
         return self.db.stat()["nkeys"]
 
+class VersionsDB(BsdDB):
+    '''Database of the files of each version. Values are PathList or
+        PathListDelta objects, get returns the files of a version as a PathList.'''
+    def __init__(self, filename, readonly, shared=False, env=None):
+        super().__init__(filename, readonly, decode_versions_value, shared=shared, env=env)
+
+    def get(self, key):
+        obj = super().get(key)
+        if isinstance(obj, PathListDelta):
+            obj = obj.apply(self.get(obj.base))
+        return obj
+
+    # Returns the number of deltas to apply to get the files of version key
+    def get_depth(self, key):
+        obj = super().get(key)
+        return obj.depth if isinstance(obj, PathListDelta) else 0
+
+class PathIndexDir:
+    '''Directory of PathIndex files, one per version. Opened indexes are kept
+        until close is called.'''
+    def __init__(self, dirname, readonly):
+        self.dirname = dirname
+        if not readonly:
+            os.makedirs(dirname, exist_ok=True)
+        self.lock = threading.Lock()
+        self.indexes = {}
+
+    def get_filename(self, key):
+        return os.path.join(self.dirname, parse.quote(lib.autoBytes(key), safe=''))
+
+    # Returns the PathIndex of version key, or None if it does not exist
+    def get(self, key):
+        key = lib.autoBytes(key)
+        with self.lock:
+            if key not in self.indexes:
+                try:
+                    self.indexes[key] = PathIndex.open(self.get_filename(key))
+                except FileNotFoundError:
+                    return None
+            return self.indexes[key]
+
+    def exists(self, key):
+        return os.path.exists(self.get_filename(key))
+
+    # Writes the index of version key, paths is an iterable of bytes
+    def put(self, key, paths):
+        filename = self.get_filename(key)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.dirname, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PathIndex.pack(paths))
+            os.fsync(f.fileno())
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, filename)
+
+    def close(self):
+        with self.lock:
+            for index in self.indexes.values():
+                index.close()
+            self.indexes = {}
+
+# Shared Berkeley DB environments
+#
+# If ELIXIR_DB_CACHE_SIZE is set, databases of a data directory are opened in an
+# environment stored in this directory, with a memory pool of this size in MiB,
+# shared by all processes that open them: each page is cached once per host,
+# instead of once per process and file. ELIXIR_DB_MMAP_SIZE sets the size in MiB
+# up to which databases opened read-only are memory-mapped instead of read into
+# the pool. The same settings must be used by all processes that open the
+# databases, including update.py, so that they don't read outdated pages.
+# The environment uses the locking of the Concurrent Data Store: update.py
+# writes pages of the shared pool while web server processes read them, so
+# writes must wait until cursors of readers are closed, and the other way round.
+# Opening the environment requires write access to the data directory and to its
+# files. Processes that cannot open it, for example if the data directory is
+# read-only, open the databases directly, each with its own cache.
+
+# Names of the files of an environment
+DB_ENV_FILES_PREFIX = '__db.'
+
+# data directory -> [DBEnv, number of DB objects using it]
+db_envs = {}
+# Data directories in which the environment could not be opened
+db_envs_failed = set()
+db_envs_lock = threading.Lock()
+
+# Returns the DBEnv of the databases of dir, or None if environments are not used.
+# It must be released with release_env.
+def acquire_env(dir):
+    cache_size = int(os.environ.get('ELIXIR_DB_CACHE_SIZE', 0))
+    if cache_size == 0:
+        return None
+
+    dir = os.path.realpath(dir)
+    with db_envs_lock:
+        if dir in db_envs_failed:
+            return None
+
+        if dir not in db_envs:
+            env = berkeleydb.db.DBEnv()
+            env.set_cachesize(cache_size // 1024, (cache_size % 1024) * 1024 * 1024, 1)
+            mmap_size = int(os.environ.get('ELIXIR_DB_MMAP_SIZE', 0))
+            if mmap_size != 0:
+                env.set_mp_mmapsize(mmap_size * 1024 * 1024)
+            flags = (berkeleydb.db.DB_CREATE | berkeleydb.db.DB_INIT_MPOOL |
+                     berkeleydb.db.DB_INIT_CDB | berkeleydb.db.DB_INIT_LOCK |
+                     berkeleydb.db.DB_THREAD)
+            try:
+                env.open(dir, flags, 0o644)
+            except berkeleydb.db.DBError as e:
+                logger.warning('could not open database environment in %s, '
+                               'opening databases without it: %s', dir, e)
+                env.close()
+                db_envs_failed.add(dir)
+                return None
+            db_envs[dir] = [env, 0]
+
+        db_envs[dir][1] += 1
+        return db_envs[dir][0]
+
+def release_env(env):
+    with db_envs_lock:
+        for dir, entry in db_envs.items():
+            if entry[0] is env:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    env.close()
+                    del db_envs[dir]
+                return
+
 class DB:
     def __init__(self, dir, readonly=True, dtscomp=False, shared=False):
         if os.path.isdir(dir):
@@ -193,31 +1280,67 @@ class DB:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dir)
 
         ro = readonly
+        self.env = acquire_env(dir)
 
-        self.vars = BsdDB(dir + '/variables.db', ro, lambda x: int(x.decode()), shared=shared)
+        self.vars = BsdDB(dir + '/variables.db', ro, lambda x: int(x.decode()), shared=shared, env=self.env)
             # Key-value store of basic information
-        self.blob = BsdDB(dir + '/blobs.db', ro, lambda x: int(x.decode()), shared=shared)
+        self.blob = BsdDB(dir + '/blobs.db', ro, lambda x: int(x.decode()), shared=shared, env=self.env)
             # Map hash to sequential integer serial number
-        self.hash = BsdDB(dir + '/hashes.db', ro, lambda x: x, shared=shared)
+        self.hash = BsdDB(dir + '/hashes.db', ro, lambda x: x, shared=shared, env=self.env)
             # Map serial number back to hash
-        self.file = BsdDB(dir + '/filenames.db', ro, lambda x: x.decode(), shared=shared)
+        self.file = BsdDB(dir + '/filenames.db', ro, lambda x: x.decode(), shared=shared, env=self.env)
             # Map serial number to filename
-        self.vers = BsdDB(dir + '/versions.db', ro, PathList, shared=shared)
-        self.defs = BsdDB(dir + '/definitions.db', ro, DefList, shared=shared)
+        self.vers = VersionsDB(dir + '/versions.db', ro, shared=shared, env=self.env)
+        if not ro or os.path.exists(dir + '/versions-blobs.db'):
+            self.vers_blobs = BsdDB(dir + '/versions-blobs.db', ro, BlobSet, shared=shared, env=self.env)
+            # Map version to the set of its blob IDs
+        else:
+            self.vers_blobs = None
+        self.vers_paths = PathIndexDir(dir + '/versions-paths', ro)
+            # Memory-mapped sets of the paths of each version
+        self.defs = BsdDB(dir + '/definitions.db', ro, DefList, shared=shared, env=self.env)
         self.defs_cache = {}
         NOOP = lambda x: x
-        self.defs_cache['C'] = BsdDB(dir + '/definitions-cache-C.db', ro, NOOP, shared=shared)
-        self.defs_cache['K'] = BsdDB(dir + '/definitions-cache-K.db', ro, NOOP, shared=shared)
-        self.defs_cache['D'] = BsdDB(dir + '/definitions-cache-D.db', ro, NOOP, shared=shared)
-        self.defs_cache['M'] = BsdDB(dir + '/definitions-cache-M.db', ro, NOOP, shared=shared)
+        self.defs_cache['C'] = BsdDB(dir + '/definitions-cache-C.db', ro, NOOP, shared=shared, env=self.env)
+        self.defs_cache['K'] = BsdDB(dir + '/definitions-cache-K.db', ro, NOOP, shared=shared, env=self.env)
+        self.defs_cache['D'] = BsdDB(dir + '/definitions-cache-D.db', ro, NOOP, shared=shared, env=self.env)
+        self.defs_cache['M'] = BsdDB(dir + '/definitions-cache-M.db', ro, NOOP, shared=shared, env=self.env)
         assert sorted(self.defs_cache.keys()) == sorted(lib.CACHED_DEFINITIONS_FAMILIES)
-        self.refs = BsdDB(dir + '/references.db', ro, RefList, shared=shared)
-        self.docs = BsdDB(dir + '/doccomments.db', ro, RefList, shared=shared)
+        self.refs = BsdDB(dir + '/references.db', ro, RefList, shared=shared, env=self.env)
+        if not ro or os.path.exists(dir + '/tokens.db'):
+            self.tokens = BsdDB(dir + '/tokens.db', ro, TokenList, shared=shared, env=self.env)
+            # Map serial number to the identifiers of the blob
+        else:
+            self.tokens = None
+        self.docs = BsdDB(dir + '/doccomments.db', ro, RefList, shared=shared, env=self.env)
         self.dtscomp = dtscomp
         if dtscomp:
-            self.comps = BsdDB(dir + '/compatibledts.db', ro, RefList, shared=shared)
-            self.comps_docs = BsdDB(dir + '/compatibledts_docs.db', ro, RefList, shared=shared)
+            self.comps = BsdDB(dir + '/compatibledts.db', ro, RefList, shared=shared, env=self.env)
+            self.comps_docs = BsdDB(dir + '/compatibledts_docs.db', ro, RefList, shared=shared, env=self.env)
             # Use a RefList in case there are multiple doc comments for an identifier
+        self.autocomplete = {}
+        if ro:
+            for name in get_autocomplete_names(self):
+                try:
+                    self.autocomplete[name] = AutocompleteIndex.open(get_autocomplete_filename(dir, name))
+                except (FileNotFoundError, ValueError):
+                    # Not generated yet, or written on a host with another byte order
+                    pass
+            # Memory-mapped autocomplete indexes, by name of the database of their keys
+
+    # Writes all changes to the databases to disk
+    def sync(self):
+        databases = [self.vars, self.blob, self.hash, self.file, self.vers, self.defs,
+                     *self.defs_cache.values(), self.refs, self.docs]
+        if self.vers_blobs is not None:
+            databases.append(self.vers_blobs)
+        if self.tokens is not None:
+            databases.append(self.tokens)
+        if self.dtscomp:
+            databases += [self.comps, self.comps_docs]
+
+        for bsddb in databases:
+            bsddb.db.sync()
 
     def close(self):
         self.vars.close()
@@ -225,14 +1348,303 @@ class DB:
         self.hash.close()
         self.file.close()
         self.vers.close()
+        if self.vers_blobs is not None:
+            self.vers_blobs.close()
+        self.vers_paths.close()
         self.defs.close()
         self.defs_cache['C'].close()
         self.defs_cache['K'].close()
         self.defs_cache['D'].close()
         self.defs_cache['M'].close()
         self.refs.close()
+        if self.tokens is not None:
+            self.tokens.close()
         self.docs.close()
         if self.dtscomp:
             self.comps.close()
             self.comps_docs.close()
+        for index in self.autocomplete.values():
+            index.close()
+        if self.env is not None:
+            release_env(self.env)
+
+# Name of the file of the data directory storing the generation of the index, and
+# the ID of the index. update.py increments the generation once all databases are
+# synced after indexing a version, so that readers know when to reopen them.
+# The ID is chosen when the file is created, so that generations of different
+# indexes of the same project can't be mistaken for one another.
+GENERATION_FILE = 'generation'
+
+# Returns (generation, index ID) of the index in data_dir, or None if it has no
+# generation file (index created by an older version of Elixir)
+def read_generation(data_dir):
+    try:
+        with open(os.path.join(data_dir, GENERATION_FILE)) as f:
+            generation, index_id = f.read().split()
+        return int(generation), index_id
+    except FileNotFoundError:
+        return None
+
+# Increments the generation of the index in data_dir
+def bump_generation(data_dir):
+    current = read_generation(data_dir)
+    if current is None:
+        current = (0, os.urandom(8).hex())
+
+    fd, tmp_filename = tempfile.mkstemp(dir=data_dir, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(f'{current[0] + 1} {current[1]}\n')
+    os.chmod(tmp_filename, 0o644)
+    os.replace(tmp_filename, os.path.join(data_dir, GENERATION_FILE))
+
+# Name of the file of the data directory storing the latest indexed tags, without
+# and with release candidates (see Query.get_latest_tag), so that readers don't
+# have to list the tags of the repository
+LATEST_TAGS_FILE = 'latest-tags'
+
+# Returns (latest tag, latest tag including release candidates) stored in data_dir,
+# or None if they are not stored (index created by an older version of Elixir)
+def read_latest_tags(data_dir):
+    try:
+        with open(os.path.join(data_dir, LATEST_TAGS_FILE)) as f:
+            latest, latest_rc = f.read().split()
+        return latest, latest_rc
+    except FileNotFoundError:
+        return None
+
+def write_latest_tags(data_dir, latest, latest_rc):
+    fd, tmp_filename = tempfile.mkstemp(dir=data_dir, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(f'{latest} {latest_rc}\n')
+    os.chmod(tmp_filename, 0o644)
+    os.replace(tmp_filename, os.path.join(data_dir, LATEST_TAGS_FILE))
+
+# Returns the first tag of sorted_tags that is indexed in db. If none is, returns
+# the last tag, even if it is not indexed.
+def find_latest_tag(db, sorted_tags):
+    for tag in sorted_tags:
+        if db.vers.exists(tag):
+            return tag
+    return sorted_tags[-1]
+
+# Name of the file of the data directory storing the indexed versions, in the order
+# of `script.sh list-tags -h`, one "<topmenu> <submenu> <tag>" line per version,
+# so that readers don't have to run the tag scripts of the project
+VERSIONS_TREE_FILE = 'versions-tree'
+
+# Returns the (topmenu, submenu, tag) tuples of the versions indexed in db
+# lines: output of `script.sh list-tags -h`, with 1 to 3 fields per tag
+def find_versions_tree(db, lines):
+    tree = []
+    for line in lines:
+        taginfo = lib.decode(line).split(' ')
+        num = len(taginfo)
+        topmenu, submenu = 'FIXME', 'FIXME'
+
+        if num == 1:
+            tag, = taginfo
+        elif num == 2:
+            submenu, tag = taginfo
+        elif num == 3:
+            topmenu, submenu, tag = taginfo
+        else:
+            raise Exception("unexpected number of fields in taginfo")
+
+        if db.vers.exists(tag):
+            tree.append((topmenu, submenu, tag))
+    return tree
+
+# Returns the tree written by write_versions_tree, or None if it is not stored
+# (index created by an older version of Elixir)
+def read_versions_tree(data_dir):
+    try:
+        with open(os.path.join(data_dir, VERSIONS_TREE_FILE)) as f:
+            return [tuple(line.split(' ')) for line in f.read().splitlines()]
+    except FileNotFoundError:
+        return None
+
+def write_versions_tree(data_dir, tree):
+    fd, tmp_filename = tempfile.mkstemp(dir=data_dir, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        for entry in tree:
+            f.write(' '.join(entry) + '\n')
+    os.chmod(tmp_filename, 0o644)
+    os.replace(tmp_filename, os.path.join(data_dir, VERSIONS_TREE_FILE))
+
+# Snapshots of data directories
+#
+# When update.py is run with snapshots, the data directory is a symlink to the
+# current snapshot, a directory of <data directory>-snapshots. New versions are
+# indexed in a copy of the current snapshot, and the symlink is replaced once
+# the databases are closed, so that readers never see databases being written.
+# Only one update.py may run at a time for a data directory.
+
+# Prefix of snapshots being created
+SNAPSHOT_STAGING_PREFIX = '.staging-'
+
+# Copies a file with copy_file_range, so that filesystems supporting it can
+# share the blocks of both files until they are modified (copy-on-write)
+def copy_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size)
+                if copied == 0:
+                    break
+                size -= copied
+        except OSError:
+            # Not supported by the filesystem, copy the rest
+            shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+
+# Returns the path of a new snapshot, containing a copy of the current data of data_dir.
+# Subdirectories only contain files that are replaced and never modified, and are
+# shared with hard links.
+def create_snapshot(data_dir):
+    data_dir = data_dir.rstrip('/')
+    snapshots_dir = data_dir + '-snapshots'
+    os.makedirs(snapshots_dir, exist_ok=True)
+
+    # Snapshots of interrupted updates
+    for entry in os.scandir(snapshots_dir):
+        if entry.name.startswith(SNAPSHOT_STAGING_PREFIX):
+            shutil.rmtree(entry.path)
+
+    snapshot = tempfile.mkdtemp(dir=snapshots_dir, prefix=SNAPSHOT_STAGING_PREFIX)
+    os.chmod(snapshot, 0o755)
+    current = os.path.realpath(data_dir)
+    for entry in os.scandir(current):
+        if entry.name.startswith('.') or entry.name.startswith(DB_ENV_FILES_PREFIX):
+            continue
+        target = os.path.join(snapshot, entry.name)
+        if entry.is_dir():
+            os.mkdir(target)
+            for file in os.scandir(entry.path):
+                os.link(file.path, os.path.join(target, file.name))
+        else:
+            copy_file(entry.path, target)
+
+    return snapshot
+
+# Makes data_dir a symlink to snapshot, created by create_snapshot, and removes
+# snapshots older than the last `keep` previous ones
+def publish_snapshot(data_dir, snapshot, keep):
+    data_dir = data_dir.rstrip('/')
+    snapshots_dir = os.path.dirname(snapshot)
+    name = time.strftime('%Y%m%d-%H%M%S')
+    n = 1
+    while os.path.exists(os.path.join(snapshots_dir, name)):
+        name = time.strftime('%Y%m%d-%H%M%S') + f'.{n}'
+        n += 1
+    os.rename(snapshot, os.path.join(snapshots_dir, name))
+
+    if os.path.isdir(data_dir) and not os.path.islink(data_dir):
+        # First snapshot of an existing data directory, which becomes the oldest
+        # snapshot. Readers won't find the data directory until it is replaced.
+        os.rename(data_dir, os.path.join(snapshots_dir, '00000000-000000'))
+
+    link = os.path.join(os.path.dirname(data_dir), SNAPSHOT_STAGING_PREFIX + os.path.basename(data_dir))
+    if os.path.lexists(link):
+        os.unlink(link)
+    os.symlink(os.path.join(os.path.basename(snapshots_dir), name), link)
+    os.replace(link, data_dir)
+
+    # Snapshot names sort by creation time
+    previous = sorted(entry.name for entry in os.scandir(snapshots_dir)
+                      if not entry.name.startswith('.') and entry.name != name)
+    for old in previous[:max(len(previous) - keep, 0)]:
+        shutil.rmtree(os.path.join(snapshots_dir, old))
+
+# Adds the identifiers in keys to the definitions caches of the families they are
+# compatible with. Families of an identifier are only ever added, so existing
+# cache entries never need to be removed.
+# Each family has a definitions cache generation, in the variables database, that
+# is incremented when identifiers are added to the cache of the family. It tells
+# if a TokenList is up to date: identifiers of outdated lists that had no
+# definition are looked up again when the blob is displayed.
+# Since most indexed versions define new identifiers, TokenLists of the main
+# families only stay up to date until the next run of update.py. Identifiers
+# that were marked as defined never need to be looked up again.
+def update_defs_caches(db, keys):
+    added = set()
+    for key in keys:
+        value = db.defs.get(key)
+        for family in lib.CACHED_DEFINITIONS_FAMILIES:
+            if (lib.compatibleFamily(value.get_families(), family) or
+                        lib.compatibleMacro(value.get_macros(), family)):
+                if not db.defs_cache[family].exists(key):
+                    db.defs_cache[family].put(key, b'')
+                    added.add(family)
+
+    for family in added:
+        db.vars.put('defsCacheGeneration' + family, get_defs_cache_generation(db, family) + 1)
+
+# Returns the definitions cache generation of family, see update_defs_caches
+def get_defs_cache_generation(db, family):
+    if db.vars.exists('defsCacheGeneration' + family):
+        return db.vars.get('defsCacheGeneration' + family)
+    # Generation shared by all families, before they had their own. Generations of
+    # families start from it, so that older TokenLists are not seen as up to date.
+    if db.vars.exists('defsCacheGeneration'):
+        return db.vars.get('defsCacheGeneration')
+    return 0
+
+# Regenerates the definitions caches from all definitions
+def generate_defs_caches(db):
+    update_defs_caches(db, db.defs.get_keys())
+
+# Autocomplete indexes
+#
+# update.py writes an AutocompleteIndex of the keys of the definitions database, and
+# one of the keys of the compatible DTS database, so that autocomplete requests don't
+# have to walk and rank the keys of the databases.
+
+# Returns the names of the autocomplete indexes of db
+def get_autocomplete_names(db):
+    return ['definitions', 'compatibledts'] if db.dtscomp else ['definitions']
+
+def get_autocomplete_filename(dir, name):
+    return os.path.join(dir, 'autocomplete-' + name + '.idx')
+
+# Returns (count, weight) of key in the autocomplete index name
+def get_autocomplete_entry(db, name, key):
+    if name == 'definitions':
+        refs = db.refs.get(key)
+        count = refs.count() if refs is not None else 0
+        weight = max((autocomplete_type_weights.get(type, 1) for type in db.defs.get(key).get_types()),
+                     default=1)
+    else:
+        count = db.comps.get(key).count()
+        weight = 1
+    return count, weight
+
+# Updates the entries of keys in the autocomplete indexes of db, keys maps names of
+# indexes to the keys added or modified since they were written.
+# Missing indexes are generated from all keys. Returns True if an index was written.
+def update_autocomplete_indexes(db, keys):
+    written = False
+    for name in get_autocomplete_names(db):
+        filename = get_autocomplete_filename(db.dir, name)
+        entries = {}
+        try:
+            previous = AutocompleteIndex.open(filename)
+            entries.update((key, (count, weight)) for key, count, weight in previous.iter())
+            previous.close()
+            updated = keys.get(name, ())
+            if not updated:
+                continue
+        except (FileNotFoundError, ValueError):
+            updated = (db.defs if name == 'definitions' else db.comps).get_keys()
+
+        for key in updated:
+            entries[key] = get_autocomplete_entry(db, name, key)
+
+        fd, tmp_filename = tempfile.mkstemp(dir=db.dir, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(AutocompleteIndex.pack((key, *entries[key]) for key in sorted(entries)))
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, filename)
+        written = True
 
+    return written
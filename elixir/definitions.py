@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Copyright (C) 2017--2020 Mikaël Bouillot <mikael.bouillot@bootlin.com>
+#  and contributors
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Finds definitions in many files with a single ctags call per file family.
+# This follows the same rules as the parse-defs command of script.sh, which
+# runs ctags once per file.
+
+import os
+import re
+import subprocess
+import tempfile
+
+# ctags options for each file family
+ctags_options = {
+    'C': ('--kinds-c=+p+x', '--extras=-{anonymous}'),
+    'K': ('--language-force=kconfig', '--kinds-kconfig=c', '--extras-kconfig=-{configPrefixed}'),
+    'D': ('--language-force=dts',),
+}
+
+# Function macros, e.g., in .S files
+entry_regex = re.compile(rb'^\s*ENTRY\((\w+)\)')
+syscall_regex = re.compile(rb'^SYSCALL_DEFINE[0-9]\(\s*(\w+)\W')
+
+# Returns a list of (index, ident, type, line) tuples, sorted by index
+# files: list of (filename, family, contents) tuples, index is the position in this list
+# filename: file name without path, used by ctags to detect the language
+def find_definitions(files):
+    defs = [[] for _ in files]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Each file is written in its own directory to keep its name
+        paths = {}
+        for n, (filename, family, contents) in enumerate(files):
+            if family not in ctags_options:
+                continue
+
+            os.mkdir(os.path.join(tmp, str(n)))
+            path = os.path.join(str(n), filename)
+            with open(os.path.join(tmp, path), 'wb') as f:
+                f.write(contents)
+            paths.setdefault(family, []).append(path)
+
+        for family, family_paths in paths.items():
+            run_ctags(tmp, family, family_paths, defs)
+
+    for n, (filename, family, contents) in enumerate(files):
+        if family == 'C':
+            defs[n] += find_macro_definitions(contents)
+
+    return [(n, ident, type, line) for n, file_defs in enumerate(defs)
+                                    for ident, type, line in file_defs]
+
+# Appends (ident, type, line) tuples found by ctags in files at paths to defs
+def run_ctags(tmp, family, paths, defs):
+    cmd = ('ctags', '-x', *ctags_options[family], '-L', '-')
+    file_list = '\n'.join(paths).encode() + b'\n'
+    result = subprocess.run(cmd, cwd=tmp, input=file_list, stdout=subprocess.PIPE)
+
+    for l in result.stdout.split(b'\n'):
+        # Lines are "<ident> <type> <line> <path> <line contents>"
+        fields = l.split(maxsplit=3)
+        if len(fields) < 4:
+            continue
+        ident, type, line, path = fields
+
+        if family == 'C' and (l.startswith(b'operator ') or ident.startswith(b'CONFIG_')):
+            continue
+        if family == 'K':
+            ident = b'CONFIG_' + ident
+
+        n = int(path.split(b'/', maxsplit=1)[0])
+        defs[n].append((ident, type.decode(), int(line)))
+
+# Returns (ident, type, line) tuples for definitions of function macros
+def find_macro_definitions(contents):
+    # Lines keep their newline character, like in perl
+    lines = [l + b'\n' for l in contents.split(b'\n')]
+    lines[-1] = lines[-1][:-1]
+    defs = []
+    for num, line in enumerate(lines, 1):
+        m = entry_regex.match(line)
+        if m:
+            defs.append((m.group(1), 'function', num))
+    for num, line in enumerate(lines, 1):
+        m = syscall_regex.match(line)
+        if m:
+            defs.append((b'sys_' + m.group(1), 'function', num))
+    return defs
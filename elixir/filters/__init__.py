@@ -1,3 +1,5 @@
+import re
+from functools import lru_cache
 from typing import List
 
 from .utils import Filter, FilterContext
@@ -21,3 +23,42 @@ def get_filters(ctx: FilterContext, project_name: str) -> List[Filter]:
 
     return [f for f in filters if f.check_if_applies(ctx)]
 
+
+# Applies transform_raw_code of filters to code, in order.
+# Each filter runs on the output of the previous ones, filters that have
+# nothing to match in the code are skipped.
+def transform_raw_code(ctx: FilterContext, filters: List[Filter], code: str) -> str:
+    for f in filters:
+        if f.required_text is None or f.required_text in code:
+            code = f.transform_raw_code(ctx, code)
+    return code
+
+# Returns a regex matching placeholders of all patterns, with a named group per pattern
+@lru_cache(maxsize=128)
+def get_placeholders_regex(patterns: tuple[re.Pattern]) -> re.Pattern:
+    return re.compile('|'.join(f'(?P<f{ n }>{ p.pattern })' for n, p in enumerate(patterns)),
+                      flags=re.MULTILINE)
+
+# Replaces placeholders left in html by all filters in a single pass, then
+# applies untransform_formatted_code of filters that don't use placeholders
+def untransform_formatted_code(ctx: FilterContext, filters: List[Filter], html: str) -> str:
+    placeholder_filters = [f for f in filters if f.placeholder_regex is not None]
+    if len(placeholder_filters) != 0:
+        regex = get_placeholders_regex(tuple(f.placeholder_regex for f in placeholder_filters))
+
+        def replace(m):
+            for n, f in enumerate(placeholder_filters):
+                if m.group(f'f{ n }') is not None:
+                    # Match again with the regex of the filter, for its group numbers
+                    return f.replace_placeholder(ctx, f.placeholder_regex.match(html, m.start()))
+
+        html = regex.sub(replace, html)
+
+    for f in filters:
+        if f.placeholder_regex is None:
+            html = f.untransform_formatted_code(ctx, html)
+    return html
+
+# Returns a string that changes when the filters of a project are modified
+def get_filters_key(project_name: str) -> str:
+    return repr(project_filters.get(project_name, default_filters))
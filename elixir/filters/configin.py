@@ -5,6 +5,9 @@ from .utils import Filter, FilterContext, decode_number, encode_number, filename
 # source "path/file"
 # Example: uclibc-ng/v1.0.47/source/extra/Configs/Config.in#L176
 class ConfigInFilter(Filter):
+    required_text = 'source'
+    placeholder_regex = re.compile('__KEEPCONFIGIN__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.configin = []
@@ -20,10 +23,6 @@ class ConfigInFilter(Filter):
 
         return re.sub('^(\s*)(source)(\s*)\"(.*)\"', keep_configin, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_configin(m):
-            w = self.configin[decode_number(m.group(1)) - 1]
-            return f'<a href="{ ctx.get_absolute_source_url(w) }">{ w }</a>'
-
-        return re.sub('__KEEPCONFIGIN__([A-J]+)', replace_configin, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.configin[decode_number(m.group(1)) - 1]
+        return f'<a href="{ ctx.get_absolute_source_url(w) }">{ w }</a>'
@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, extensio
 # Example: musl/v1.2.5/source/src/dirent/dirfd.c#L2
 # #include "__dirent.h"
 class CppIncFilter(Filter):
+    required_text = '#include'
+    placeholder_regex = re.compile('__KEEPCPPINC__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.cppinc = []
@@ -21,11 +24,7 @@ class CppIncFilter(Filter):
 
         return re.sub('^(\s*)#include(\s*)\"(.*?)\"', keep_cppinc, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_cppinc(m):
-            w = self.cppinc[decode_number(m.group(1)) - 1]
-            url = ctx.get_relative_source_url(w)
-            return f'<a href="{ url }">{ w }</a>'
-
-        return re.sub('__KEEPCPPINC__([A-J]+)', replace_cppinc, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.cppinc[decode_number(m.group(1)) - 1]
+        url = ctx.get_relative_source_url(w)
+        return f'<a href="{ url }">{ w }</a>'
@@ -12,6 +12,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, extensio
 # prefix_path: a list of paths, will be used to replace the prefix path during the
 # untransform_formatted_code step
 class CppPathIncFilter(Filter):
+    required_text = '#include'
+    placeholder_regex = re.compile('__KEEPCPPPATHINC__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, prefix_path: List[str] = ["include"], *args, **kwargs):
         self.prefix_path = prefix_path
         super().__init__(*args, **kwargs)
@@ -36,14 +39,10 @@ class CppPathIncFilter(Filter):
 
         return re.sub('^(\s*)#include(\s*)<(.*?)>', keep_cpppathinc, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_cpppathinc(m):
-            w = self.cpppathinc[decode_number(m.group(1)) - 1]
-            for p in self.prefix_path:
-                path = f"/{p}/{w}"
-                if ctx.query.file_exists(ctx.tag, path):
-                    return f'<a href="{ ctx.get_absolute_source_url(path) }">{ w }</a>'
-            return w
-
-        return re.sub('__KEEPCPPPATHINC__([A-J]+)', replace_cpppathinc, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.cpppathinc[decode_number(m.group(1)) - 1]
+        for p in self.prefix_path:
+            path = f"/{p}/{w}"
+            if ctx.file_exists(path):
+                return f'<a href="{ ctx.get_absolute_source_url(path) }">{ w }</a>'
+        return w
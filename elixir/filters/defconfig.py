@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, extensio
 # `CONFIG_OPTION=y`
 # Example: u-boot/v2023.10/source/configs/A13-OLinuXino_defconfig#L1
 class DefConfigIdentsFilter(Filter):
+    required_text = 'CONFIG_'
+    placeholder_regex = re.compile('__KEEPDEFCONFIGIDENTS__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.defconfigidents = []
@@ -21,10 +24,6 @@ class DefConfigIdentsFilter(Filter):
 
         return re.sub('(CONFIG_[\w]+)', keep_defconfigidents, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_defconfigidents(m):
-            i = self.defconfigidents[decode_number(m.group(1)) - 1]
-            return f'<a class="ident" href="{ ctx.get_ident_url(i, "K") }">{ i }</a>'
-
-        return re.sub('__KEEPDEFCONFIGIDENTS__([A-J]+)', replace_defconfigidents, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        i = self.defconfigidents[decode_number(m.group(1)) - 1]
+        return f'<a class="ident" href="{ ctx.get_ident_url(i, "K") }">{ i }</a>'
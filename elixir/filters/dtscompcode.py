@@ -7,6 +7,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, extensio
 # .compatible = "device"
 # Example: u-boot/v2023.10/source/drivers/phy/nop-phy.c#L84
 class DtsCompCodeFilter(Filter):
+    required_text = 'compatible'
+    placeholder_regex = re.compile('__KEEPDTSCOMPC__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dtscompC = []
@@ -30,10 +33,6 @@ class DtsCompCodeFilter(Filter):
         return re.sub('(\s*{*\s*\.(\033\[31m)?compatible(\033\[0m)?\s*=\s*)\"(.+?)\"',
                       keep_dtscompC, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_dtscompC(m):
-            i = self.dtscompC[decode_number(m.group(1)) - 1]
-            return f'<a class="ident" href="{ ctx.get_ident_url(i, "B") }">{ i }</a>'
-
-        return re.sub('__KEEPDTSCOMPC__([A-J]+)', replace_dtscompC, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        i = self.dtscompC[decode_number(m.group(1)) - 1]
+        return f'<a class="ident" href="{ ctx.get_ident_url(i, "B") }">{ i }</a>'
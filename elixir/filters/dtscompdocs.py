@@ -7,6 +7,8 @@ from .utils import Filter, FilterContext, encode_number, decode_number
 # Example: linux/v6.9.4/source/Documentation/devicetree/bindings/thermal/brcm,avs-ro-thermal.yaml#L17
 # Note that this also finds strings in comments, descriptions and other potentially unrelated properties
 class DtsCompDocsFilter(Filter):
+    placeholder_regex = re.compile('__KEEPDTSCOMPB__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dtscompB = []
@@ -28,11 +30,7 @@ class DtsCompDocsFilter(Filter):
 
         return re.sub('([\w-]+,?[\w-]+)', keep_dtscompB, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_dtscompB(m):
-            i = self.dtscompB[decode_number(m.group(1)) - 1]
-
-            return f'<a class="ident" href="{ ctx.get_ident_url(i, "B") }">{ i }</a>'
-
-        return re.sub('__KEEPDTSCOMPB__([A-J]+)', replace_dtscompB, html, flags=re.MULTILINE)
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        i = self.dtscompB[decode_number(m.group(1)) - 1]
 
+        return f'<a class="ident" href="{ ctx.get_ident_url(i, "B") }">{ i }</a>'
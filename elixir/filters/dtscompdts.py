@@ -5,6 +5,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, extensio
 # compatible = "device"
 # Example: u-boot/v2023.10/source/arch/arm/dts/ac5-98dx35xx-rd.dts#L37
 class DtsCompDtsFilter(Filter):
+    required_text = 'compatible'
+    placeholder_regex = re.compile('__KEEPDTSCOMPD__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dtscompD = []
@@ -27,11 +30,7 @@ class DtsCompDtsFilter(Filter):
 
         return re.sub('\s*compatible(.*?)$', sub_func, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_dtscompD(m):
-            i = self.dtscompD[decode_number(m.group(1)) - 1]
-
-            return f'<a class="ident" href="{ ctx.get_ident_url(i, "B") }">{ i }</a>'
-
-        return re.sub('__KEEPDTSCOMPD__([A-J]+)', replace_dtscompD, html, flags=re.MULTILINE)
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        i = self.dtscompD[decode_number(m.group(1)) - 1]
 
+        return f'<a class="ident" href="{ ctx.get_ident_url(i, "B") }">{ i }</a>'
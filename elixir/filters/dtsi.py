@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, extensio
 # /include/ "file"
 # Example: u-boot/v2023.10/source/arch/powerpc/dts/t1023si-post.dtsi#L12
 class DtsiFilter(Filter):
+    required_text = '/include/'
+    placeholder_regex = re.compile('__KEEPDTSI__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dtsi = []
@@ -21,10 +24,6 @@ class DtsiFilter(Filter):
 
         return re.sub('^(\s*)/include/(\s*)\"(.*?)\"', keep_dtsi, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_dtsi(m):
-            w = self.dtsi[decode_number(m.group(1)) - 1]
-            return f'<a href="{ ctx.get_relative_source_url(w) }">{ w }</a>'
-
-        return re.sub('__KEEPDTSI__([A-J]+)', replace_dtsi, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.dtsi[decode_number(m.group(1)) - 1]
+        return f'<a href="{ ctx.get_relative_source_url(w) }">{ w }</a>'
@@ -9,6 +9,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number
 # database. This filter replaces these marked tokens with links to their ident pages,
 # unless the token starts with CONFIG_ - these tokens are handled by the Kconfig filter.
 class IdentFilter(Filter):
+    required_text = '\033[31m'
+    placeholder_regex = re.compile('__(<.+?>)?KEEPIDENTS__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.idents = []
@@ -20,11 +23,7 @@ class IdentFilter(Filter):
 
         return re.sub('\033\[31m(?!CONFIG_)(.*?)\033\[0m', sub_func, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def sub_func(m):
-            i = self.idents[decode_number(m.group(2)) - 1]
-            link = f'<a class="ident" href="{ ctx.get_ident_url(i) }">{ i }</a>'
-            return str(m.group(1) or '') + link
-
-        return re.sub('__(<.+?>)?KEEPIDENTS__([A-J]+)', sub_func, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        i = self.idents[decode_number(m.group(2)) - 1]
+        link = f'<a class="ident" href="{ ctx.get_ident_url(i) }">{ i }</a>'
+        return str(m.group(1) or '') + link
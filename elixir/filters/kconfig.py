@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number, filename
 # `source "path/file"`
 # Example: u-boot/v2023.10/source/Kconfig#L10
 class KconfigFilter(Filter):
+    required_text = 'source'
+    placeholder_regex = re.compile('__KEEPKCONFIG__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.kconfig = []
@@ -21,10 +24,6 @@ class KconfigFilter(Filter):
 
         return re.sub('^(\s*)(source)(\s*)\"([\w/_\.-]+)\"', keep_kconfig, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_kconfig(m):
-            w = self.kconfig[decode_number(m.group(1)) - 1]
-            return f'<a href="{ ctx.get_absolute_source_url(w) }">{ w }</a>'
-
-        return re.sub('__KEEPKCONFIG__([A-J]+)', replace_kconfig, html, flags=re.MULTILINE)
-
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.kconfig[decode_number(m.group(1)) - 1]
+        return f'<a href="{ ctx.get_absolute_source_url(w) }">{ w }</a>'
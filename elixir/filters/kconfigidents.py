@@ -7,6 +7,9 @@ from .utils import Filter, FilterContext, encode_number, decode_number
 # Example: u-boot/v2023.10/source/Kconfig#L17
 # Note: Prepends identifier with CONFIG_
 class KconfigIdentsFilter(Filter):
+    required_text = '\033[31mCONFIG_'
+    placeholder_regex = re.compile('__(<.+?>)?KEEPKCONFIGIDENTS__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.kconfigidents = []
@@ -18,16 +21,12 @@ class KconfigIdentsFilter(Filter):
 
       return re.sub('\033\[31m(?=CONFIG_)(.*?)\033\[0m', keep_kconfigidents, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_kconfigidents(m):
-            i = self.kconfigidents[decode_number(m.group(2)) - 1]
-
-            n = i
-            #Remove the CONFIG_ when we are in a Kconfig file
-            if ctx.family == 'K':
-                n = n[7:]
-
-            return f'{ m.group(1) or "" }<a class="ident" href="{ ctx.get_ident_url(i, "K") }">{ n }</a>'
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        i = self.kconfigidents[decode_number(m.group(2)) - 1]
 
-        return re.sub('__(<.+?>)?KEEPKCONFIGIDENTS__([A-J]+)', replace_kconfigidents, html, flags=re.MULTILINE)
+        n = i
+        #Remove the CONFIG_ when we are in a Kconfig file
+        if ctx.family == 'K':
+            n = n[7:]
 
+        return f'{ m.group(1) or "" }<a class="ident" href="{ ctx.get_ident_url(i, "K") }">{ n }</a>'
@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, decode_number, encode_number, filename
 # obj-$(VALUE) += dir/
 # Example: u-boot/v2023.10/source/Makefile#L867
 class MakefileDirFilter(Filter):
+    required_text = '/'
+    placeholder_regex = re.compile('__KEEPMAKEFILEDIR__([A-J]+)/', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.makefiledir = []
@@ -21,7 +24,7 @@ class MakefileDirFilter(Filter):
             if filedir != '/':
                 filedir += '/'
 
-            if ctx.query.file_exists(ctx.tag, filedir + m.group(1) + '/Makefile'):
+            if ctx.file_exists(filedir + m.group(1) + '/Makefile'):
                 self.makefiledir.append(m.group(1))
                 return f'__KEEPMAKEFILEDIR__{ encode_number(len(self.makefiledir)) }/{ m.group(2) }'
             else:
@@ -29,17 +32,13 @@ class MakefileDirFilter(Filter):
 
         return re.sub('(?<=\s)([-\w/]+)/(\s+|$)', keep_makefiledir, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_makefiledir(m):
-            w = self.makefiledir[decode_number(m.group(1)) - 1]
-            filedir = dirname(ctx.filepath)
-
-            if filedir != '/':
-                filedir += '/'
-
-            fpath = f'{ filedir }{ w }/Makefile'
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.makefiledir[decode_number(m.group(1)) - 1]
+        filedir = dirname(ctx.filepath)
 
-            return f'<a href="{ ctx.get_absolute_source_url(fpath) }">{ w }/</a>'
+        if filedir != '/':
+            filedir += '/'
 
-        return re.sub('__KEEPMAKEFILEDIR__([A-J]+)/', replace_makefiledir, html, flags=re.MULTILINE)
+        fpath = f'{ filedir }{ w }/Makefile'
 
+        return f'<a href="{ ctx.get_absolute_source_url(fpath) }">{ w }/</a>'
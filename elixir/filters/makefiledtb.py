@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, decode_number, encode_number, filename
 # dtb-y += file.dtb
 # Example: u-boot/v2023.10/source/Makefile#L992
 class MakefileDtbFilter(Filter):
+    required_text = '.dtb'
+    placeholder_regex = re.compile('__KEEPMAKEFILEDTB__([A-J]+)\.dtb', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.makefiledtb = []
@@ -21,16 +24,12 @@ class MakefileDtbFilter(Filter):
 
         return re.sub('(?<=\s)([-\w/+\.]+)\.dtb', keep_makefiledtb, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_makefiledtb(m):
-            w = self.makefiledtb[decode_number(m.group(1)) - 1]
-            filedir = dirname(ctx.filepath)
-
-            if filedir != '/':
-                filedir += '/'
-
-            npath = f'{ filedir }{ w }.dts'
-            return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }.dtb</a>'
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.makefiledtb[decode_number(m.group(1)) - 1]
+        filedir = dirname(ctx.filepath)
 
-        return re.sub('__KEEPMAKEFILEDTB__([A-J]+)\.dtb', replace_makefiledtb, html, flags=re.MULTILINE)
+        if filedir != '/':
+            filedir += '/'
 
+        npath = f'{ filedir }{ w }.dts'
+        return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }.dtb</a>'
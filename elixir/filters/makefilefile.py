@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, decode_number, encode_number, filename
 # path/file
 # Example: u-boot/v2023.10/source/Makefile#L1509
 class MakefileFileFilter(Filter):
+    required_text = '/'
+    placeholder_regex = re.compile('__KEEPMAKEFILEFILE__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.makefilefile = []
@@ -21,7 +24,7 @@ class MakefileFileFilter(Filter):
             if filedir != '/':
                 filedir += '/'
 
-            if ctx.query.file_exists(ctx.tag, filedir + m.group(1)):
+            if ctx.file_exists(filedir + m.group(1)):
                 self.makefilefile.append(m.group(1))
                 return f'__KEEPMAKEFILEFILE__{ encode_number(len(self.makefilefile)) }{ m.group(2) }'
             else:
@@ -29,16 +32,12 @@ class MakefileFileFilter(Filter):
 
         return re.sub('(?:(?<=\s|=)|(?<=-I))(?!/)([-\w/]+/[-\w\.]+)(\s+|\)|$)', keep_makefilefile, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_makefilefile(m):
-            w = self.makefilefile[decode_number(m.group(1)) - 1]
-            filedir = dirname(ctx.filepath)
-
-            if filedir != '/':
-                filedir += '/'
-
-            npath = filedir + w
-            return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }</a>'
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.makefilefile[decode_number(m.group(1)) - 1]
+        filedir = dirname(ctx.filepath)
 
-        return re.sub('__KEEPMAKEFILEFILE__([A-J]+)', replace_makefilefile, html, flags=re.MULTILINE)
+        if filedir != '/':
+            filedir += '/'
 
+        npath = filedir + w
+        return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }</a>'
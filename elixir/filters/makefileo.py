@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, decode_number, encode_number, filename
 # file.o
 # Example: u-boot/v2023.10/source/Makefile#L1767
 class MakefileOFilter(Filter):
+    required_text = '.o'
+    placeholder_regex = re.compile('__KEEPMAKEFILEO__([A-J]+)\.o', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.makefileo = []
@@ -21,16 +24,12 @@ class MakefileOFilter(Filter):
 
         return re.sub('(?<=\s)([-\w/]+)\.o(?!\w)(?! :?=)', keep_makefileo, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_makefileo(m):
-            w = self.makefileo[decode_number(m.group(1)) - 1]
-
-            filedir = dirname(ctx.filepath)
-            if filedir != '/':
-                filedir += '/'
-
-            npath = f'{ filedir }{ w }.c'
-            return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }.o</a>'
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.makefileo[decode_number(m.group(1)) - 1]
 
-        return re.sub('__KEEPMAKEFILEO__([A-J]+)\.o', replace_makefileo, html, flags=re.MULTILINE)
+        filedir = dirname(ctx.filepath)
+        if filedir != '/':
+            filedir += '/'
 
+        npath = f'{ filedir }{ w }.c'
+        return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }.o</a>'
@@ -6,6 +6,9 @@ from .utils import Filter, FilterContext, decode_number, encode_number, filename
 # subdir-y += dir
 # Example: u-boot/v2023.10/source/examples/Makefile#L9
 class MakefileSubdirFilter(Filter):
+    required_text = 'subdir-y'
+    placeholder_regex = re.compile('__KEEPMAKESUBDIR__([A-J]+)', flags=re.MULTILINE)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.makefilesubdir = []
@@ -22,16 +25,12 @@ class MakefileSubdirFilter(Filter):
 
         return re.sub('(subdir-y)(\s+)(\+=|:=)(\s+)([-\w]+)(\s*|$)', keep_makefilesubdir, code, flags=re.MULTILINE)
 
-    def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        def replace_makefilesubdir(m):
-            w = self.makefilesubdir[decode_number(m.group(1)) - 1]
-            filedir = dirname(ctx.filepath)
-
-            if filedir != '/':
-                filedir += '/'
-
-            npath = f'{ filedir }{ w }/Makefile'
-            return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }</a>'
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        w = self.makefilesubdir[decode_number(m.group(1)) - 1]
+        filedir = dirname(ctx.filepath)
 
-        return re.sub('__KEEPMAKESUBDIR__([A-J]+)', replace_makefilesubdir, html, flags=re.MULTILINE)
+        if filedir != '/':
+            filedir += '/'
 
+        npath = f'{ filedir }{ w }/Makefile'
+        return f'<a href="{ ctx.get_absolute_source_url(npath) }">{ w }</a>'
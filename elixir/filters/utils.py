@@ -1,7 +1,7 @@
 import re
 import os
-from dataclasses import dataclass
-from typing import Callable, List
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
 from ..query import Query
 
 # Context data used by Filters
@@ -11,6 +11,7 @@ from ..query import Query
 # get_ident_url: function that returns URL to identifier passed as argument
 # get_absolute_source_url: function that returns a URL to file with absolute path passed as an argument
 # get_relative_source_url: function that returns a URL to file in directory of current file
+# checked_paths: results of file_exists calls, by path
 @dataclass
 class FilterContext:
     query: Query
@@ -20,6 +21,15 @@ class FilterContext:
     get_ident_url: Callable[[str], str]
     get_absolute_source_url: Callable[[str], str]
     get_relative_source_url: Callable[[str], str]
+    checked_paths: Dict[str, bool] = field(default_factory=dict)
+
+    # Returns True if file exists in the browsed version.
+    # Filters must use this instead of Query.file_exists: results are recorded in
+    # checked_paths, so that cached output can be checked against other versions.
+    def file_exists(self, path: str) -> bool:
+        exists = self.query.file_exists(self.tag, path)
+        self.checked_paths[path] = exists
+        return exists
 
 # Filter interface/base class
 # Filters are used to add extra information, like links, to code formatted into HTML by Pygments.
@@ -27,8 +37,15 @@ class FilterContext:
 # to mark interesting identifiers, for example keywords. How the identifiers are marked is
 # up to the filter, but it's important to be careful to not break formatting.
 # The second part runs on HTML, replacing markings left by the first part with HTML code.
+# Filters usually leave placeholders matched by placeholder_regex, which are replaced by
+# replace_placeholder. Placeholders of all filters are then replaced in a single pass,
+# see untransform_formatted_code in __init__.py.
+# required_text: transform_raw_code is skipped if the code does not contain this string
 # path_exceptions: list of regexes, disables filter if path of the filtered file matches a regex from the list
 class Filter:
+    required_text: str|None = None
+    placeholder_regex: re.Pattern|None = None
+
     def __init__(self, path_exceptions: List[str] = []):
         self.path_exceptions = path_exceptions
 
@@ -49,7 +66,14 @@ class Filter:
     # Replace information left by `transform_raw_code` with target HTML
     # html: HTML output from code formatter
     def untransform_formatted_code(self, ctx: FilterContext, html: str) -> str:
-        return html
+        if self.placeholder_regex is None:
+            return html
+        return self.placeholder_regex.sub(lambda m: self.replace_placeholder(ctx, m), html)
+
+    # Returns HTML code for a placeholder
+    # m: match of placeholder_regex
+    def replace_placeholder(self, ctx: FilterContext, m: re.Match) -> str:
+        return m.group(0)
 
 
 # Returns true if filename from filepath, with removed extension, is in the
@@ -67,27 +91,15 @@ def extension_matches(filepath: str, allowed_extensions) -> bool:
     return file_ext in allowed_extensions
 
 
+encode_table = str.maketrans('0123456789', 'ABCDEFGHIJ')
+decode_table = str.maketrans('ABCDEFGHIJ', '0123456789')
+
 # Encodes an integer into a string of characters (A-J)
 # encode_number(10239) = 'BACDJ'
 def encode_number(number):
-    result = ''
-
-    while number != 0:
-        number, rem = divmod(number, 10)
-        rem = chr(ord('A') + rem)
-        result = rem + result
-
-    return result
+    return str(number).translate(encode_table)
 
 # Decodes a string of characters returned by encode_number into an integer
 # decode_number('BACDJ') = 10239
 def decode_number(string):
-    result = ''
-
-    while string != '':
-        string, char = string[:-1], string[-1]
-        char = str(ord(char) - ord('A'))
-        result = char + result
-
-    return int(result)
-
+    return int(string.translate(decode_table))
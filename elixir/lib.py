@@ -20,6 +20,7 @@
 
 import sys
 import logging
+import threading
 import subprocess, os
 
 logger = logging.getLogger(__name__)
@@ -46,6 +47,238 @@ def scriptLines(*args, env=None):
     del p[-1]
     return p
 
+# Long-lived `git cat-file` process, answering object requests on its stdin.
+# check: if True, runs in --batch-check mode (no object contents)
+class GitCatFile:
+    def __init__(self, repo_dir, check=False):
+        self.repo_dir = repo_dir
+        self.check = check
+        self.proc = None
+
+    def start(self):
+        mode = '--batch-check' if self.check else '--batch'
+        self.proc = subprocess.Popen(('git', '-C', self.repo_dir, 'cat-file', mode),
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def stop(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=1)
+            except Exception:
+                self.proc.kill()
+            self.proc = None
+
+    # Names of objects are written ahead of the answers, but at most
+    # REQUEST_WINDOW bytes of names are left unanswered: if git blocked on
+    # writing answers while this process blocked on writing names to a full pipe,
+    # both would wait forever.
+    REQUEST_WINDOW = 4096
+
+    # Returns a list of (hash, type, size, contents) tuples, None for missing objects.
+    # contents is None in check mode.
+    def request(self, objects):
+        if self.proc is None or self.proc.poll() is not None:
+            self.start()
+
+        names = [autoBytes(o) + b'\n' for o in objects]
+        result = []
+        written = 0
+        pending = 0
+        while len(result) < len(names):
+            start = written
+            while written < len(names) and \
+                    (pending == 0 or pending + len(names[written]) <= self.REQUEST_WINDOW):
+                pending += len(names[written])
+                written += 1
+            if written != start:
+                self.proc.stdin.write(b''.join(names[start:written]))
+                self.proc.stdin.flush()
+
+            result.append(self.read_answer())
+            pending -= len(names[len(result)-1])
+
+        return result
+
+    # Reads the answer to the next requested object, see request
+    def read_answer(self):
+        header = self.proc.stdout.readline()
+        if not header:
+            raise BrokenPipeError('git cat-file exited unexpectedly')
+
+        # "<object> missing" or "<object> ambiguous", the object name may contain spaces
+        if header.endswith((b' missing\n', b' ambiguous\n')):
+            return None
+
+        fields = header.split()
+        hash, type, size = fields[0], fields[1].decode(), int(fields[2])
+        contents = None
+        if not self.check:
+            contents = self.proc.stdout.read(size + 1)[:-1]
+        return (hash, type, size, contents)
+
+# Pool of `git cat-file --batch` and `--batch-check` processes for a repository.
+# Requests from concurrent threads are multiplexed over at most max_workers
+# pairs of processes, processes are restarted if they fail.
+class GitObjectStore:
+    def __init__(self, repo_dir, max_workers=4):
+        self.repo_dir = repo_dir
+        self.max_workers = max_workers
+        self.idle = []
+        self.workers = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.workers >= self.max_workers:
+                self.cond.wait()
+
+            if self.idle:
+                return self.idle.pop()
+
+            self.workers += 1
+            return (GitCatFile(self.repo_dir), GitCatFile(self.repo_dir, check=True))
+
+    def release(self, worker):
+        with self.cond:
+            self.idle.append(worker)
+            self.cond.notify()
+
+    def request(self, objects, check):
+        worker = self.acquire()
+        cat_file = worker[1] if check else worker[0]
+        try:
+            try:
+                return cat_file.request(objects)
+            except (BrokenPipeError, OSError):
+                logger.warning('git cat-file failed in %s, restarting', self.repo_dir)
+                cat_file.stop()
+                return cat_file.request(objects)
+        except:
+            cat_file.stop()
+            raise
+        finally:
+            self.release(worker)
+
+    # Returns contents of the object, or None if it does not exist
+    # obj: object hash or "<revision>:<path>"
+    def get_blob(self, obj):
+        result = self.request((obj,), check=False)[0]
+        return result[3] if result is not None else None
+
+    # Returns (hash, contents) of the object, or (None, None) if it does not exist
+    def get_blob_with_hash(self, obj):
+        result = self.request((obj,), check=False)[0]
+        return (result[0].decode(), result[3]) if result is not None else (None, None)
+
+    # Returns contents of objects in a list, None for objects that do not exist
+    def get_blobs(self, objects):
+        return [r[3] if r is not None else None for r in self.request(objects, check=False)]
+
+    # Returns type of the object (blob, tree, commit...) or None if it does not exist
+    def get_type(self, obj):
+        result = self.request((obj,), check=True)[0]
+        return result[1] if result is not None else None
+
+    # Returns hash of the object, or None if it does not exist
+    def get_hash(self, obj):
+        result = self.request((obj,), check=True)[0]
+        return result[0].decode() if result is not None else None
+
+    # Returns sizes of objects in a list, None for objects that do not exist
+    def get_sizes(self, objects):
+        return [r[2] if r is not None else None for r in self.request(objects, check=True)]
+
+    # Returns a list of (mode, type, name, hash) tuples describing entries
+    # of a tree, or None if the tree does not exist
+    def get_tree(self, obj):
+        result = self.request((obj,), check=False)[0]
+        if result is None or result[1] != 'tree':
+            return None
+
+        hash_len = len(result[0]) // 2
+        contents = result[3]
+        entries = []
+        pos = 0
+        while pos < len(contents):
+            space = contents.index(b' ', pos)
+            nul = contents.index(b'\0', space)
+            mode = contents[pos:space].decode()
+            name = contents[space+1:nul]
+            hash = contents[nul+1:nul+1+hash_len].hex()
+            pos = nul + 1 + hash_len
+
+            if mode == '40000':
+                type = 'tree'
+            elif mode == '160000':
+                type = 'commit'
+            else:
+                type = 'blob'
+
+            entries.append((mode.rjust(6, '0'), type, name, hash))
+
+        return entries
+
+    def close(self):
+        with self.cond:
+            for worker in self.idle:
+                worker[0].stop()
+                worker[1].stop()
+            self.idle = []
+            self.workers = 0
+
+# Coalesces concurrent identical computations of a process: a thread calling run
+# while another one is computing the same key waits for its result instead of
+# computing it again. Results are shared, callers must not modify them.
+class SingleFlight:
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.ok = False
+            self.result = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> Call being computed
+        self.calls = {}
+
+    # Returns the result of func(), or of the call of the thread already computing key
+    def run(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = SingleFlight.Call()
+                self.calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.ok:
+                return call.result
+            # The computation failed, errors are reported by each caller
+            return func()
+
+        try:
+            call.result = func()
+            call.ok = True
+            return call.result
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+git_stores = {}
+git_stores_lock = threading.Lock()
+
+# Returns the GitObjectStore of a repository, shared by the whole process.
+# The number of processes per repository can be set with ELIXIR_GIT_WORKERS.
+def getGitObjectStore(repo_dir):
+    with git_stores_lock:
+        if repo_dir not in git_stores:
+            max_workers = int(os.environ.get('ELIXIR_GIT_WORKERS', 4))
+            git_stores[repo_dir] = GitObjectStore(repo_dir, max_workers)
+        return git_stores[repo_dir]
+
 def unescape(bstr):
     subs = (
         ('\1','\n'),
@@ -21,8 +21,12 @@
 from .lib import script, scriptLines, decode
 from . import lib
 from . import data
+from . import tokenizer
 import os
+import bisect
+import threading
 from collections import OrderedDict
+from functools import lru_cache
 from urllib import parse
 
 from io import BytesIO
@@ -43,6 +47,179 @@ class SymbolInstance(object):
     def __str__(self):
         return self.__repr__()
 
+# Database handles shared by all Query objects of a process.
+# Opening a data.DB means opening every Berkeley DB file of a project, which is
+# too expensive to do on each request. Handles are opened read-only with DB_THREAD,
+# so that they can be used by multiple threads at once, and are reopened when
+# the index on disk changes (new versions added by update.py).
+class DBPool:
+    class Entry:
+        def __init__(self, db, real_dir, stamp):
+            self.db = db
+            self.real_dir = real_dir
+            self.stamp = stamp
+            self.users = 0
+            self.stale = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # data_dir -> Entry
+        self.entries = {}
+        # repo_dir -> DT bindings compatible strings support
+        self.dts_comp_support = {}
+
+    # Returns a value that changes when the index in data_dir is updated,
+    # see data.GENERATION_FILE
+    @staticmethod
+    def get_stamp(data_dir):
+        generation = data.read_generation(data_dir)
+        if generation is not None:
+            return generation
+
+        # Index without generation, versions.db is synced by update.py after each indexed version
+        st = os.stat(os.path.join(data_dir, 'versions.db'))
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get_dts_comp_support(self, query):
+        with self.lock:
+            if query.repo_dir not in self.dts_comp_support:
+                self.dts_comp_support[query.repo_dir] = int(query.script('dts-comp'))
+            return self.dts_comp_support[query.repo_dir]
+
+    # Returns an Entry with open handles for data_dir, release it with release()
+    def acquire(self, data_dir, dtscomp):
+        # data_dir is a symlink to the current snapshot if update.py uses snapshots,
+        # see data.create_snapshot. It is resolved once, so that all handles are
+        # opened in the same snapshot.
+        real_dir = os.path.realpath(data_dir)
+        stamp = self.get_stamp(real_dir)
+
+        with self.lock:
+            entry = self.entries.get(data_dir)
+            if entry is not None and (entry.real_dir != real_dir or entry.stamp != stamp):
+                self.retire(entry)
+                del self.entries[data_dir]
+                entry = None
+
+            if entry is None:
+                db = data.DB(real_dir, readonly=True, dtscomp=dtscomp, shared=True)
+                entry = DBPool.Entry(db, real_dir, stamp)
+                self.entries[data_dir] = entry
+
+            entry.users += 1
+            return entry
+
+    def release(self, entry):
+        with self.lock:
+            entry.users -= 1
+            if entry.stale and entry.users == 0:
+                entry.db.close()
+
+    # Must be called with lock held
+    def retire(self, entry):
+        entry.stale = True
+        if entry.users == 0:
+            entry.db.close()
+
+db_pool = DBPool()
+
+search_ident_flight = lib.SingleFlight()
+
+# Returns the Git revision of a version, see version_rev in script.sh.
+# Versions are immutable, so results are cached by the process.
+@lru_cache(maxsize=4096)
+def get_version_rev(repo_dir, version):
+    env = {
+        **os.environ,
+        "LXR_REPO_DIR": repo_dir,
+    }
+    return decode(script('version-rev', version, env=env)).strip()
+
+# Number of objects of a tree requested at once by get_tree_listing, so that
+# listings of large directories don't keep a git process for long
+TREE_REQUEST_SIZE = 256
+
+# Returns the results of func for objects, requested TREE_REQUEST_SIZE at a time
+def request_chunks(func, objects):
+    result = []
+    for i in range(0, len(objects), TREE_REQUEST_SIZE):
+        result += func(objects[i:i+TREE_REQUEST_SIZE])
+    return result
+
+# Returns a sorted list of (type, name, size, mode, link_target) tuples describing
+# the entries of a tree, directories first. Hidden files are skipped, size is None
+# for directories, link_target is the contents of symlinks and None for other entries.
+# Trees are immutable, so listings are cached by the process.
+@lru_cache(maxsize=1024)
+def get_tree_listing(repo_dir, tree_hash):
+    git = lib.getGitObjectStore(repo_dir)
+    entries = git.get_tree(tree_hash)
+    if entries is None:
+        return []
+
+    blobs = [hash for _, type, _, hash in entries if type == 'blob']
+    sizes = dict(zip(blobs, request_chunks(git.get_sizes, blobs)))
+    links = [hash for mode, _, _, hash in entries if mode == '120000']
+    targets = dict(zip(links, request_chunks(git.get_blobs, links)))
+
+    result = []
+    for mode, type, name, hash in entries:
+        name = decode(name)
+        if name.startswith('.'):
+            continue
+        size = sizes[hash] if type == 'blob' else None
+        link_target = decode(targets[hash]) if mode == '120000' else None
+        result.append((type, name, size, mode, link_target))
+
+    result.sort(key=lambda e: e[1])
+    result.sort(key=lambda e: e[0], reverse=True)
+    return result
+
+# Returns data.read_latest_tags of data_dir, read once per index generation (stamp)
+@lru_cache(maxsize=64)
+def read_latest_tags(data_dir, stamp):
+    return data.read_latest_tags(data_dir)
+
+# Yields indexes of entries equal to id in ids, a sorted list of blob IDs
+def find_entries(ids, id):
+    n = bisect.bisect_left(ids, id)
+    while n < len(ids) and ids[n] == id:
+        yield n
+        n += 1
+
+# Yields (index, id) for the first entry of each blob ID in ids, a sorted list
+def iter_first_entries(ids):
+    prev_id = None
+    for n, id in enumerate(ids):
+        if id != prev_id:
+            yield n, id
+            prev_id = id
+
+class VersionFiles:
+    '''Looks up the paths of blobs in the files of a version. If the version has
+        a BlobSet, blob IDs are looked up in it, and only the paths of the blobs
+        found in the version are read. Otherwise, the whole PathList is decoded.'''
+    def __init__(self, db, version):
+        self.db = db
+        self.version = version
+        self.blob_set = db.vers_blobs.get(version) if db.vers_blobs is not None else None
+        self.paths = None
+
+    # Returns the paths of blob id in this version, sorted
+    def get_paths(self, id):
+        if self.blob_set is None:
+            if self.paths is None:
+                self.paths = self.db.vers.get(self.version)
+            ids = self.paths.get_ids()
+            return [self.paths.get_path(n) for n in find_entries(ids, id)]
+
+        start, end, hint = self.blob_set.find(id)
+        if start == end:
+            return []
+        if self.paths is None:
+            self.paths = self.db.vers.get(self.version)
+        return [self.paths.get_path_at(n, hint) for n in range(start, end)]
+
 # Returns a Query class instance or None if project data directory does not exist
 # basedir: absolute path to parent directory of all project data directories, ex. "/srv/elixir-data/"
 # project: name of the project, directory in basedir, ex. "linux"
@@ -53,15 +230,29 @@ def get_query(basedir, project):
     if not os.path.exists(datadir) or not os.path.exists(repodir):
         return None
 
-    return Query(datadir, repodir)
+    return Query(datadir, repodir, pool=db_pool)
 
 class Query:
-    def __init__(self, data_dir, repo_dir):
+    # pool: optional DBPool, database handles are opened for this Query only if not set
+    # stamp: DBPool.get_stamp of the index when the databases were opened, caches of
+    #   results depending on the index should be keyed by it
+    def __init__(self, data_dir, repo_dir, pool=None):
         self.repo_dir = repo_dir
         self.data_dir = data_dir
-        self.dts_comp_support = int(self.script('dts-comp'))
-        self.db = data.DB(data_dir, readonly=True, dtscomp=self.dts_comp_support)
+        self.pool = pool
+        if pool is not None:
+            self.dts_comp_support = pool.get_dts_comp_support(self)
+            self.pool_entry = pool.acquire(data_dir, self.dts_comp_support)
+            self.db = self.pool_entry.db
+            self.data_dir = self.pool_entry.real_dir
+            self.stamp = self.pool_entry.stamp
+        else:
+            self.dts_comp_support = int(self.script('dts-comp'))
+            self.data_dir = os.path.realpath(data_dir)
+            self.stamp = DBPool.get_stamp(self.data_dir)
+            self.db = data.DB(self.data_dir, readonly=True, dtscomp=self.dts_comp_support)
         self.file_cache = {}
+        self.git = lib.getGitObjectStore(repo_dir)
 
     def script(self, *args):
         return script(*args, env=self.getEnv())
@@ -76,8 +267,18 @@ class Query:
             "LXR_DATA_DIR": self.data_dir,
         }
 
+    # Returns the name of the object at path in version, in a format understood by git cat-file
+    # Example: v3.1-rc10 /Makefile -> v3.1-rc10:Makefile
+    def get_object_name(self, version, path):
+        return get_version_rev(self.repo_dir, version) + ':' + path[1:]
+
     def close(self):
-        self.db.close()
+        if self.pool is not None:
+            if self.pool_entry is not None:
+                self.pool.release(self.pool_entry)
+                self.pool_entry = None
+        else:
+            self.db.close()
 
     # Check if a dts compatible string exists
     def dts_comp_exists(self, ident):
@@ -88,6 +289,11 @@ class Query:
 
     # Returns True if file exists
     def file_exists(self, version, path):
+        path_index = self.db.vers_paths.get(version)
+        if path_index is not None:
+            return path.strip('/') in path_index
+
+        # Versions indexed by older versions of Elixir have no path index
         if version not in self.file_cache:
             version_cache = set()
             last_dir = None
@@ -112,57 +318,96 @@ class Query:
         if family != None:
             assert family in lib.CACHED_DEFINITIONS_FAMILIES, f"family {family} must have its definitions cached"
 
-            buffer = BytesIO()
-            tokens = self.scriptLines('tokenize-file', version, path, family)
-            even = True
+            hash, code = self.git.get_blob_with_hash(self.get_object_name(version, path))
+            if code is None:
+                return ''
 
             prefix = b''
             if family == 'K':
                 prefix = b'CONFIG_'
 
+            token_list = self.get_token_list(hash, family)
+            if token_list is not None:
+                return decode(self.mark_tokens(code, token_list, family, prefix))
+
+            buffer = BytesIO()
+            tokens = tokenizer.split_tokens(code, family)
+            even = True
+
             for tok in tokens:
                 even = not even
                 tok2 = prefix + tok
                 if even and self.db.defs_cache[family].exists(tok2):
                     tok = b'\033[31m' + tok2 + b'\033[0m'
-                else:
-                    tok = lib.unescape(tok)
                 buffer.write(tok)
             return decode(buffer.getvalue())
         else:
-            return decode(self.script('get-file', version, path))
-
-    # Returns the contents (trees or blobs) of the specified directory
+            return self.get_file_raw(version, path)
+
+    # Returns the TokenList of blob hash stored by update.py, or None if it
+    # does not exist or was created for another family
+    def get_token_list(self, hash, family):
+        if self.db.tokens is None or not self.db.blob.exists(hash):
+            return None
+
+        token_list = self.db.tokens.get(self.db.blob.get(hash))
+        if token_list is None or token_list.get_family() != family:
+            return None
+        return token_list
+
+    # Returns code with the identifiers of token_list that have a definition
+    # marked, like get_tokenized_file
+    def mark_tokens(self, code, token_list, family, prefix):
+        defined = list(token_list.defined)
+        # Only identifiers that had no definition when the list was created
+        # may have one now
+        if token_list.generation != data.get_defs_cache_generation(self.db, family):
+            for n, is_defined in enumerate(defined):
+                if not is_defined:
+                    ident = prefix + token_list.get_ident(code, n)
+                    defined[n] = self.db.defs_cache[family].exists(ident)
+
+        replacements = []
+        for n, is_defined in enumerate(defined):
+            ident = token_list.get_ident(code, n)
+            if is_defined:
+                ident = b'\033[31m' + prefix + ident + b'\033[0m'
+            replacements.append(ident)
+
+        buffer = BytesIO()
+        pos = 0
+        for n, offset in token_list.iter():
+            buffer.write(code[pos:offset])
+            buffer.write(replacements[n])
+            pos = offset + token_list.lengths[n]
+        buffer.write(code[pos:token_list.end])
+        return buffer.getvalue()
+
+    # Returns the contents (trees or blobs) of the directory at path in version,
+    # as (type, name, size, mode, link_target) tuples, see get_tree_listing
     # Example: v3.1-rc10 /arch
     def get_dir_contents(self, version, path):
-        entries_str =  decode(self.script('get-dir', version, path))
-        return entries_str.split("\n")[:-1]
-
-    # Returns indexed versions, as a tree of OrderedDict.
-    # It has a depth of 3, for example: v3 v3.1 v3.1-rc10.
+        hash = self.git.get_hash(self.get_object_name(version, path))
+        if hash is None:
+            return []
+        return get_tree_listing(self.repo_dir, hash)
+
+    # Returns the indexed versions grouped by top menu and submenu, as a tree of
+    # OrderedDict with a depth of 3, for example: v3 v3.1 v3.1-rc10.
+    # The tree is stored by update.py, tags are only listed for older indexes.
     def get_versions(self):
         versions = OrderedDict()
 
-        for line in self.scriptLines('list-tags', '-h'):
-            taginfo = decode(line).split(' ')
-            num = len(taginfo)
-            topmenu, submenu = 'FIXME', 'FIXME'
-
-            if num == 1:
-                tag, = taginfo
-            elif num == 2:
-                submenu, tag = taginfo
-            elif num == 3:
-                topmenu, submenu, tag = taginfo
-            else:
-                raise Exception("unexpected number of fields in taginfo")
+        tree = data.read_versions_tree(self.data_dir)
+        if tree is None:
+            tree = data.find_versions_tree(self.db, self.scriptLines('list-tags', '-h'))
 
-            if self.db.vers.exists(tag):
-                if topmenu not in versions:
-                    versions[topmenu] = OrderedDict()
-                if submenu not in versions[topmenu]:
-                    versions[topmenu][submenu] = []
-                versions[topmenu][submenu].append(tag)
+        for topmenu, submenu, tag in tree:
+            if topmenu not in versions:
+                versions[topmenu] = OrderedDict()
+            if submenu not in versions[topmenu]:
+                versions[topmenu][submenu] = []
+            versions[topmenu][submenu].append(tag)
 
         return versions
 
@@ -173,153 +418,208 @@ class Query:
     # > ./query.py type v3.1-rc10 /arch
     # tree
     def get_file_type(self, version, path):
-        return decode(self.script('get-type', version, path)).strip()
-
-    # Returns identifier search results
-    def search_ident(self, version, ident, family):
+        return self.git.get_type(self.get_object_name(version, path)) or ''
+
+    # Returns the hash of the object at path in version, or None if it does not exist
+    def get_file_hash(self, version, path):
+        return self.git.get_hash(self.get_object_name(version, path))
+
+    # Returns identifier search results: definitions, references and documentation
+    # comments of ident in the files of version whose path starts with path_prefix,
+    # and whether ident exists. References are sorted by path, only those after the
+    # path cursor are returned if it is set, and at most limit of them if it is set.
+    # Concurrent identical searches of the process are only computed once
+    def search_ident(self, version, ident, family, path_prefix='', cursor=None, limit=None):
+        key = (self.data_dir, self.stamp, version, ident, family, path_prefix)
+        symbol_definitions, symbol_references, symbol_doccomments, symbol_exists = search_ident_flight.run(
+                key, lambda: self.find_ident(version, ident, family, path_prefix))
+
+        # Results are shared with concurrent searches, and must not be modified
+        if cursor is not None:
+            start = bisect.bisect_right(symbol_references, cursor, key=lambda sym: sym.path)
+            symbol_references = symbol_references[start:]
+        if limit is not None:
+            symbol_references = symbol_references[:limit]
+
+        return symbol_definitions, symbol_references, symbol_doccomments, symbol_exists
+
+    # files_this_version: optional VersionFiles of version, to share between searches
+    def find_ident(self, version, ident, family, path_prefix='', files_this_version=None):
         # DT bindings compatible strings are handled differently
         if family == 'B':
-            return self.get_idents_comps(version, ident)
+            return self.get_idents_comps(version, ident, path_prefix, files_this_version)
+        else:
+            return self.get_idents_defs(version, ident, family, path_prefix, files_this_version)
+
+    # Yields search results of find_ident for each (ident, family) of idents.
+    # The files of version are looked up once for all identifiers.
+    def search_idents(self, version, idents, path_prefix=''):
+        files_this_version = VersionFiles(self.db, version)
+        for ident, family in idents:
+            yield self.find_ident(version, ident, family, path_prefix, files_this_version)
+
+    # Yields (kind, path, line, type) for the definitions, references and documentation
+    # comments of ident in the files of version whose path starts with path_prefix,
+    # as they are found in the databases, without sorting them.
+    # kind is 'definitions', 'references' or 'documentations'.
+    def iter_ident(self, version, ident, family, path_prefix=''):
+        if family == 'B':
+            return self.iter_idents_comps(version, ident, path_prefix)
         else:
-            return self.get_idents_defs(version, ident, family)
+            return self.iter_idents_defs(version, ident, family, path_prefix)
 
     # Returns the latest tag that is included in the database.
     # This excludes release candidates if `rc` is False.
+    # The tag is stored by update.py, tags are only listed for older indexes.
     def get_latest_tag(self, rc):
+        latest_tags = read_latest_tags(self.data_dir, self.stamp)
+        if latest_tags is not None:
+            return latest_tags[rc]
+
         if rc:
             sorted_tags = list(reversed(self.scriptLines('list-tags')))
         else:
             sorted_tags = self.scriptLines('get-latest-tags')
 
-        for tag in sorted_tags:
-            if self.db.vers.exists(tag):
-                return tag.decode()
-
         # return the oldest tag, even if it does not exist in the database
-        return sorted_tags[-1].decode()
+        return data.find_latest_tag(self.db, sorted_tags).decode()
 
     def get_file_raw(self, version, path):
-        return decode(self.script('get-file', version, path))
-
-    def get_idents_comps(self, version, ident):
-
-        # DT bindings compatible strings are handled differently
-        # They are defined in C files
-        # Used in DT files
-        # Documented in documentation files
-        symbol_c = []
-        symbol_dts = []
-        symbol_docs = []
+        return decode(self.git.get_blob(self.get_object_name(version, path)) or b'')
 
+    def iter_idents_comps(self, version, ident, path_prefix='', files_this_version=None):
         # DT compatible strings are quoted in the database
         ident = parse.quote(ident)
 
         if not self.dts_comp_support or not self.db.comps.exists(ident):
-            return symbol_c, symbol_dts, symbol_docs, False
+            return
 
-        files_this_version = self.db.vers.get(version).iter()
-        comps = self.db.comps.get(ident).iter(dummy=True)
+        if files_this_version is None:
+            files_this_version = VersionFiles(self.db, version)
+        comps = self.db.comps.get(ident)
 
         if self.db.comps_docs.exists(ident):
-            comps_docs = self.db.comps_docs.get(ident).iter(dummy=True)
+            comps_docs = self.db.comps_docs.get(ident)
         else:
-            comps_docs = data.RefList().iter(dummy=True)
+            comps_docs = data.RefList()
+
+        for n, file_idx in iter_first_entries(comps.get_ids()):
+            comps_family = comps.get_family(n)
+            if comps_family == 'C':
+                # C/CPP/ASM files
+                kind, type = 'definitions', 'compatible'
+            elif comps_family == 'D':
+                # DT files
+                kind, type = 'references', None
+            else:
+                continue
+            for path in files_this_version.get_paths(file_idx):
+                if path.startswith(path_prefix):
+                    yield kind, path, comps.get_lines(n), type
+
+        # DT bindings docs files
+        for n, file_idx in iter_first_entries(comps_docs.get_ids()):
+            for path in files_this_version.get_paths(file_idx):
+                if path.startswith(path_prefix):
+                    yield 'documentations', path, comps_docs.get_lines(n), None
 
-        comps_idx, comps_lines, comps_family = next(comps)
-        comps_docs_idx, comps_docs_lines, comps_docs_family = next(comps_docs)
-        compsCBuf = [] # C/CPP/ASM files
-        compsDBuf = [] # DT files
-        compsBBuf = [] # DT bindings docs files
+    def get_idents_comps(self, version, ident, path_prefix='', files_this_version=None):
 
-        for file_idx, file_path in files_this_version:
-            while comps_idx < file_idx:
-                comps_idx, comps_lines, comps_family = next(comps)
+        # DT bindings compatible strings are handled differently
+        # They are defined in C files
+        # Used in DT files
+        # Documented in documentation files
+        symbol_c = []
+        symbol_dts = []
+        symbol_docs = []
 
-            while comps_docs_idx < file_idx:
-                comps_docs_idx, comps_docs_lines, comps_docs_family = next(comps_docs)
+        if not self.dts_comp_support or not self.db.comps.exists(parse.quote(ident)):
+            return symbol_c, symbol_dts, symbol_docs, False
 
-            if comps_idx == file_idx:
-                if comps_family == 'C':
-                    compsCBuf.append((file_path, comps_lines))
-                elif comps_family == 'D':
-                    compsDBuf.append((file_path, comps_lines))
+        compsBuf = {
+            'definitions': [], # C/CPP/ASM files
+            'references': [], # DT files
+            'documentations': [], # DT bindings docs files
+        }
 
-            if comps_docs_idx == file_idx:
-                compsBBuf.append((file_path, comps_docs_lines))
+        for kind, path, lines, _ in self.iter_idents_comps(version, ident, path_prefix, files_this_version):
+            compsBuf[kind].append((path, lines))
 
-        for path, cline in sorted(compsCBuf):
+        for path, cline in sorted(compsBuf['definitions']):
             symbol_c.append(SymbolInstance(path, cline, 'compatible'))
 
-        for path, dlines in sorted(compsDBuf):
+        for path, dlines in sorted(compsBuf['references']):
             symbol_dts.append(SymbolInstance(path, dlines))
 
-        for path, blines in sorted(compsBBuf):
+        for path, blines in sorted(compsBuf['documentations']):
             symbol_docs.append(SymbolInstance(path, blines))
 
         return symbol_c, symbol_dts, symbol_docs, True
 
-    def get_idents_defs(self, version, ident, family):
+    def iter_idents_defs(self, version, ident, family, path_prefix='', files_this_version=None):
+        if not self.db.defs.exists(ident) or not self.db.vers.exists(version):
+            return
 
-        symbol_definitions = []
-        symbol_references = []
-        symbol_doccomments = []
-
-        if not self.db.defs.exists(ident):
-            return symbol_definitions, symbol_references, symbol_doccomments, False
-
-        if not self.db.vers.exists(version):
-            return symbol_definitions, symbol_references, symbol_doccomments, True
-
-        files_this_version = self.db.vers.get(version).iter()
+        if files_this_version is None:
+            files_this_version = VersionFiles(self.db, version)
         this_ident = self.db.defs.get(ident)
-        defs_this_ident = this_ident.iter(dummy=True)
         macros_this_ident = this_ident.get_macros()
         # FIXME: see why we can have a discrepancy between defs_this_ident and refs
         if self.db.refs.exists(ident):
-            refs = self.db.refs.get(ident).iter(dummy=True)
+            refs = self.db.refs.get(ident)
         else:
-            refs = data.RefList().iter(dummy=True)
+            refs = data.RefList()
 
         if self.db.docs.exists(ident):
-            docs = self.db.docs.get(ident).iter(dummy=True)
+            docs = self.db.docs.get(ident)
         else:
-            docs = data.RefList().iter(dummy=True)
+            docs = data.RefList()
+
+        # There is a one-to-one mapping between blob hashes and idx values.
+        # Therefore, we can look up the entries of defs, refs, and docs in the
+        # files of this version, which are usually much more numerous.
+
+        # Definitions are only reported for the first path of a blob
+        for def_idx, def_type, def_line, def_family in this_ident.iter():
+            if (def_family == family or family == 'A'
+                or lib.compatibleMacro(macros_this_ident, family)):
+                paths = files_this_version.get_paths(def_idx)
+                if len(paths) != 0 and paths[0].startswith(path_prefix):
+                    yield 'definitions', paths[0], def_line, def_type
+
+        for n, ref_idx in iter_first_entries(refs.get_ids()):
+            ref_family = refs.get_family(n)
+            if lib.compatibleFamily(family, ref_family) or family == 'A':
+                for path in files_this_version.get_paths(ref_idx):
+                    if path.startswith(path_prefix):
+                        yield 'references', path, refs.get_lines(n), None
+
+        # TODO should all entries of a blob be reported, not only the first one?
+        for n, doc_idx in iter_first_entries(docs.get_ids()):
+            for path in files_this_version.get_paths(doc_idx):
+                if path.startswith(path_prefix):
+                    yield 'documentations', path, docs.get_lines(n), None
+
+    def get_idents_defs(self, version, ident, family, path_prefix='', files_this_version=None):
 
-        # vers, defs, refs, and docs are all populated by update.py in order of
-        # idx, and there is a one-to-one mapping between blob hashes and idx
-        # values.  Therefore, we can sequentially step through the defs, refs,
-        # and docs for each file in a version.
+        symbol_definitions = []
+        symbol_references = []
+        symbol_doccomments = []
 
-        def_idx, def_type, def_line, def_family = next(defs_this_ident)
-        ref_idx, ref_lines, ref_family = next(refs)
-        doc_idx, doc_line, doc_family = next(docs)
+        if not self.db.defs.exists(ident):
+            return symbol_definitions, symbol_references, symbol_doccomments, False
 
         dBuf = []
         rBuf = []
         docBuf = []
 
-        for file_idx, file_path in files_this_version:
-            # Advance defs, refs, and docs to the current file
-            while def_idx < file_idx:
-                def_idx, def_type, def_line, def_family = next(defs_this_ident)
-            while ref_idx < file_idx:
-                ref_idx, ref_lines, ref_family = next(refs)
-            while doc_idx < file_idx:
-                doc_idx, doc_line, doc_family = next(docs)
-
-            # Copy information about this identifier into dBuf, rBuf, and docBuf.
-            while def_idx == file_idx:
-                if (def_family == family or family == 'A'
-                    or lib.compatibleMacro(macros_this_ident, family)):
-                    dBuf.append((file_path, def_type, def_line))
-                def_idx, def_type, def_line, def_family = next(defs_this_ident)
-
-            if ref_idx == file_idx:
-                if lib.compatibleFamily(family, ref_family) or family == 'A':
-                    rBuf.append((file_path, ref_lines))
-
-            if doc_idx == file_idx: # TODO should this be a `while`?
-                docBuf.append((file_path, doc_line))
+        for kind, path, line, type in self.iter_idents_defs(version, ident, family, path_prefix, files_this_version):
+            if kind == 'definitions':
+                dBuf.append((path, type, line))
+            elif kind == 'references':
+                rBuf.append((path, line))
+            else:
+                docBuf.append((path, line))
 
         # Sort dBuf by path name before sorting by type in the loop
         dBuf.sort()
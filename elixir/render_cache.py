@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# On-disk cache of rendered source files, shared by all web server processes.
+# Each entry is a file named after the hash of its key, that starts with a JSON
+# header line followed by the cached text. Reading an entry updates its
+# modification time, and the least recently used entries are removed when the
+# size of the cache goes over max_size.
+class RenderCache:
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Bytes written by this process since the size of the cache was last checked
+        self.written = 0
+
+    def get_entry_path(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    # Returns (text, metadata) stored for key, or None if there is no entry
+    def get(self, key):
+        path = self.get_entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                if header['key'] != key:
+                    return None
+                text = f.read().decode()
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return text, header['metadata']
+
+    # Stores text and metadata, a JSON-serializable object, for key
+    def put(self, key, text, metadata):
+        path = self.get_entry_path(key)
+        contents = json.dumps({'key': key, 'metadata': metadata}).encode() + b'\n' + text.encode()
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(contents)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning('could not write to render cache %s: %s', self.cache_dir, e)
+            return
+
+        with self.lock:
+            self.written += len(contents)
+            check_size = self.written > self.max_size // 16
+            if check_size:
+                self.written = 0
+
+        if check_size:
+            self.evict()
+
+    # Returns a context manager holding a lock shared by all processes, that
+    # should be held to render the text of key after a cache miss. Keys are
+    # mapped to one of 256 lock files, so a few unrelated keys share a lock.
+    @contextlib.contextmanager
+    def render_lock(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        with open(os.path.join(self.cache_dir, '.lock-' + name[:2]), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    # Removes the least recently used entries until the cache uses at most 90%
+    # of max_size. Skipped if another process is already doing it.
+    def evict(self):
+        with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return
+                raise
+
+            entries = []
+            total = 0
+            for subdir in os.scandir(self.cache_dir):
+                if not subdir.is_dir():
+                    continue
+                for entry in os.scandir(subdir.path):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+
+            if total <= self.max_size:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size * 0.9:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                total -= size
+
+render_cache = None
+render_cache_lock = threading.Lock()
+
+# Returns the RenderCache of the process, or None if caching is disabled.
+# The cache is enabled by setting ELIXIR_CACHE_DIR, its maximum size in MiB
+# can be set with ELIXIR_CACHE_SIZE.
+def get_render_cache():
+    global render_cache
+    with render_cache_lock:
+        if render_cache is None and os.environ.get('ELIXIR_CACHE_DIR'):
+            cache_dir = os.environ['ELIXIR_CACHE_DIR']
+            max_size = int(os.environ.get('ELIXIR_CACHE_SIZE', 1024)) * 1024 * 1024
+            os.makedirs(cache_dir, exist_ok=True)
+            render_cache = RenderCache(cache_dir, max_size)
+        return render_cache
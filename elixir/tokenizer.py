@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Copyright (C) 2017--2020 Mikaël Bouillot <mikael.bouillot@bootlin.com>
+#  and contributors
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Splits source files into identifiers and everything else (whitespace, punctuation,
+# comments, strings, #include <...> paths). This follows the same rules as the
+# tokenize-file command of script.sh, without the git/tr/perl pipeline.
+
+import re
+
+# Each match is a run of separators (group 1) followed by an optional identifier (group 4).
+# Comments, strings and system includes are kept in separators, so that words
+# inside of them are not considered as identifiers.
+token_regex = re.compile(
+    rb'((/\*.*?\*/|//.*?\n|[^\']"(\\.|.)*?"|# *include *<.*?>|\W)+)(\w+)?',
+    flags=re.DOTALL)
+
+# Don't cut around '-' in devicetrees
+token_regex_dts = re.compile(
+    rb'((/\*.*?\*/|//.*?\n|[^\']"(\\.|.)*?"|# *include *<.*?>|[^\w-])+)([\w-]+)?',
+    flags=re.DOTALL)
+
+# Returns the contents of code as a list of alternating tokens: separators at even
+# indexes, identifiers at odd indexes. Joining the list gives back the original code,
+# except for the last token, which is dropped like in script.sh.
+# code: bytes
+# family: file family, see lib.getFileFamily
+def split_tokens(code, family):
+    regex = token_regex_dts if family == 'D' else token_regex
+
+    tokens = []
+    pos = 0
+    for m in regex.finditer(code):
+        # Code that could not be matched (only possible at the beginning of the file)
+        # is kept with the following separators
+        tokens.append(code[pos:m.end(1)])
+        tokens.append(m.group(4) or b'')
+        pos = m.end()
+
+    # script.sh drops the last line of its output: either unmatched code
+    # left at the end of the file, or the last identifier
+    if tokens and pos == len(code):
+        del tokens[-1]
+
+    return tokens
+
+# Yields (identifier, line number, offset) tuples for identifiers in tokens
+# tokens: list returned by split_tokens
+def iter_token_identifiers(tokens):
+    line_num = 1
+    offset = 0
+    even = True
+    for tok in tokens:
+        even = not even
+        if even:
+            if tok:
+                yield tok, line_num, offset
+        else:
+            line_num += tok.count(b'\n')
+        offset += len(tok)
+
+# Yields (identifier, line number) tuples for identifiers found in code
+# code: bytes
+# family: file family, see lib.getFileFamily
+def iter_identifiers(code, family):
+    for tok, line_num, _ in iter_token_identifiers(split_tokens(code, family)):
+        yield tok, line_num
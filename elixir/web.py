@@ -23,7 +23,6 @@ import os
 import sys
 import re
 import threading
-import time
 import datetime
 from collections import OrderedDict, namedtuple
 from re import search, sub
@@ -32,17 +31,17 @@ from urllib import parse
 import falcon
 import jinja2
 
-from .lib import validFamily, getFileFamily
-from .query import Query, SymbolInstance
-from .filters import get_filters
+from .lib import validFamily, getFileFamily, SingleFlight
+from .query import Query, SymbolInstance, DBPool
+from .filters import get_filters, get_filters_key, transform_raw_code, untransform_formatted_code
 from .filters.utils import FilterContext
 from .autocomplete import AutocompleteResource
-from .api import ApiIdentGetterResource
+from .api import ApiIdentGetterResource, ApiIdentsBatchResource
+from .render_cache import get_render_cache
 from .query import get_query
 from .web_utils import ProjectConverter, IdentConverter, validate_version, validate_project, validate_ident, \
         get_elixir_version_string, get_elixir_repo_url, RequestContext, Config
 
-VERSION_CACHE_DURATION_SECONDS = 2 * 60  # 2 minutes
 ELIXIR_VERSION_STRING = get_elixir_version_string()
 ELIXIR_REPO_LINK = get_elixir_repo_url(ELIXIR_VERSION_STRING)
 
@@ -105,9 +104,8 @@ def get_project_error_page(req, resp, exception: ElixirProjectError):
         project = exception.project
         version = exception.version
 
-        versions_raw = get_versions_cached(query, req.context, project)
-        get_url_with_new_version = lambda v: stringify_source_path(project, v, '/')
-        versions, current_version_path = get_versions(versions_raw, get_url_with_new_version, version)
+        menu = get_versions_menu_cached(query, req.context, project)
+        current_version_path = menu.version_paths.get(version, (None, None, None))
 
         if current_version_path[2] is None:
             # If details about current version are not available, make base links
@@ -115,12 +113,16 @@ def get_project_error_page(req, resp, exception: ElixirProjectError):
             # current_tag is not set to latest to avoid latest being highlighted in the sidebar
             version = query.get_latest_tag(rc=False)
 
+        get_url_with_new_version = lambda v: stringify_source_path(project, v, '/')
+        versions_menu, _ = get_versions_menu(menu, project, get_url_with_new_version,
+                                             exception.version, version)
+
         template_ctx = {
             **template_ctx,
 
             'current_project': project,
             'current_tag': version,
-            'versions': versions,
+            'versions_menu': versions_menu,
             'current_version_path': current_version_path,
 
             'home_page_url': get_source_base_url(project, version),
@@ -237,6 +239,7 @@ class SourceResource:
         if version in ('latest', 'latest-rc'):
             rc = version == 'latest-rc'
             version = query.get_latest_tag(rc=rc)
+            query.close()
             resp.status = falcon.HTTP_FOUND
             resp.location = stringify_source_path(project, version, path)
             return
@@ -279,7 +282,8 @@ class IdentPostRedirectResource:
         get_ident = req.get_param('i', required=False)
         get_family = req.get_param('f', required=False)
         if get_ident is None:
-            project, version, _ = validate_project_and_version(req.context, project, version)
+            project, version, query = validate_project_and_version(req.context, project, version)
+            query.close()
             resp.status = falcon.HTTP_FOUND
             resp.location = stringify_source_path(project, version, "")
         else:
@@ -337,12 +341,15 @@ class IdentResource(IdentPostRedirectResource):
         if version in ('latest', 'latest-rc'):
             rc = version == 'latest-rc'
             version = query.get_latest_tag(rc=rc)
+            query.close()
             resp.status = falcon.HTTP_FOUND
             resp.location = stringify_ident_path(project, version, family, ident)
             return
 
         resp.content_type = falcon.MEDIA_HTML
-        resp.status, resp.text = generate_ident_page(req.context, query, project, version, family, ident)
+        key = (query.data_dir, query.stamp, project, version, family, ident)
+        resp.status, resp.text = ident_page_flight.run(key,
+            lambda: generate_ident_page(req.context, query, project, version, family, ident))
 
         query.close()
 
@@ -441,19 +448,69 @@ def get_versions(versions: OrderedDict[str, OrderedDict[str, str]],
 
     return result, current_version_path
 
-# Caches get_versions result in a context object
-def get_versions_cached(q, ctx, project):
+# Placeholder for the part of URLs after the version in the versions menu
+VERSIONS_MENU_URL_SUFFIX = '\x01'
+# Placeholders for classes of entries of the versions menu
+versions_menu_marker_re = re.compile('\x02[0-9]+\x03')
+
+# Versions menu of the sidebar of a project, rendered once per update of the index
+# stamp: see DBPool.get_stamp
+# html: rendered menu, links end with VERSIONS_MENU_URL_SUFFIX and classes of
+#   entries that can be active are markers
+# markers: dict mapping ('major'|'minor'|'version', name) to markers
+# version_paths: dict mapping versions to (major, minor, version) triples, see get_versions
+VersionsMenu = namedtuple('VersionsMenu', 'stamp, html, markers, version_paths')
+
+# Renders the versions menu of a project for all pages
+# versions: result of Query.get_versions()
+def render_versions_menu(ctx: RequestContext, project: str, versions, stamp) -> VersionsMenu:
+    get_url = lambda v: f'/{ parse.quote(project, safe="") }/{ parse.quote(v, safe="") }{ VERSIONS_MENU_URL_SUFFIX }'
+    versions, _ = get_versions(versions, get_url, None)
+
+    markers = {}
+    def marker(kind, name):
+        if (kind, name) not in markers:
+            markers[(kind, name)] = f'\x02{ len(markers) }\x03'
+        return markers[(kind, name)]
+
+    version_paths = {}
+    for major, minor_versions in versions.items():
+        for minor, patch_versions in minor_versions.items():
+            for v in patch_versions:
+                version_paths[v.version] = (major, minor, v.version)
+
+    html = ctx.jinja_env.get_template('versions.html').render(versions=versions, marker=marker)
+    return VersionsMenu(stamp, html, markers, version_paths)
+
+# Returns the VersionsMenu of a project, cached in a context object until the index is updated
+def get_versions_menu_cached(q: Query, ctx: RequestContext, project: str) -> VersionsMenu:
     with ctx.versions_cache_lock:
-        if project not in ctx.versions_cache:
-            ctx.versions_cache[project] = (time.time(), q.get_versions())
-            cached_versions = ctx.versions_cache[project]
-        else:
-            cached_versions = ctx.versions_cache[project]
-            if time.time()-cached_versions[0] > VERSION_CACHE_DURATION_SECONDS:
-                ctx.versions_cache[project] = (time.time(), q.get_versions())
-                cached_versions = ctx.versions_cache[project]
+        menu = ctx.versions_cache.get(project)
+        if menu is None or menu.stamp != q.stamp:
+            menu = render_versions_menu(ctx, project, q.get_versions(), q.stamp)
+            ctx.versions_cache[project] = menu
+        return menu
+
+# Returns HTML of the versions menu for a page, and the (major, minor, version) triple
+# of current_version, see get_versions
+# get_url_with_new_version: see get_url parameter of get_versions
+# current_tag: version highlighted in the menu
+def get_versions_menu(menu: VersionsMenu, project: str, get_url_with_new_version: Callable[[str], str],
+                      current_version: str, current_tag: str) -> Tuple[str, Tuple[str|None, str|None, str|None]]:
+    current_version_path = menu.version_paths.get(current_version, (None, None, None))
+    current_major, current_minor, _ = current_version_path
+
+    html = menu.html
+    for key in (('major', current_major), ('minor', current_minor), ('version', current_tag)):
+        if key in menu.markers:
+            html = html.replace(menu.markers[key], 'active')
+    html = versions_menu_marker_re.sub('', html)
+
+    url = get_url_with_new_version(VERSION_PLACEHOLDER)
+    url_prefix = f'/{ parse.quote(project, safe="") }/{ parse.quote(VERSION_PLACEHOLDER, safe="") }'
+    html = html.replace(VERSIONS_MENU_URL_SUFFIX, url[len(url_prefix):])
 
-        return cached_versions[1]
+    return html, current_version_path
 
 # Returns template context used by the layout template
 # get_url_with_new_version: see get_url parameter of get_versions
@@ -461,12 +518,13 @@ def get_versions_cached(q, ctx, project):
 # version: version of the project
 def get_layout_template_context(q: Query, ctx: RequestContext, get_url_with_new_version: Callable[[str], str],
                                 project: str, version: str) -> dict[str, Any]:
-    versions_raw = get_versions_cached(q, ctx, project)
-    versions, current_version_path = get_versions(versions_raw, get_url_with_new_version, version)
+    menu = get_versions_menu_cached(q, ctx, project)
+    versions_menu, current_version_path = get_versions_menu(menu, project, get_url_with_new_version,
+                                                            version, parse.unquote(version))
 
     return {
         'projects': get_projects(ctx.config.project_dir),
-        'versions': versions,
+        'versions_menu': versions_menu,
         'current_version_path': current_version_path,
         'topbar_families': TOPBAR_FAMILIES,
         'elixir_version_string': ctx.config.version_string,
@@ -521,12 +579,56 @@ def format_code(filename: str, code: str) -> str:
     )
     return pygments.highlight(code, lexer, formatter)
 
+# Version used in URLs of cached source files, replaced by the browsed version when
+# they are served. Quoted as %00 in URLs, which can't be part of a valid URL path.
+VERSION_PLACEHOLDER = '\0'
+
+# Concurrent requests of the same page, computed once by the process
+source_flight = SingleFlight()
+ident_page_flight = SingleFlight()
+
 # Generate formatted HTML of a file, apply filters (for ex. to add identifier links)
+# Results are stored in the render cache, if enabled, and shared by all versions
+# that contain the same blob at the same path.
 # q: Query object
 # project: name of the requested project
 # version: requested version of the project
 # path: path to the file in the repository
 def generate_source(q: Query, project: str, version: str, path: str) -> str:
+    cache = get_render_cache()
+    hash = q.get_file_hash(version, path) if cache is not None else None
+    if hash is None:
+        return render_source(q, project, version, path, version)[0]
+
+    # Rendering also depends on the index (identifiers with definitions),
+    # on the filters of the project and on the code of Elixir
+    key = ' '.join((ELIXIR_VERSION_STRING, project, path, hash, get_filters_key(project),
+                    str(q.dts_comp_support), str(q.stamp)))
+
+    # Links to other files are only valid for versions where they exist
+    is_valid = lambda cached: cached is not None and \
+            all(q.file_exists(version, p) == exists for p, exists in cached[1].items())
+
+    cached = cache.get(key)
+    if not is_valid(cached):
+        # Other processes rendering the same file at the same time wait for this one
+        with cache.render_lock(key):
+            cached = cache.get(key)
+            if not is_valid(cached):
+                html_code_block, checked_paths = render_source(q, project, version, path, VERSION_PLACEHOLDER)
+                cache.put(key, html_code_block, checked_paths)
+                cached = (html_code_block, checked_paths)
+
+    html_code_block = cached[0]
+
+    project = parse.quote(project, safe="")
+    return html_code_block.replace(f'/{ project }/{ parse.quote(VERSION_PLACEHOLDER, safe="") }/',
+                                   f'/{ project }/{ parse.quote(version, safe="") }/')
+
+# Returns formatted HTML of a file and the results of file existence checks
+# made by filters, see generate_source
+# url_version: version used in URLs
+def render_source(q: Query, project: str, version: str, path: str, url_version: str) -> tuple[str, dict[str, bool]]:
     code = q.get_tokenized_file(version, path)
 
     _, fname = os.path.split(path)
@@ -534,12 +636,12 @@ def generate_source(q: Query, project: str, version: str, path: str) -> str:
     extension = extension[1:].lower()
     family = getFileFamily(fname)
 
-    source_base_url = get_source_base_url(project, version)
+    source_base_url = get_source_base_url(project, url_version)
 
     def get_ident_url(ident, ident_family=None):
         if ident_family is None:
             ident_family = family
-        return stringify_ident_path(project, version, ident_family, ident)
+        return stringify_ident_path(project, url_version, ident_family, ident)
 
     filter_ctx = FilterContext(
         q,
@@ -554,18 +656,16 @@ def generate_source(q: Query, project: str, version: str, path: str) -> str:
     filters = get_filters(filter_ctx, project)
 
     # Apply filters
-    for f in filters:
-        code = f.transform_raw_code(filter_ctx, code)
+    code = transform_raw_code(filter_ctx, filters, code)
 
     html_code_block = format_code(fname, code)
 
     # Replace line numbers by links to the corresponding line in the current file
     html_code_block = sub(r'href="#codeline-(\d+)', 'name="L\\1" id="L\\1" href="#L\\1', html_code_block)
 
-    for f in filters:
-        html_code_block = f.untransform_formatted_code(filter_ctx, html_code_block)
+    html_code_block = untransform_formatted_code(filter_ctx, filters, html_code_block)
 
-    return html_code_block
+    return html_code_block, filter_ctx.checked_paths
 
 # Represents a file entry in git tree
 # type : either tree (directory), blob (file) or symlink
@@ -581,20 +681,17 @@ DirectoryEntry = namedtuple('DirectoryEntry', 'type, name, path, url, size')
 # path: path to the directory in the repository
 def get_directory_entries(q: Query, base_url, tag: str, path: str) -> list[DirectoryEntry]:
     dir_entries = []
-    lines = q.get_dir_contents(tag, path)
 
-    for l in lines:
-        type, name, size, perm = l.split(' ')
+    for type, name, size, mode, link_target in q.get_dir_contents(tag, path):
         file_path = f"{ path }/{ name }"
 
         if type == 'tree':
             dir_entries.append(DirectoryEntry('tree', name, file_path, f"{ base_url }{ file_path }", None))
         elif type == 'blob':
             # 120000 permission means it's a symlink
-            if perm == '120000':
+            if mode == '120000':
                 dir_path = path if path.endswith('/') else path + '/'
-                link_contents = q.get_file_raw(tag, file_path)
-                link_target_path = os.path.abspath(dir_path + link_contents)
+                link_target_path = os.path.abspath(dir_path + link_target)
 
                 dir_entries.append(DirectoryEntry('symlink', name, link_target_path, f"{ base_url }{ link_target_path }", size))
             else:
@@ -630,8 +727,9 @@ def generate_source_page(ctx: RequestContext, q: Query,
         }
         template = ctx.jinja_env.get_template('tree.html')
     elif type == 'blob':
+        key = (q.data_dir, q.stamp, project, version, path)
         template_ctx = {
-            'code': generate_source(q, project, version, path),
+            'code': source_flight.run(key, lambda: generate_source(q, project, version, path)),
             'path': path,
         }
         template = ctx.jinja_env.get_template('source.html')
@@ -829,6 +927,7 @@ def get_application():
 
     app.add_route('/acp', AutocompleteResource())
     app.add_route('/api/ident/{project:project}/{ident:ident}', ApiIdentGetterResource())
+    app.add_route('/api/idents/{project:project}', ApiIdentsBatchResource())
 
     app.add_route('/{project}', IncompleteURLRedirectResource())
     app.add_route('/{project}/{version}', IncompleteURLRedirectResource())
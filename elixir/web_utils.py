@@ -51,7 +51,8 @@ class RequestContext(NamedTuple):
     config: Config
     jinja_env: jinja2.Environment
     logger: logging.Logger
-    versions_cache: Dict[str, str]
+    # project -> web.VersionsMenu
+    versions_cache: Dict[str, Any]
     versions_cache_lock: threading.Lock
 
 def validate_project(project: str) -> str|None:
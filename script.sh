@@ -135,6 +135,15 @@ list_blobs()
     sed -r "s/^\S* blob (\S*)\t(([^/]*\/)*(.*))$/$format/; /^\S* commit .*$/d"
 }
 
+diff_blobs()
+{
+    v1=`echo $opt1 | version_rev`
+    v2=`echo $opt2 | version_rev`
+
+    # Raw output: ":<old mode> <new mode> <old hash> <new hash> <status>\t<path>"
+    git diff-tree -r --no-renames "$v1" "$v2"
+}
+
 untokenize()
 {
     tr -d '\n' |
@@ -251,6 +260,10 @@ case $cmd in
         get_latest_tags
         ;;
 
+    version-rev)
+        echo $opt1 | version_rev
+        ;;
+
     get-type)
         get_type
         ;;
@@ -271,6 +284,10 @@ case $cmd in
         list_blobs
         ;;
 
+    diff-blobs)
+        diff_blobs
+        ;;
+
     tokenize-file)
         tokenize_file
         ;;
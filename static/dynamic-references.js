@@ -1,7 +1,14 @@
 "use strict";
 
+// Maximum number of references shown in the popup, the ident page lists all of them
+const referencesLimit = 1000;
+
 function identUrl(project, ident, version, family) {
-  return `/api/ident/${project}/${ident}?version=${version}&family=${family}`;
+  return `/api/ident/${project}/${ident}?version=${version}&family=${family}&limit=${referencesLimit}`;
+}
+
+function identPageUrl(project, ident, version, family) {
+  return `/${project}/${version}/${family}/ident/${ident}`;
 }
 
 /*
@@ -25,7 +32,10 @@ function identUrl(project, ident, version, family) {
       "line": "15,17,18",
       "type": null
     }
-  ]
+  ],
+  "next": "src/stat/fstatat.c"
+
+  "next" is only set if there are more references than the limit
 */
 
 function generateSymbolDefinitionsHTML(symbolDefinitions, project, version) {
@@ -77,14 +87,18 @@ function generateSymbolDefinitionsHTML(symbolDefinitions, project, version) {
   return result;
 }
 
-function generateSymbolReferencesHTML(symbolReferences, project, version) {
+function generateSymbolReferencesHTML(symbolReferences, moreUrl, project, version) {
   let result = "";
 
   if(symbolReferences.length == 0) {
     return '<h2>No references found in the database</h2>';
   }
 
-  result += '<h2>Referenced in ' + symbolReferences.length.toString() + ' files:</h2>';
+  if (moreUrl !== undefined) {
+    result += '<h2>Referenced in more than ' + symbolReferences.length.toString() + ' files:</h2>';
+  } else {
+    result += '<h2>Referenced in ' + symbolReferences.length.toString() + ' files:</h2>';
+  }
   result += '<ul>';
   for (let sr of symbolReferences) {
     let ln = sr.line.split(',');
@@ -106,6 +120,9 @@ function generateSymbolReferencesHTML(symbolReferences, project, version) {
     }
   }
   result += '</ul>'
+  if (moreUrl !== undefined) {
+    result += `<h2><a href="${moreUrl}">See all references</a></h2>`;
+  }
   return result;
 }
 
@@ -139,14 +156,18 @@ function generateDocCommentsHTML(symbolDocComments, project, version) {
   return result;
 }
 
-function generateReferencesHTML(data, project, version) {
+// moreUrl: URL of the page listing all references, used if they were not all returned
+function generateReferencesHTML(data, moreUrl, project, version) {
   let symbolDefinitions = data["definitions"];
   let symbolReferences = data["references"];
   let symbolDocumentations = data["documentations"];
+  if (data["next"] === undefined) {
+    moreUrl = undefined;
+  }
   return '<div class="lxrident">' +
     generateDocCommentsHTML(symbolDocumentations, project, version) +
     generateSymbolDefinitionsHTML(symbolDefinitions, project, version) +
-    generateSymbolReferencesHTML(symbolReferences, project, version) +
+    generateSymbolReferencesHTML(symbolReferences, moreUrl, project, version) +
     '</div>';
 }
 
@@ -221,7 +242,8 @@ document.addEventListener("DOMContentLoaded", _ => {
           .then(r => r.json());
 
         if(currentPopupId == popupId) {
-          referencePopup.innerHTML = generateReferencesHTML(result, project, version);
+          referencePopup.innerHTML = generateReferencesHTML(result,
+            identPageUrl(project, ident, version, family), project, version);
           showPopup(referencePopup, ev.target);
         }
       } catch(e) {
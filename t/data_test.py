@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks that binary DefList, PathList and RefList values decode to the same
+# entries as the legacy text format, that PostingsBuffer writes them, that
+# versions stored as deltas are read back, that BlobSet finds PathList entries,
+# that TokenList values are read back, that PathIndex finds paths of versions,
+# and that the generation of the index is incremented
+
+import os
+import sys
+import tempfile
+import unittest
+
+elixir_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, elixir_dir)
+
+from elixir import data
+
+class DataTest(unittest.TestCase):
+    def check_roundtrip(self, cls, legacy):
+        entries = list(cls(legacy).iter())
+        packed = cls(legacy).pack()
+        self.assertTrue(data.is_binary(packed))
+        self.assertEqual(list(cls(packed).iter()), entries)
+        return entries
+
+    def test_deflist(self):
+        legacy = b'70000p941C,12f33C,12M40K,3s7C#C,K'
+        entries = self.check_roundtrip(data.DefList, legacy)
+        self.assertEqual(entries, [
+            (3, 'struct', 7, 'C'),
+            (12, 'function', 33, 'C'),
+            (12, 'macro', 40, 'K'),
+            (70000, 'prototype', 941, 'C'),
+        ])
+
+        obj = data.DefList(data.DefList(legacy).pack())
+        self.assertEqual(obj.get_families(), ['C', 'K'])
+        self.assertEqual(obj.get_macros(), ['K'])
+        self.assertEqual(data.DefList().get_macros(), '')
+
+    def test_deflist_append(self):
+        obj = data.DefList()
+        obj.append(5, 'function', 10, 'C')
+        obj.append(2, 'define', 1, 'D')
+        obj.append(5, 'variable', 3, 'C')
+        obj.append(9, 'unknown', 3, 'C')
+        obj = data.DefList(obj.pack())
+        self.assertEqual(list(obj.iter(dummy=True)), [
+            (2, 'define', 1, 'D'),
+            (5, 'function', 10, 'C'),
+            (5, 'variable', 3, 'C'),
+            (data.maxId, None, None, None),
+        ])
+        self.assertEqual(obj.get_families(), ['C', 'D'])
+
+    def test_pathlist(self):
+        legacy = b'1 a.c\n2 dir/b with space.c\n2 dir/copy.c\n300 x\n'
+        entries = self.check_roundtrip(data.PathList, legacy)
+        self.assertEqual(entries, [
+            (1, 'a.c'), (2, 'dir/b with space.c'), (2, 'dir/copy.c'), (300, 'x')])
+
+        obj = data.PathList(data.PathList(legacy).pack())
+        obj.append(300, b'y')
+        obj.append(100000, b'z')
+        obj = data.PathList(obj.pack())
+        self.assertEqual(obj.get_ids(), [1, 2, 2, 300, 300, 100000])
+        self.assertEqual(obj.get_path(4), 'y')
+
+        with self.assertRaises(ValueError):
+            obj.append(1, b'a.c')
+
+    def test_reflist(self):
+        legacy = b'8:3,9,1000:C\n2:70000:K\n8:5:D\n'
+        entries = self.check_roundtrip(data.RefList, legacy)
+        self.assertEqual(entries, [
+            (2, '70000', 'K'), (8, '3,9,1000', 'C'), (8, '5', 'D')])
+
+        obj = data.RefList(data.RefList(legacy).pack())
+        # Unsorted line numbers are kept as is
+        obj.append(4, '7,2', 'M')
+        obj.append(9, '1', 'C')
+        obj = data.RefList(obj.pack())
+        self.assertEqual(obj.get_ids(), [2, 4, 8, 8, 9])
+        self.assertEqual(obj.get_lines(1), '7,2')
+        self.assertEqual(obj.get_family(1), 'M')
+        self.assertEqual(list(obj.iter())[-1], (9, '1', 'C'))
+
+    def test_postings_buffer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = data.BsdDB(tmp + '/references.db', False, data.RefList)
+            obj = data.RefList()
+            obj.append(1, '5', 'C')
+            db.put(b'foo', obj)
+
+            # A limit of 0 spills all entries to temporary files
+            for memory_limit in (0, 1024*1024):
+                with self.subTest(memory_limit=memory_limit):
+                    buf = data.PostingsBuffer(db, memory_limit)
+                    buf.append(b'foo', 3, '1,2', 'C')
+                    buf.append('bar', 2, '4', 'K')
+                    buf.append(b'foo', 2, '7', 'C')
+                    self.assertEqual(buf.flush(), [b'bar', b'foo'])
+
+            self.assertEqual(list(db.get(b'foo').iter()), [
+                (1, '5', 'C'), (2, '7', 'C'), (2, '7', 'C'), (3, '1,2', 'C'), (3, '1,2', 'C')])
+            self.assertEqual(list(db.get(b'bar').iter()), [(2, '4', 'K'), (2, '4', 'K')])
+            db.close()
+
+    def test_versions_delta(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = data.VersionsDB(tmp + '/versions.db', False)
+            base = data.PathList()
+            for id, path in ((1, b'a.c'), (2, b'b.c'), (2, b'copy/b.c'), (3, b'c.c')):
+                base.append(id, path)
+            db.put(b'v1', base)
+
+            delta = data.PathListDelta(base=b'v1', depth=1)
+            delta.removed.append(2, b'copy/b.c')
+            delta.removed.append(3, b'c.c')
+            delta.added.append(2, b'a/b.c')
+            delta.added.append(4, b'c.c')
+            db.put(b'v2', delta)
+
+            delta = data.PathListDelta(base=b'v2', depth=2)
+            delta.added.append(0, b'first.c')
+            db.put(b'v3', delta)
+
+            self.assertEqual(list(db.get(b'v2').iter()), [
+                (1, 'a.c'), (2, 'a/b.c'), (2, 'b.c'), (4, 'c.c')])
+            self.assertEqual(db.get(b'v3').get_ids(), [0, 1, 2, 2, 4])
+            self.assertEqual([db.get_depth(v) for v in (b'v1', b'v2', b'v3')], [0, 1, 2])
+            db.close()
+
+    def test_blob_set(self):
+        # Dense group stored as a bitmap, sparse ones as arrays, and duplicate blobs
+        ids = list(range(0, 10000, 2)) + [10000, 10000, 10000] + [70000, 70000, 70001, 1 << 20]
+        paths = data.PathList()
+        blob_set = data.BlobSet()
+        for n, id in enumerate(ids):
+            path = f'dir/file{n}.c'.encode()
+            paths.append(id, path)
+            blob_set.append(id, path)
+
+        paths = data.PathList(paths.pack())
+        blob_set = data.BlobSet(blob_set.pack())
+        for id in ids + [1, 9999, 10001, 69999, 70002, (1 << 20) + 1]:
+            start, end, hint = blob_set.find(id)
+            self.assertEqual(end - start, ids.count(id))
+            if id in ids:
+                self.assertEqual(start, ids.index(id))
+            for n in range(start, end):
+                self.assertEqual(paths.get_path_at(n, hint), f'dir/file{n}.c')
+        self.assertFalse(paths.decoded)
+
+        blob_set = data.BlobSet()
+        blob_set.append(70000, b'b.c')
+        with self.assertRaises(ValueError):
+            blob_set.append(1, b'a.c')
+
+    def test_token_list(self):
+        code = b'int foo(int bar) {\n\treturn foo(bar + 1);\n}\n'
+        obj = data.TokenList(family='C', end=len(code) - 1)
+        for ident, offset in ((b'int', 0), (b'foo', 4), (b'int', 8), (b'bar', 12),
+                              (b'return', 20), (b'foo', 27), (b'bar', 31)):
+            obj.append(offset, ident)
+        self.assertEqual(obj.get_idents(), [b'int', b'foo', b'bar', b'return'])
+        obj.defined[1] = 1
+        obj.generation = 7
+
+        with self.assertRaises(ValueError):
+            obj.append(30, b'x')
+
+        obj = data.TokenList(obj.pack())
+        self.assertEqual(obj.get_family(), 'C')
+        self.assertEqual((obj.generation, obj.end), (7, len(code) - 1))
+        self.assertEqual(list(obj.defined), [0, 1, 0, 0])
+        self.assertEqual(list(obj.iter()), [(0, 0), (1, 4), (0, 8), (2, 12), (3, 20), (1, 27), (2, 31)])
+        self.assertEqual([obj.get_ident(code, n) for n in range(4)], [b'int', b'foo', b'bar', b'return'])
+
+    def test_path_index(self):
+        entries = [(1, 'Makefile'), (2, 'arch/arm/Makefile'), (2, 'arch/x86/Makefile'),
+                   (3, 'arch/arm/boot/dts/a.dts'), (4, 'arch/arm/Kconfig'), (5, 'dir with space/f.c')]
+        paths = list(data.get_indexed_paths(entries))
+        with tempfile.TemporaryDirectory() as tmp:
+            index_dir = data.PathIndexDir(tmp + '/versions-paths', False)
+            index_dir.put(b'v1/rc', paths)
+            self.assertTrue(index_dir.exists('v1/rc'))
+            self.assertIsNone(index_dir.get(b'v2'))
+
+            index = index_dir.get('v1/rc')
+            self.assertEqual(index.count, len(set(paths)))
+            for path in ('', 'Makefile', 'arch/arm', 'arch/arm/Makefile', 'arch/arm/boot/dts',
+                         'arch/arm/boot/dts/a.dts', 'dir with space', 'dir with space/f.c'):
+                self.assertIn(path, index)
+            for path in ('arch', 'arch/arm/', 'Makefil', 'Makefile2', 'arch/arm/boot/dts/a'):
+                self.assertNotIn(path, index)
+            index_dir.close()
+
+    def test_generation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(data.read_generation(tmp))
+            data.bump_generation(tmp)
+            generation, index_id = data.read_generation(tmp)
+            self.assertEqual(generation, 1)
+            data.bump_generation(tmp)
+            self.assertEqual(data.read_generation(tmp), (2, index_id))
+
+    def test_autocomplete_index(self):
+        self.assertEqual(data.get_word_starts(b'my_foo_bar'), [0, 3, 7])
+        self.assertEqual(data.get_word_starts(b'getDeviceName'), [0, 3, 9])
+        self.assertEqual(data.get_word_starts(b'vendor%2Cdevice-name'), [0, 7, 9, 16])
+
+        entries = [(b'Foo_bar', 0, 1), (b'foo', 3, 4), (b'foo_baz', 50, 2), (b'foo_qux', 50, 4),
+                   (b'getDeviceName', 2, 4), (b'my_foo_bar', 500, 4), (b'other', 1000, 4), (b'x_FOO', 20, 1)]
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(tmp + '/index', 'wb') as f:
+                f.write(data.AutocompleteIndex.pack(entries))
+            index = data.AutocompleteIndex.open(tmp + '/index')
+            self.assertEqual(list(index.iter()), entries)
+
+            # Prefix matches by decreasing score, then matches of words ignoring case
+            self.assertEqual(index.search(b'foo', 10),
+                             [b'foo_qux', b'foo_baz', b'foo', b'my_foo_bar', b'x_FOO', b'Foo_bar'])
+            self.assertEqual(index.search(b'foo', 2), [b'foo_qux', b'foo_baz'])
+            self.assertEqual(index.search(b'foo_', 10), [b'foo_qux', b'foo_baz', b'my_foo_bar', b'Foo_bar'])
+            self.assertEqual(index.search(b'fo', 10), [b'foo_qux', b'foo_baz', b'foo', b'my_foo_bar',
+                                                        b'x_FOO', b'Foo_bar'])
+            self.assertEqual(index.search(b'bar', 10), [b'my_foo_bar', b'Foo_bar'])
+            self.assertEqual(index.search(b'device', 10), [b'getDeviceName'])
+            self.assertEqual(index.search(b'o', 10), [b'other'])
+            self.assertEqual(index.search(b'z', 10), [])
+            index.close()
+
+            with open(tmp + '/empty', 'wb') as f:
+                f.write(data.AutocompleteIndex.pack([]))
+            index = data.AutocompleteIndex.open(tmp + '/empty')
+            self.assertEqual(index.search(b'foo', 10), [])
+            index.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks that elixir.definitions finds the same definitions in the files of t/tree
+# as the parse-defs command of script.sh, which parses them one at a time
+
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+elixir_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, elixir_dir)
+
+from elixir import definitions, lib
+
+tree_dir = os.path.join(elixir_dir, 't', 'tree')
+script_sh = os.path.join(elixir_dir, 'script.sh')
+
+class DefinitionsTest(unittest.TestCase):
+    def setUp(self):
+        self.repo_dir = tempfile.TemporaryDirectory()
+        subprocess.run(('git', 'init', '-q', '--bare', self.repo_dir.name), check=True)
+
+    def tearDown(self):
+        self.repo_dir.cleanup()
+
+    def script_defs(self, filename, family, code):
+        hash = subprocess.run(('git', '-C', self.repo_dir.name, 'hash-object', '-w', '--stdin'),
+                              input=code, stdout=subprocess.PIPE, check=True).stdout.strip()
+        env = {**os.environ, 'LXR_REPO_DIR': self.repo_dir.name}
+        out = subprocess.run((script_sh, 'parse-defs', hash, filename, family),
+                             stdout=subprocess.PIPE, env=env, check=True).stdout
+        defs = []
+        for l in out.split(b'\n')[:-1]:
+            ident, type, line = l.split(b' ')
+            defs.append((ident, type.decode(), int(line)))
+        return defs
+
+    def check(self, files):
+        defs = [[] for _ in files]
+        for n, ident, type, line in definitions.find_definitions(files):
+            defs[n].append((ident, type, line))
+
+        for (filename, family, code), file_defs in zip(files, defs):
+            with self.subTest(filename=filename):
+                self.assertEqual(sorted(file_defs), sorted(self.script_defs(filename, family, code)))
+
+    def test_tree(self):
+        files = []
+        for root, _, names in os.walk(tree_dir):
+            for name in names:
+                family = lib.getFileFamily(name)
+                if family in (None, 'M'):
+                    continue
+                with open(os.path.join(root, name), 'rb') as f:
+                    files.append((name, family, f.read()))
+
+        self.check(files)
+
+    def test_macros(self):
+        code = (b'ENTRY(entry_asm)\n'
+                b'  ENTRY(indented_entry)\n'
+                b'SYSCALL_DEFINE3(open, const char __user *, filename)\n'
+                b'SYSCALL_DEFINE1(newline_at_end\n'
+                b'SYSCALL_DEFINE0(last')
+        # Same file name in a batch
+        self.check([('entry.S', 'C', code), ('entry.S', 'C', b'ENTRY(other)\n')])
+        self.assertEqual(definitions.find_macro_definitions(code), [
+            (b'entry_asm', 'function', 1),
+            (b'indented_entry', 'function', 2),
+            (b'sys_open', 'function', 3),
+            (b'sys_newline_at_end', 'function', 4),
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks that GitObjectStore answers requests of many objects, and objects
+# that do not exist, and that directories with many entries are listed
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+elixir_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, elixir_dir)
+
+from elixir.lib import GitObjectStore
+from elixir.query import get_tree_listing
+
+# Number of files of the test repository, enough to fill the pipes of git cat-file
+FILES_COUNT = 4000
+
+class GitObjectStoreTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        repo = cls.tmp.name
+        subprocess.run(('git', 'init', '-q', repo), check=True)
+        os.mkdir(os.path.join(repo, 'dir'))
+        for n in range(FILES_COUNT):
+            with open(os.path.join(repo, 'dir', 'file' + str(n)), 'w') as f:
+                f.write('x' * n)
+        os.mkdir(os.path.join(repo, 'links'))
+        for n in range(FILES_COUNT):
+            os.symlink('../dir/file' + str(n), os.path.join(repo, 'links', 'link' + str(n)))
+        with open(os.path.join(repo, 'some file'), 'w') as f:
+            f.write('contents')
+        subprocess.run(('git', '-C', repo, 'add', '.'), check=True)
+        subprocess.run(('git', '-C', repo, '-c', 'user.name=t', '-c', 'user.email=t',
+                        'commit', '-q', '-m', 'files'), check=True)
+        cls.git = GitObjectStore(repo)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.git.close()
+        cls.tmp.cleanup()
+
+    def test_many_objects(self):
+        entries = self.git.get_tree('HEAD:dir')
+        self.assertEqual(len(entries), FILES_COUNT)
+        hashes = [hash for _, _, _, hash in entries]
+        sizes = {name.decode(): size for (_, _, name, _), size
+                 in zip(entries, self.git.get_sizes(hashes))}
+        self.assertEqual(sizes, {'file' + str(n): n for n in range(FILES_COUNT)})
+
+        blobs = self.git.get_blobs(hashes)
+        self.assertEqual(sorted(len(blob) for blob in blobs), list(range(FILES_COUNT)))
+
+    def test_tree_listing(self):
+        listing = get_tree_listing(self.tmp.name, 'HEAD:dir')
+        self.assertEqual(len(listing), FILES_COUNT)
+        self.assertIn(('blob', 'file123', 123, '100644', None), listing)
+
+        listing = get_tree_listing(self.tmp.name, 'HEAD:links')
+        self.assertEqual(len(listing), FILES_COUNT)
+        self.assertIn(('blob', 'link123', 14, '120000', '../dir/file123'), listing)
+
+    def test_missing(self):
+        self.assertEqual(self.git.get_blob('HEAD:some file'), b'contents')
+        self.assertIsNone(self.git.get_blob('HEAD:missing file'))
+        self.assertIsNone(self.git.get_type('HEAD:a missing file'))
+        self.assertEqual(self.git.get_sizes(('HEAD:missing file', 'HEAD:some file')), [None, 8])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks that RenderCache returns stored entries and removes the least
+# recently used ones when it is full
+
+import os
+import sys
+import tempfile
+import unittest
+
+elixir_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, elixir_dir)
+
+from elixir.render_cache import RenderCache
+
+class RenderCacheTest(unittest.TestCase):
+    def test_get_put(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = RenderCache(tmp, 1024*1024)
+            self.assertIsNone(cache.get('a'))
+            cache.put('a', '<pre>é</pre>', {'/include/a.h': True})
+            self.assertEqual(cache.get('a'), ('<pre>é</pre>', {'/include/a.h': True}))
+            cache.put('a', 'new', {})
+            self.assertEqual(cache.get('a'), ('new', {}))
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # Each entry is a bit more than 1000 bytes
+            cache = RenderCache(tmp, 10000)
+            for n in range(9):
+                cache.put(str(n), 'x'*1000, {})
+                # Modification times are used to find least recently used entries
+                os.utime(cache.get_entry_path(str(n)), (n, n))
+            os.utime(cache.get_entry_path('0'), (100, 100))
+
+            cache.put('9', 'x'*1000, {})
+            cache.evict()
+            self.assertIsNotNone(cache.get('0'))
+            self.assertIsNone(cache.get('1'))
+            self.assertIsNone(cache.get('2'))
+            self.assertIsNotNone(cache.get('9'))
+
+if __name__ == '__main__':
+    unittest.main()
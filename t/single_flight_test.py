@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks that SingleFlight computes concurrent calls with the same key once,
+# and that waiting callers compute the result themselves if the first call fails
+
+import os
+import sys
+import threading
+import unittest
+
+elixir_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, elixir_dir)
+
+from elixir.lib import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+    def run_threads(self, flight, key, func, count):
+        results = [None] * count
+        def run(n):
+            try:
+                results[n] = flight.run(key, func)
+            except ValueError as e:
+                results[n] = e
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_coalesce(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        def func():
+            calls.append(1)
+            release.wait()
+            return ['result']
+
+        threads, results = self.run_threads(flight, 'key', func, 8)
+        # Wait for the first call, so that the other threads find it running
+        while not calls:
+            release.wait(0.01)
+        other = flight.run('other', lambda: 'other')
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(other, 'other')
+        self.assertLess(len(calls), 8)
+        self.assertEqual(results, [['result']] * 8)
+        self.assertEqual(flight.calls, {})
+
+    def test_error(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait()
+                raise ValueError('first call fails')
+            return 'result'
+
+        threads, results = self.run_threads(flight, 'key', func, 4)
+        while not calls:
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(isinstance(r, ValueError) for r in results), 1)
+        self.assertEqual(results.count('result'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+#  This file is part of Elixir, a source code cross-referencer.
+#
+#  Elixir is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Elixir is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with Elixir.  If not, see <http://www.gnu.org/licenses/>.
+
+# Checks that elixir.tokenizer splits the files in t/tree exactly like
+# the tokenize-file command of script.sh
+
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+elixir_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, elixir_dir)
+
+from elixir import tokenizer
+
+tree_dir = os.path.join(elixir_dir, 't', 'tree')
+script_sh = os.path.join(elixir_dir, 'script.sh')
+
+class TokenizerTest(unittest.TestCase):
+    def setUp(self):
+        self.repo_dir = tempfile.TemporaryDirectory()
+        subprocess.run(('git', 'init', '-q', '--bare', self.repo_dir.name), check=True)
+
+    def tearDown(self):
+        self.repo_dir.cleanup()
+
+    def script_tokens(self, code, family):
+        hash = subprocess.run(('git', '-C', self.repo_dir.name, 'hash-object', '-w', '--stdin'),
+                              input=code, stdout=subprocess.PIPE, check=True).stdout.strip()
+        env = {**os.environ, 'LXR_REPO_DIR': self.repo_dir.name}
+        out = subprocess.run((script_sh, 'tokenize-file', '-b', hash, family),
+                             stdout=subprocess.PIPE, env=env, check=True).stdout
+        lines = out.split(b'\n')
+        del lines[-1]
+        return [l.replace(b'\1', b'\n') for l in lines]
+
+    def check(self, code, family):
+        self.assertEqual(tokenizer.split_tokens(code, family), self.script_tokens(code, family))
+
+    def test_tree(self):
+        for root, _, files in os.walk(tree_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    code = f.read()
+
+                for family in ('C', 'D', 'K', 'M'):
+                    with self.subTest(path=os.path.relpath(path, tree_dir), family=family):
+                        self.check(code, family)
+
+    def test_edge_cases(self):
+        cases = (
+            b'',
+            b'ident',
+            b'ident\n',
+            b'no_newline_at_end(x)',
+            b'obj-y += foo.o\n',
+            b'#include <linux/i2c.h>\n#include "i2c-core.h"\n',
+            b'/* multi\n line comment */ int a; // comment\nint b;\n',
+            b'char *s = "string \\" with quote";\nchar c = \'"\';\n',
+            b'node-name: label@0 { compatible = "vendor,dev"; };\n',
+        )
+        for code in cases:
+            for family in ('C', 'D'):
+                with self.subTest(code=code, family=family):
+                    self.check(code, family)
+
+    def test_identifiers(self):
+        code = b' int foo;\n/* bar */\nbaz(foo);\n'
+        self.assertEqual(list(tokenizer.iter_identifiers(code, 'C')),
+                         [(b'int', 1), (b'foo', 1), (b'baz', 3), (b'foo', 3)])
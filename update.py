@@ -22,617 +22,546 @@
 # Throughout, an "idx" is the sequential number associated with a blob.
 # This is different from that blob's Git hash.
 
+# Files are parsed by a pool of worker processes, in batches of blobs.
+# Workers don't access the databases: they return what they found to the main
+# process, which is the only one to read and write the databases, one tag at a time.
+
+import os
+import heapq
 from sys import argv
-from threading import Thread, Lock, Event, Condition
+from multiprocessing import Pool
 
 import elixir.lib as lib
 from elixir.lib import script, scriptLines
 import elixir.data as data
+import elixir.tokenizer as tokenizer
+import elixir.definitions as definitions
 from elixir.data import PathList
 from find_compatible_dts import FindCompatibleDTS
 
 verbose = False
 
-dts_comp_support = int(script('dts-comp'))
-
-compatibles_parser = FindCompatibleDTS()
-
-db = data.DB(lib.getDataDir(), readonly=False, shared=True, dtscomp=dts_comp_support)
-
-# Number of cpu threads (+2 for version indexing)
+# Number of worker processes
 cpu = 10
-threads_list = []
-
-hash_file_lock = Lock() # Lock for db.hash and db.file
-blobs_lock = Lock() # Lock for db.blobs
-defs_lock = Lock() # Lock for db.defs
-refs_lock = Lock() # Lock for db.refs
-docs_lock = Lock() # Lock for db.docs
-comps_lock = Lock() # Lock for db.comps
-comps_docs_lock = Lock() # Lock for db.comps_docs
-tag_ready = Condition() # Waiting for new tags
-
-new_idxes = [] # (new idxes, Event idxes ready, Event defs ready, Event comps ready, Event vers ready)
-bindings_idxes = [] # DT bindings documentation files
-idx_key_mod = 1000000
-defs_idxes = {} # Idents definitions stored with (idx*idx_key_mod + line) as the key.
-
-tags_done = False # True if all tags have been added to new_idxes
-
-# Progress variables [tags, finished threads]
-tags_defs = [0, 0]
-tags_defs_lock = Lock()
-tags_refs = [0, 0]
-tags_refs_lock = Lock()
-tags_docs = [0, 0]
-tags_docs_lock = Lock()
-tags_comps = [0, 0]
-tags_comps_lock = Lock()
-tags_comps_docs = [0, 0]
-tags_comps_docs_lock = Lock()
-
-class UpdateIds(Thread):
-    def __init__(self, tag_buf):
-        Thread.__init__(self, name="UpdateIdsElixir")
-        self.tag_buf = tag_buf
-
-    def run(self):
-        global new_idxes, tags_done, tag_ready
-        self.index = 0
 
-        for tag in self.tag_buf:
+# Number of blobs parsed by a worker at once
+batch_size = 50
 
-            new_idxes.append((self.update_blob_ids(tag), Event(), Event(), Event(), Event()))
+# Maximum number of deltas to apply to read the files of a version.
+# 0 to store the files of all versions in full.
+version_deltas = int(os.environ.get('ELIXIR_VERSION_DELTAS', 0))
 
-            progress('ids: ' +  tag.decode() + ': ' + str(len(new_idxes[self.index][0])) +
-                        ' new blobs', self.index+1)
+# Memory used to buffer new definitions, references, etc. before writing them
+# to the databases (in bytes)
+index_memory = int(os.environ.get('ELIXIR_INDEX_MEMORY', 1024)) * 1024 * 1024
 
-            new_idxes[self.index][1].set() # Tell that the tag is ready
+# Number of previous snapshots of the data directory to keep, see data.create_snapshot.
+# 0 to write to the databases of the data directory directly.
+snapshots = int(os.environ.get('ELIXIR_SNAPSHOTS', 0))
 
-            self.index += 1
-
-            # Wake up waiting threads
-            with tag_ready:
-                tag_ready.notify_all()
-
-        tags_done = True
-        progress('ids: Thread finished', self.index)
-
-    def update_blob_ids(self, tag):
+idx_key_mod = 1000000
 
-        global hash_file_lock, blobs_lock
 
+# Worker processes
+
+def init_worker():
+    global git_store, compatibles_parser
+    # Blobs are read through a long-lived git cat-file process
+    git_store = lib.GitObjectStore(lib.getRepoDir(), 1)
+    compatibles_parser = FindCompatibleDTS()
+
+# Returns the lines of a blob, as returned by scriptLines
+def get_blob_lines(hash):
+    lines = git_store.get_blob(hash).split(b'\n')
+    del lines[-1]
+    return lines
+
+# The following functions take a list of (idx, hash, filename) tuples
+
+# Returns a list of (idx, ident, type, line, family) tuples
+def parse_definitions(blobs):
+    files = []
+    for idx, hash, filename in blobs:
+        family = lib.getFileFamily(filename)
+        if family in [None, 'M']: continue
+
+        files.append((idx, filename, family, git_store.get_blob(hash)))
+
+    # ctags is run once for all files of the batch
+    defs = definitions.find_definitions([(filename, family, code)
+                                            for idx, filename, family, code in files])
+    return [(files[n][0], ident, type, line, files[n][2]) for n, ident, type, line in defs]
+
+# Returns a list of (idx, family, {ident: [line, ...]}, TokenList) tuples, for all
+# identifiers that may be references: tokens rejected by lib.isIdent never have
+# definitions, and are only kept in the TokenList. The main process keeps the
+# identifiers that have a definition, and completes the TokenList of each blob.
+def parse_references(blobs):
+    refs = []
+    for idx, hash, filename in blobs:
+        family = lib.getFileFamily(filename)
+        if family == None: continue
+
+        prefix = b''
+        # Kconfig values are saved as CONFIG_<value>
+        if family == 'K':
+            prefix = b'CONFIG_'
+
+        code = git_store.get_blob(hash)
+        tokens = tokenizer.split_tokens(code, family)
+        token_list = data.TokenList(family=family, end=sum(map(len, tokens)))
+        idents = {}
+        for tok, line_num, offset in tokenizer.iter_token_identifiers(tokens):
+            token_list.append(offset, tok)
+            tok = prefix + tok
+
+            # We only index CONFIG_??? in makefiles
+            if lib.isIdent(tok) and (family != 'M' or tok.startswith(b'CONFIG_')):
+                if tok in idents:
+                    idents[tok].append(line_num)
+                else:
+                    idents[tok] = [line_num]
+
+        refs.append((idx, family, idents, token_list))
+    return refs
+
+# Returns a list of (idx, ident, line, family) tuples
+def parse_doc_comments(blobs):
+    docs = []
+    for idx, hash, filename in blobs:
+        family = lib.getFileFamily(filename)
+        if family in [None, 'M']: continue
+
+        lines = scriptLines('parse-docs', hash, filename)
+        for l in lines:
+            ident, line = l.split(b' ')
+            docs.append((idx, ident, int(line.decode()), family))
+    return docs
+
+# Returns a list of (idx, family, {ident: lines}) tuples
+def parse_compatibles(blobs):
+    comps = []
+    for idx, hash, filename in blobs:
+        family = lib.getFileFamily(filename)
+        if family in [None, 'K', 'M']: continue
+
+        lines = compatibles_parser.run(get_blob_lines(hash), family)
+        idents = {}
+        for l in lines:
+            ident, line = l.split(' ')
+
+            if ident in idents:
+                idents[ident] += ',' + str(line)
+            else:
+                idents[ident] = str(line)
+
+        comps.append((idx, family, idents))
+    return comps
+
+# Returns a list of (idx, [(ident, line), ...]) tuples, for DT bindings documentation
+# files. The main process keeps the compatibles that are used in the code.
+def parse_compatibles_bindings(blobs):
+    comps_docs = []
+    for idx, hash, filename in blobs:
+        lines = compatibles_parser.run(get_blob_lines(hash), 'B')
+        comps_docs.append((idx, [l.split(' ') for l in lines]))
+    return comps_docs
+
+
+# Main process
+
+class UpdateTag:
+    def __init__(self, tag):
+        self.tag = tag
+
+    # Registers new blobs and starts parsing them
+    # previous: UpdateTag of the previous new tag, not finished yet, or None
+    def start(self, pool, previous):
+        added, removed = self.list_blobs(previous)
+        self.blobs = self.update_blob_ids(added)
+        progress('ids: ' + self.tag.decode() + ': ' + str(len(self.blobs)) + ' new blobs')
+
+        self.update_manifest(added, removed)
+
+        # DT bindings documentation files
+        bindings_idxes = set(idx for idx, path in self.versions
+                                if path[:33] == b'Documentation/devicetree/bindings')
+
+        # Results of batches are iterated by finish as they arrive, so that they are
+        # added to the buffers and freed instead of being kept for the whole tag
+        batches = [self.blobs[i:i+batch_size] for i in range(0, len(self.blobs), batch_size)]
+        self.defs = pool.imap(parse_definitions, batches, chunksize=1)
+        self.refs = pool.imap(parse_references, batches, chunksize=1)
+        self.docs = pool.imap(parse_doc_comments, batches, chunksize=1)
+        if dts_comp_support:
+            self.comps = pool.imap(parse_compatibles, batches, chunksize=1)
+            bindings = [blob for blob in self.blobs if blob[0] in bindings_idxes]
+            self.comps_docs = pool.apply_async(parse_compatibles_bindings, (bindings,))
+
+    # Writes results of the workers to the databases
+    def finish(self):
+        defs_idxes = self.update_definitions(self.defs)
+        self.update_references(self.refs, defs_idxes)
+        self.update_doc_comments(self.docs)
+        if dts_comp_support:
+            self.update_compatibles(self.comps)
+            self.update_compatibles_bindings(self.comps_docs.get())
+
+        # The version is added last, so that it is only visible once it is complete
+        db.sync()
+        self.update_versions()
+        update_latest_tags()
+        update_versions_tree()
+        # Tell readers to reopen the databases
+        data.bump_generation(db.dir)
+
+    # Finds the closest previous tag that is indexed, or being indexed if it is previous.
+    # Sets self.base to this tag, or None, and self.base_versions to its files.
+    def find_base(self, previous):
+        self.base = None
+        self.base_depth = 0
+
+        pos = all_tags.index(self.tag)
+        for tag in reversed(all_tags[:pos]):
+            if previous is not None and tag == previous.tag:
+                self.base = tag
+                self.base_versions = previous.versions
+                self.base_depth = previous.depth
+                return
+            elif db.vers.exists(tag):
+                self.base = tag
+                self.base_versions = [(idx, path.encode()) for idx, path in db.vers.get(tag).iter()]
+                self.base_depth = db.vers.get_depth(tag)
+                return
+
+    # Lists the files of the version, as differences with its base if there is one,
+    # so that unchanged files are not listed again.
+    # Returns a list of (hash, path) tuples for added files and a set of removed paths.
+    def list_blobs(self, previous):
+        self.find_base(previous)
+
+        added = []
+        removed = set()
+        if self.base is None:
+            for blob in scriptLines('list-blobs', '-p', self.tag):
+                hash, path = blob.split(b' ', maxsplit=1)
+                added.append((hash, path))
+        else:
+            for line in scriptLines('diff-blobs', self.base, self.tag):
+                info, path = line.split(b'\t', maxsplit=1)
+                old_mode, new_mode, old_hash, new_hash, status = info[1:].split(b' ')
+                # Missing files have a null mode, submodules are not indexed
+                if old_mode not in (b'000000', b'160000'):
+                    removed.add(path)
+                if new_mode not in (b'000000', b'160000'):
+                    added.append((new_hash, path))
+
+        return added, removed
+
+    # Registers blobs of added files that are not known yet
+    # Returns a list of (idx, hash, filename) tuples for new blobs
+    def update_blob_ids(self, added):
         if db.vars.exists('numBlobs'):
             idx = db.vars.get('numBlobs')
         else:
             idx = 0
 
-        # Get blob hashes and associated file names (without path)
-        blobs = scriptLines('list-blobs', '-f', tag)
-
-        new_idxes = []
-        for blob in blobs:
-            hash, filename = blob.split(b' ',maxsplit=1)
-            with blobs_lock:
-                blob_exist = db.blob.exists(hash)
-                if not blob_exist:
-                    db.blob.put(hash, idx)
-
-            if not blob_exist:
-                with hash_file_lock:
-                    db.hash.put(idx, hash)
-                    db.file.put(idx, filename)
+        new_blobs = []
+        for hash, path in added:
+            # File name without path
+            filename = path.rsplit(b'/', maxsplit=1)[-1]
+            if not db.blob.exists(hash):
+                db.blob.put(hash, idx)
+                db.hash.put(idx, hash)
+                db.file.put(idx, filename)
 
-                new_idxes.append(idx)
+                new_blobs.append((idx, hash, filename.decode()))
                 if verbose:
                     print(f"New blob #{idx} {hash}:{filename}")
                 idx += 1
         db.vars.put('numBlobs', idx)
-        return new_idxes
-
-
-class UpdateVersions(Thread):
-    def __init__(self, tag_buf):
-        Thread.__init__(self, name="UpdateVersionsElixir")
-        self.tag_buf = tag_buf
-
-    def run(self):
-        global new_idxes, tag_ready
-
-        index = 0
-
-        while index < len(self.tag_buf):
-            if index >= len(new_idxes):
-                # Wait for new tags
-                with tag_ready:
-                    tag_ready.wait()
-                continue
-
-            tag = self.tag_buf[index]
-
-            new_idxes[index][1].wait() # Make sure the tag is ready
-
-            self.update_versions(tag)
-
-            new_idxes[index][4].set() # Tell that UpdateVersions processed the tag
-
-            progress('vers: ' + tag.decode() + ' done', index+1)
-
-            index += 1
-
-        progress('vers: Thread finished', index)
-
-    def update_versions(self, tag):
-        global blobs_lock
-
-        # Get blob hashes and associated file paths
-        blobs = scriptLines('list-blobs', '-p', tag)
-        buf = []
-
-        for blob in blobs:
-            hash, path = blob.split(b' ', maxsplit=1)
-            with blobs_lock:
-                idx = db.blob.get(hash)
-            buf.append((idx, path))
-
-        buf = sorted(buf)
-        obj = PathList()
-        for idx, path in buf:
-            obj.append(idx, path)
-
-            # Store DT bindings documentation files to parse them later
-            if path[:33] == b'Documentation/devicetree/bindings':
-                bindings_idxes.append(idx)
+        return new_blobs
 
-            if verbose:
-                print(f"Tag {tag}: adding #{idx} {path}")
-        db.vers.put(tag, obj, sync=True)
+    # Computes the files of the version, as sorted (idx, path) tuples
+    def update_manifest(self, added, removed):
+        self.added = sorted((db.blob.get(hash), path) for hash, path in added)
 
+        if self.base is None:
+            self.removed = []
+            self.versions = self.added
+        else:
+            self.removed = []
+            self.versions = []
+            for entry in self.base_versions:
+                if entry[1] in removed:
+                    self.removed.append(entry)
+                else:
+                    self.versions.append(entry)
+            self.versions = list(heapq.merge(self.versions, self.added))
 
-def generate_defs_caches():
-    for key in db.defs.get_keys():
-        value = db.defs.get(key)
-        for family in ['C', 'K', 'D', 'M']:
-            if (lib.compatibleFamily(value.get_families(), family) or
-                        lib.compatibleMacro(value.get_macros(), family)):
-                db.defs_cache[family].put(key, b'')
-
-
-class UpdateDefs(Thread):
-    def __init__(self, start, inc):
-        Thread.__init__(self, name="UpdateDefsElixir")
-        self.index = start
-        self.inc = inc # Equivalent to the number of defs threads
-
-    def run(self):
-        global new_idxes, tags_done, tag_ready, tags_defs, tags_defs_lock
-
-        while not (tags_done and self.index >= len(new_idxes)):
-            if self.index >= len(new_idxes):
-                # Wait for new tags
-                with tag_ready:
-                    tag_ready.wait()
-                continue
-
-            new_idxes[self.index][1].wait() # Make sure the tag is ready
-
-            with tags_defs_lock:
-                tags_defs[0] += 1
-
-            self.update_definitions(new_idxes[self.index][0])
-
-            new_idxes[self.index][2].set() # Tell that UpdateDefs processed the tag
-
-            self.index += self.inc
-
-        with tags_defs_lock:
-            tags_defs[1] += 1
-            progress('defs: Thread ' + str(tags_defs[1]) + '/' + str(self.inc) + ' finished', tags_defs[0])
-
-
-    def update_definitions(self, idxes):
-        global hash_file_lock, defs_lock, tags_defs
-
-        for idx in idxes:
-            if idx % 1000 == 0: progress('defs: ' + str(idx), tags_defs[0])
-
-            with hash_file_lock:
-                hash = db.hash.get(idx)
-                filename = db.file.get(idx)
-
-            family = lib.getFileFamily(filename)
-            if family in [None, 'M']: continue
-
-            lines = scriptLines('parse-defs', hash, filename, family)
-
-            with defs_lock:
-                for l in lines:
-                    ident, type, line = l.split(b' ')
-                    type = type.decode()
-                    line = int(line.decode())
-
-                    defs_idxes[idx*idx_key_mod + line] = ident
+        # Store the version as a delta if allowed and smaller
+        if (self.base is not None and self.base_depth < version_deltas and
+                len(self.added) + len(self.removed) < len(self.versions) // 2):
+            self.depth = self.base_depth + 1
+        else:
+            self.depth = 0
+
+    def update_versions(self):
+        if self.depth > 0:
+            obj = data.PathListDelta(base=self.base, depth=self.depth)
+            for idx, path in self.removed:
+                obj.removed.append(idx, path)
+            for idx, path in self.added:
+                obj.added.append(idx, path)
+        else:
+            obj = PathList()
+            for idx, path in self.versions:
+                obj.append(idx, path)
+
+        blob_set = data.BlobSet()
+        for idx, path in self.versions:
+            blob_set.append(idx, path)
+
+        if verbose:
+            for idx, path in self.versions:
+                print(f"Tag {self.tag}: adding #{idx} {path}")
+        db.vers_paths.put(self.tag, data.get_indexed_paths(self.versions))
+        db.vers_blobs.put(self.tag, blob_set, sync=True)
+        db.vers.put(self.tag, obj, sync=True)
+        progress('vers: ' + self.tag.decode() + ' done')
+
+    # Returns idents definitions stored with (idx*idx_key_mod + line) as the key
+    def update_definitions(self, results):
+        defs_idxes = {}
+
+        for defs in results:
+            for idx, ident, type, line, family in defs:
+                defs_idxes[idx*idx_key_mod + line] = ident
+
+                if not (lib.isIdent(ident) or db.defs.exists(ident)):
+                    continue
+
+                defs_buf.append(ident, idx, type, line, family)
+                if verbose:
+                    print(f"def {type} {ident} in #{idx} @ {line}")
+
+        idents = defs_buf.flush()
+        data.update_defs_caches(db, idents)
+        autocomplete_keys['definitions'].update(idents)
+        progress('defs: ' + self.tag.decode() + ': ' + str(len(idents)) + ' identifiers')
+        return defs_idxes
+
+    def update_references(self, results, defs_idxes):
+        # family -> definitions cache generation of family
+        generations = {family: data.get_defs_cache_generation(db, family)
+                       for family in lib.CACHED_DEFINITIONS_FAMILIES}
+        # (family, ident) -> 1 if ident is in the definitions cache of family
+        in_defs_cache = {}
+
+        for refs in results:
+            for idx, family, idents, token_list in refs:
+                prefix = b'CONFIG_' if family == 'K' else b''
+                for n, tok in enumerate(token_list.get_idents()):
+                    key = (family, tok)
+                    if key not in in_defs_cache:
+                        in_defs_cache[key] = int(db.defs_cache[family].exists(prefix + tok))
+                    token_list.defined[n] = in_defs_cache[key]
+                token_list.generation = generations[family]
+                db.tokens.put(idx, token_list)
 
-                    if db.defs.exists(ident):
-                        obj = db.defs.get(ident)
-                    elif lib.isIdent(ident):
-                        obj = data.DefList()
-                    else:
+                for ident, lines in idents.items():
+                    if not db.defs.exists(ident):
                         continue
 
-                    obj.append(idx, type, line, family)
-                    if verbose:
-                        print(f"def {type} {ident} in #{idx} @ {line}")
-                    db.defs.put(ident, obj)
-
-        generate_defs_caches()
-
-
-class UpdateRefs(Thread):
-    def __init__(self, start, inc):
-        Thread.__init__(self, name="UpdateRefsElixir")
-        self.index = start
-        self.inc = inc # Equivalent to the number of refs threads
-
-    def run(self):
-        global new_idxes, tags_done, tags_refs, tags_refs_lock
-
-        while not (tags_done and self.index >= len(new_idxes)):
-            if self.index >= len(new_idxes):
-                # Wait for new tags
-                with tag_ready:
-                    tag_ready.wait()
-                continue
-
-            new_idxes[self.index][1].wait() # Make sure the tag is ready
-            new_idxes[self.index][2].wait() # Make sure UpdateDefs processed the tag
-
-            with tags_refs_lock:
-                tags_refs[0] += 1
-
-            self.update_references(new_idxes[self.index][0])
-
-            self.index += self.inc
-
-        with tags_refs_lock:
-            tags_refs[1] += 1
-            progress('refs: Thread ' + str(tags_refs[1]) + '/' + str(self.inc) + ' finished', tags_refs[0])
-
-    def update_references(self, idxes):
-        global hash_file_lock, defs_lock, refs_lock, tags_refs
-
-        for idx in idxes:
-            if idx % 1000 == 0: progress('refs: ' + str(idx), tags_refs[0])
-
-            with hash_file_lock:
-                hash = db.hash.get(idx)
-                filename = db.file.get(idx)
-
-            family = lib.getFileFamily(filename)
-            if family == None: continue
-
-            prefix = b''
-            # Kconfig values are saved as CONFIG_<value>
-            if family == 'K':
-                prefix = b'CONFIG_'
-
-            tokens = scriptLines('tokenize-file', '-b', hash, family)
-            even = True
-            line_num = 1
-            idents = {}
-            with defs_lock:
-                for tok in tokens:
-                    even = not even
-                    if even:
-                        tok = prefix + tok
-
-                        if (db.defs.exists(tok) and
-                            not ( (idx*idx_key_mod + line_num) in defs_idxes and
-                                defs_idxes[idx*idx_key_mod + line_num] == tok ) and
-                            (family != 'M' or tok.startswith(b'CONFIG_'))):
-                            # We only index CONFIG_??? in makefiles
-                            if tok in idents:
-                                idents[tok] += ',' + str(line_num)
-                            else:
-                                idents[tok] = str(line_num)
-
-                    else:
-                        line_num += tok.count(b'\1')
-
-            with refs_lock:
-                for ident, lines in idents.items():
-                    if db.refs.exists(ident):
-                        obj = db.refs.get(ident)
-                    else:
-                        obj = data.RefList()
+                    # Lines where ident is defined are not references
+                    lines = [str(line_num) for line_num in lines
+                                if defs_idxes.get(idx*idx_key_mod + line_num) != ident]
+                    if not lines:
+                        continue
 
-                    obj.append(idx, lines, family)
+                    lines = ','.join(lines)
+                    refs_buf.append(ident, idx, lines, family)
                     if verbose:
                         print(f"ref: {ident} in #{idx} @ {lines}")
-                    db.refs.put(ident, obj)
-
-
-class UpdateDocs(Thread):
-    def __init__(self, start, inc):
-        Thread.__init__(self, name="UpdateDocsElixir")
-        self.index = start
-        self.inc = inc # Equivalent to the number of docs threads
-
-    def run(self):
-        global new_idxes, tags_done, tags_docs, tags_docs_lock
-
-        while not (tags_done and self.index >= len(new_idxes)):
-            if self.index >= len(new_idxes):
-                # Wait for new tags
-                with tag_ready:
-                    tag_ready.wait()
-                continue
-
-            new_idxes[self.index][1].wait() # Make sure the tag is ready
-
-            with tags_docs_lock:
-                tags_docs[0] += 1
-
-            self.update_doc_comments(new_idxes[self.index][0])
-
-            self.index += self.inc
-
-        with tags_docs_lock:
-            tags_docs[1] += 1
-            progress('docs: Thread ' + str(tags_docs[1]) + '/' + str(self.inc) + ' finished', tags_docs[0])
-
-    def update_doc_comments(self, idxes):
-        global hash_file_lock, docs_lock, tags_docs
-
-        for idx in idxes:
-            if idx % 1000 == 0: progress('docs: ' + str(idx), tags_docs[0])
-
-            with hash_file_lock:
-                hash = db.hash.get(idx)
-                filename = db.file.get(idx)
-
-            family = lib.getFileFamily(filename)
-            if family in [None, 'M']: continue
-
-            lines = scriptLines('parse-docs', hash, filename)
-            with docs_lock:
-                for l in lines:
-                    ident, line = l.split(b' ')
-                    line = int(line.decode())
-
-                    if db.docs.exists(ident):
-                        obj = db.docs.get(ident)
-                    else:
-                        obj = data.RefList()
-
-                    obj.append(idx, str(line), family)
-                    if verbose:
-                        print(f"doc: {ident} in #{idx} @ {line}")
-                    db.docs.put(ident, obj)
-
 
-class UpdateComps(Thread):
-    def __init__(self, start, inc):
-        Thread.__init__(self, name="UpdateCompsElixir")
-        self.index = start
-        self.inc = inc # Equivalent to the number of comps threads
+        idents = refs_buf.flush()
+        autocomplete_keys['definitions'].update(idents)
+        progress('refs: ' + self.tag.decode() + ': ' + str(len(idents)) + ' identifiers')
 
-    def run(self):
-        global new_idxes, tags_done, tags_comps, tags_comps_lock
-
-        while not (tags_done and self.index >= len(new_idxes)):
-            if self.index >= len(new_idxes):
-                # Wait for new tags
-                with tag_ready:
-                    tag_ready.wait()
-                continue
-
-            new_idxes[self.index][1].wait() # Make sure the tag is ready
-
-            with tags_comps_lock:
-                tags_comps[0] += 1
-
-            self.update_compatibles(new_idxes[self.index][0])
-
-            new_idxes[self.index][3].set() # Tell that UpdateComps processed the tag
-
-            self.index += self.inc
-
-        with tags_comps_lock:
-            tags_comps[1] += 1
-            progress('comps: Thread ' + str(tags_comps[1]) + '/' + str(self.inc) + ' finished', tags_comps[0])
-
-    def update_compatibles(self, idxes):
-        global hash_file_lock, comps_lock, tags_comps
-
-        for idx in idxes:
-            if idx % 1000 == 0: progress('comps: ' + str(idx), tags_comps[0])
-
-            with hash_file_lock:
-                hash = db.hash.get(idx)
-                filename = db.file.get(idx)
-
-            family = lib.getFileFamily(filename)
-            if family in [None, 'K', 'M']: continue
-
-            lines = compatibles_parser.run(scriptLines('get-blob', hash), family)
-            comps = {}
-            for l in lines:
-                ident, line = l.split(' ')
-
-                if ident in comps:
-                    comps[ident] += ',' + str(line)
-                else:
-                    comps[ident] = str(line)
+    def update_doc_comments(self, results):
+        for docs in results:
+            for idx, ident, line, family in docs:
+                docs_buf.append(ident, idx, str(line), family)
+                if verbose:
+                    print(f"doc: {ident} in #{idx} @ {line}")
 
-            with comps_lock:
-                for ident, lines in comps.items():
-                    if db.comps.exists(ident):
-                        obj = db.comps.get(ident)
-                    else:
-                        obj = data.RefList()
+        idents = docs_buf.flush()
+        progress('docs: ' + self.tag.decode() + ': ' + str(len(idents)) + ' identifiers')
 
-                    obj.append(idx, lines, family)
+    def update_compatibles(self, results):
+        for comps in results:
+            for idx, family, idents in comps:
+                for ident, lines in idents.items():
+                    comps_buf.append(ident, idx, lines, family)
                     if verbose:
-                        print(f"comps: {ident} in #{idx} @ {line}")
-                    db.comps.put(ident, obj)
+                        print(f"comps: {ident} in #{idx} @ {lines}")
 
+        idents = comps_buf.flush()
+        autocomplete_keys['compatibledts'].update(idents)
+        progress('comps: ' + self.tag.decode() + ': ' + str(len(idents)) + ' identifiers')
 
-class UpdateCompsDocs(Thread):
-    def __init__(self, start, inc):
-        Thread.__init__(self, name="UpdateCompsDocsElixir")
-        self.index = start
-        self.inc = inc # Equivalent to the number of comps_docs threads
-
-    def run(self):
-        global new_idxes, tags_done, tags_comps_docs, tags_comps_docs_lock
-
-        while not (tags_done and self.index >= len(new_idxes)):
-            if self.index >= len(new_idxes):
-                # Wait for new tags
-                with tag_ready:
-                    tag_ready.wait()
-                continue
-
-            new_idxes[self.index][1].wait() # Make sure the tag is ready
-            new_idxes[self.index][3].wait() # Make sure UpdateComps processed the tag
-            new_idxes[self.index][4].wait() # Make sure UpdateVersions processed the tag
-
-            with tags_comps_docs_lock:
-                tags_comps_docs[0] += 1
-
-            self.update_compatibles_bindings(new_idxes[self.index][0])
-
-            self.index += self.inc
-
-        with tags_comps_docs_lock:
-            tags_comps_docs[1] += 1
-            progress('comps_docs: Thread ' + str(tags_comps_docs[1]) + '/' + str(self.inc) + ' finished', tags_comps_docs[0])
-
-    def update_compatibles_bindings(self, idxes):
-        global hash_file_lock, comps_lock, comps_docs_lock, tags_comps_docs, bindings_idxes
-
-        for idx in idxes:
-            if idx % 1000 == 0: progress('comps_docs: ' + str(idx), tags_comps_docs[0])
-
-            if not idx in bindings_idxes: # Parse only bindings doc files
-                continue
-
-            with hash_file_lock:
-                hash = db.hash.get(idx)
-
-            family = 'B'
-            lines = compatibles_parser.run(scriptLines('get-blob', hash), family)
+    def update_compatibles_bindings(self, results):
+        for idx, lines in results:
             comps_docs = {}
-            with comps_lock:
-                for l in lines:
-                    ident, line = l.split(' ')
-
-                    if db.comps.exists(ident):
-                        if ident in comps_docs:
-                            comps_docs[ident] += ',' + str(line)
-                        else:
-                            comps_docs[ident] = str(line)
-
-            with comps_docs_lock:
-                for ident, lines in comps_docs.items():
-                    if db.comps_docs.exists(ident):
-                        obj = db.comps_docs.get(ident)
+            for ident, line in lines:
+                if db.comps.exists(ident):
+                    if ident in comps_docs:
+                        comps_docs[ident] += ',' + str(line)
                     else:
-                        obj = data.RefList()
+                        comps_docs[ident] = str(line)
 
-                    obj.append(idx, lines, family)
-                    if verbose:
-                        print(f"comps_docs: {ident} in #{idx} @ {line}")
-                    db.comps_docs.put(ident, obj)
-
-
-def progress(msg, current):
-    print('{} - {} ({:.1%})'.format(project, msg, current/num_tags))
+            for ident, lines in comps_docs.items():
+                comps_docs_buf.append(ident, idx, lines, 'B')
+                if verbose:
+                    print(f"comps_docs: {ident} in #{idx} @ {lines}")
+
+        idents = comps_docs_buf.flush()
+        progress('comps_docs: ' + self.tag.decode() + ': ' + str(len(idents)) + ' identifiers')
+
+
+# Returns True if files created by update.py are missing from the index in data_dir,
+# created by an older version of Elixir. They are created by the backward-compatibility
+# steps run when there are no new tags.
+def is_incomplete(data_dir, dtscomp):
+    db = data.DB(data_dir, readonly=True, dtscomp=dtscomp)
+    incomplete = (db.defs_cache['C'].db.stat()['nkeys'] == 0 or
+                  len(db.autocomplete) != len(data.get_autocomplete_names(db)) or
+                  data.read_latest_tags(data_dir) != find_latest_tags(db) or
+                  data.read_versions_tree(data_dir) != data.find_versions_tree(db, tags_tree))
+    db.close()
+    return incomplete
+
+# Returns the latest tags indexed in db, as returned by data.read_latest_tags
+def find_latest_tags(db):
+    latest = data.find_latest_tag(db, sorted_latest_tags)
+    latest_rc = data.find_latest_tag(db, list(reversed(all_tags)))
+    return latest.decode(), latest_rc.decode()
+
+# Stores the latest indexed tags if they changed, see data.write_latest_tags
+# Returns True if they were written
+def update_latest_tags():
+    latest_tags = find_latest_tags(db)
+    if data.read_latest_tags(db.dir) == latest_tags:
+        return False
+    data.write_latest_tags(db.dir, *latest_tags)
+    return True
+
+# Stores the tree of indexed versions if it changed, see data.write_versions_tree
+# Returns True if it was written
+def update_versions_tree():
+    tree = data.find_versions_tree(db, tags_tree)
+    if data.read_versions_tree(db.dir) == tree:
+        return False
+    data.write_versions_tree(db.dir, tree)
+    return True
+
+def progress(msg):
+    print('{} - {} ({:.1%})'.format(project, msg, tags_done/num_tags))
 
 
 # Main
 
-# Check number of threads arg
-if len(argv) >= 2 and argv[1].isdigit() :
-    cpu = int(argv[1])
-
-    if cpu < 5 :
-        cpu = 5
-
-# Distribute threads among functions using the following rules :
-# There are more (or equal) refs threads than others
-# There are more (or equal) defs threads than docs or comps threads
-# Example : if cpu=6 : defs=1, refs=2, docs=1, comps=1, comps_docs=1
-#           if cpu=7 : defs=2, refs=2, docs=1, comps=1, comps_docs=1
-#           if cpu=8 : defs=2, refs=3, docs=1, comps=1, comps_docs=1
-#           if cpu=11: defs=2, refs=3, docs=2, comps=2, comps_docs=2
-quo, rem = divmod(cpu, 5)
-num_th_refs = quo
-num_th_defs = quo
-num_th_docs = quo
-
-# If DT bindings support is enabled, use $quo threads for each of the 2 threads
-# Otherwise add them to the remaining threads
-if dts_comp_support:
-    num_th_comps = quo
-    num_th_comps_docs = quo
-else :
-    num_th_comps = 0
-    num_th_comps_docs = 0
-    rem += 2*quo
-
-quo, rem = divmod(rem, 2)
-num_th_defs += quo
-num_th_refs += quo + rem
-
-tag_buf = []
-for tag in scriptLines('list-tags'):
-    if not db.vers.exists(tag):
-        tag_buf.append(tag)
-
-num_tags = len(tag_buf)
-project = lib.currentProject()
-
-print(project + ' - found ' + str(num_tags) + ' new tags')
-
-if not num_tags:
-    # Backward-compatibility: generate defs caches if they are empty.
-    if db.defs_cache['C'].db.stat()['nkeys'] == 0:
-        generate_defs_caches()
-    exit(0)
-
-threads_list.append(UpdateIds(tag_buf))
-threads_list.append(UpdateVersions(tag_buf))
-
-# Define defs threads
-for i in range(num_th_defs):
-    threads_list.append(UpdateDefs(i, num_th_defs))
-# Define refs threads
-for i in range(num_th_refs):
-    threads_list.append(UpdateRefs(i, num_th_refs))
-# Define docs threads
-for i in range(num_th_docs):
-    threads_list.append(UpdateDocs(i, num_th_docs))
-# Define comps threads
-for i in range(num_th_comps):
-    threads_list.append(UpdateComps(i, num_th_comps))
-# Define comps_docs threads
-for i in range(num_th_comps_docs):
-    threads_list.append(UpdateCompsDocs(i, num_th_comps_docs))
-
-
-# Start to process tags
-threads_list[0].start()
-
-# Wait until the first tag is ready
-with tag_ready:
-    tag_ready.wait()
-
-# Start remaining threads
-for i in range(1, len(threads_list)):
-    threads_list[i].start()
-
-# Make sure all threads finished
-for i in range(len(threads_list)):
-    threads_list[i].join()
+if __name__ == "__main__":
+    # Check number of processes arg
+    if len(argv) >= 2 and argv[1].isdigit() :
+        cpu = max(int(argv[1]), 1)
+
+    dts_comp_support = int(script('dts-comp'))
+    data_dir = lib.getDataDir()
+    all_tags = scriptLines('list-tags')
+    sorted_latest_tags = scriptLines('get-latest-tags')
+    tags_tree = scriptLines('list-tags', '-h')
+
+    if snapshots:
+        # Only copy the databases if there are new tags, or files to create for
+        # indexes of older versions of Elixir
+        vers_filename = os.path.join(data_dir, 'versions.db')
+        if os.path.exists(vers_filename):
+            vers = data.VersionsDB(vers_filename, True)
+            new_tags = [tag for tag in all_tags if not vers.exists(tag)]
+            vers.close()
+            if len(new_tags) == 0 and not is_incomplete(data_dir, dts_comp_support):
+                print(lib.currentProject() + ' - found 0 new tags')
+                exit(0)
+
+        snapshot = data.create_snapshot(data_dir)
+
+    # Workers are started before opening the databases, so that they don't inherit them
+    pool = Pool(cpu, initializer=init_worker)
+
+    db = data.DB(snapshot if snapshots else data_dir, readonly=False, dtscomp=dts_comp_support)
+
+    defs_buf = data.PostingsBuffer(db.defs, index_memory // 5)
+    refs_buf = data.PostingsBuffer(db.refs, index_memory // 5)
+    docs_buf = data.PostingsBuffer(db.docs, index_memory // 5)
+    if dts_comp_support:
+        comps_buf = data.PostingsBuffer(db.comps, index_memory // 5)
+        comps_docs_buf = data.PostingsBuffer(db.comps_docs, index_memory // 5)
+
+    # Keys to update in the autocomplete indexes, see data.update_autocomplete_indexes
+    autocomplete_keys = {'definitions': set(), 'compatibledts': set()}
+
+    tag_buf = []
+    for tag in all_tags:
+        if not db.vers.exists(tag):
+            tag_buf.append(tag)
+
+    num_tags = len(tag_buf)
+    tags_done = 0
+    project = lib.currentProject()
+
+    print(project + ' - found ' + str(num_tags) + ' new tags')
+
+    if not num_tags:
+        # Backward-compatibility: generate defs caches if they are empty.
+        if db.defs_cache['C'].db.stat()['nkeys'] == 0:
+            data.generate_defs_caches(db)
+        # Backward-compatibility: generate autocomplete indexes if they are missing
+        if data.update_autocomplete_indexes(db, autocomplete_keys):
+            data.bump_generation(db.dir)
+        # Backward-compatibility: store the latest tags and versions if they are missing.
+        # They are also updated if a previous run was interrupted.
+        changed = update_latest_tags()
+        changed = update_versions_tree() or changed
+        if changed:
+            data.bump_generation(db.dir)
+        pool.terminate()
+        db.close()
+        if snapshots:
+            data.publish_snapshot(data_dir, snapshot, snapshots)
+        exit(0)
+
+    # Workers parse the blobs of the next tag while the results of
+    # the previous one are written
+    previous = None
+    for tag in tag_buf:
+        current = UpdateTag(tag)
+        current.start(pool, previous)
+        if previous is not None:
+            previous.finish()
+            tags_done += 1
+        previous = current
+
+    previous.finish()
+    tags_done += 1
+
+    pool.close()
+    pool.join()
+
+    # Autocomplete indexes are updated once for all new tags
+    data.update_autocomplete_indexes(db, autocomplete_keys)
+    data.bump_generation(db.dir)
+    db.close()
+
+    if snapshots:
+        data.publish_snapshot(data_dir, snapshot, snapshots)
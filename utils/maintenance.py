@@ -0,0 +1,86 @@
+import os
+from elixir import data
+from elixir import lib
+
+# Rewrites values of db stored in the legacy text format in the binary format
+def migrate_db(db, name):
+    converted = 0
+    for key in db.get_keys():
+        value = db.db.get(key)
+        if not (data.is_binary(value) or data.is_delta(value)):
+            db.put(key, db.ctype(value).pack())
+            converted += 1
+
+    db.db.sync()
+    print(f"{name}: {converted} values converted")
+
+# Creates the missing BlobSet values of versions
+def generate_blob_sets(db):
+    created = 0
+    for version in db.vers.get_keys():
+        if not db.vers_blobs.exists(version):
+            blob_set = data.BlobSet()
+            for id, path in db.vers.get(version).iter():
+                blob_set.append(id, path.encode())
+            db.vers_blobs.put(version, blob_set)
+            created += 1
+
+    db.vers_blobs.db.sync()
+    print(f"versions-blobs: {created} values created")
+
+# Creates the missing path indexes of versions
+def generate_path_indexes(db):
+    created = 0
+    for version in db.vers.get_keys():
+        if not db.vers_paths.exists(version):
+            db.vers_paths.put(version, data.get_indexed_paths(db.vers.get(version).iter()))
+            created += 1
+
+    print(f"versions-paths: {created} indexes created")
+
+def cmd_migrate(data_dir, **kwargs):
+    dtscomp = os.path.exists(data_dir + '/compatibledts.db')
+    db = data.DB(data_dir, readonly=False, dtscomp=dtscomp)
+
+    migrate_db(db.vers, "versions")
+    generate_blob_sets(db)
+    generate_path_indexes(db)
+    migrate_db(db.defs, "definitions")
+    migrate_db(db.refs, "references")
+    migrate_db(db.docs, "doccomments")
+    if dtscomp:
+        migrate_db(db.comps, "compatibledts")
+        migrate_db(db.comps_docs, "compatibledts_docs")
+    data.update_autocomplete_indexes(db, {})
+
+    db.close()
+    data.bump_generation(data_dir)
+
+def cmd_rebuild_defs_caches(data_dir, **kwargs):
+    db = data.DB(data_dir, readonly=False)
+    for family in lib.CACHED_DEFINITIONS_FAMILIES:
+        db.defs_cache[family].db.truncate()
+
+    data.generate_defs_caches(db)
+    for family in lib.CACHED_DEFINITIONS_FAMILIES:
+        print(f"definitions-cache-{family}: {len(db.defs_cache[family])} identifiers")
+
+    db.close()
+    data.bump_generation(data_dir)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    migrate_subparser = subparsers.add_parser('migrate',
+        help="Convert definitions, references and versions to the binary format, and create missing versions blob sets and path indexes")
+    migrate_subparser.set_defaults(func=cmd_migrate, data_dir=lib.getDataDir())
+
+    rebuild_subparser = subparsers.add_parser('rebuild-defs-caches',
+        help="Regenerate the definitions caches from the definitions database")
+    rebuild_subparser.set_defaults(func=cmd_rebuild_defs_caches, data_dir=lib.getDataDir())
+
+    args = parser.parse_args()
+    args.func(**vars(args))